@@ -0,0 +1,334 @@
+import argparse
+import contextlib
+import gc
+import glob
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import layout
+from browser import DEFAULT_STYLE_SHEET, WIDTH
+from css import style, CSSParser, RuleIndex, cascade_priority
+from html_parser import HTMLParser
+from traversal import pre_order
+
+STAGES = ['parse', 'style', 'layout', 'paint']
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+# A stage only counts as a regression when it is this much slower than the baseline
+DEFAULT_THRESHOLD = 0.25
+
+WORDS = (
+  "the quick brown fox jumps over lazy dog browser engine layout style paint parse token tree node text "
+  "element block inline line word font size weight cascade selector rule sheet document render pixel"
+).split()
+ENTITIES = ["&amp;", "&lt;", "&gt;", "&quot;", "&nbsp;", "&copy;", "&eacute;", "&#8212;", "&#x2019;", "&hellip;"]
+INLINE_TAGS = ["b", "i", "small", "big", "a", "span", "sup"]
+BLOCK_TAGS = ["div", "section", "article", "blockquote", "ul", "li"]
+COLORS = ["black", "blue", "red", "green", "gray"]
+
+# Synthetic documents, each varying one thing from the "base" case
+SYNTHETIC = {
+  "base": {},
+  "large": {"paragraphs": 2000},
+  "deep": {"depth": 60},
+  "entities": {"entity_density": 0.3},
+  "rules": {"rules": 500},
+  "deep_rules": {"depth": 60, "rules": 500},
+  "pre": {"pre_blocks": 50},
+}
+
+
+class StubFont:
+  # Measures every character as the same fraction of the font size, so layout costs what it does in the
+  # browser minus the font engine, and runs without a display or any font files
+  def __init__(self, size, weight, style):
+    self.key = (size, weight, style)
+    ascent, descent = round(size * 0.8), round(size * 0.2)
+    self.font_metrics = {"ascent": ascent, "descent": descent, "linespace": ascent + descent,
+                         "fixed": int("fixed_width" in style)}
+    self.advance = size * (0.65 if weight == "bold" else 0.6)
+
+  def measure(self, text):
+    return round(len(text) * self.advance)
+
+  def metrics(self, *options):
+    if options:
+      return self.font_metrics[options[0]]
+    return dict(self.font_metrics)
+
+
+def font_backend(name):
+  if name == "stub":
+    return StubFont
+  elif name == "pillow":
+    from headless import HeadlessFont
+    return HeadlessFont
+  # "tk" measures with real Tk fonts, which needs a display (e.g. Xvfb)
+  return None
+
+
+def generate_words(rng, count, entity_density):
+  words = []
+  for _ in range(count):
+    if rng.random() < entity_density:
+      words.append(rng.choice(ENTITIES))
+    else:
+      words.append(rng.choice(WORDS))
+  return " ".join(words)
+
+
+def generate_paragraph(rng, entity_density):
+  parts = []
+  for _ in range(rng.randint(3, 8)):
+    text = generate_words(rng, rng.randint(4, 12), entity_density)
+    if rng.random() < 0.3:
+      tag = rng.choice(INLINE_TAGS)
+      parts.append(f"<{tag}>{text}</{tag}>")
+    else:
+      parts.append(text)
+  attributes = f' class="c{rng.randrange(10)}"' if rng.random() < 0.5 else ""
+  return f"<p{attributes}>{' '.join(parts)}</p>"
+
+
+def generate_pre(rng):
+  lines = [f"  {rng.choice(WORDS)}({rng.choice(WORDS)}, {rng.randrange(100)}) &lt;= {rng.choice(WORDS)}"
+           for _ in range(rng.randint(5, 20))]
+  return "<pre>" + "\n".join(lines) + "</pre>"
+
+
+def generate_document(paragraphs=200, depth=4, entity_density=0.02, pre_blocks=2, seed=0):
+  # The same arguments always give the same document, so timings compare across runs
+  rng = random.Random(seed)
+  blocks = [generate_paragraph(rng, entity_density) for _ in range(paragraphs)]
+  for _ in range(pre_blocks):
+    blocks.insert(rng.randrange(len(blocks) + 1), generate_pre(rng))
+
+  # Spread the blocks over a run of sections nested depth deep
+  sections = []
+  per_section = max(1, len(blocks) // 10)
+  for start in range(0, len(blocks), per_section):
+    tags = [rng.choice(BLOCK_TAGS) for _ in range(depth)]
+    opening = "".join(f"<{tag}>" for tag in tags)
+    closing = "".join(f"</{tag}>" for tag in reversed(tags))
+    sections.append(opening + "\n".join(blocks[start:start + per_section]) + closing)
+  return ("<!doctype html><html><head><title>Synthetic document</title></head><body>"
+          + "\n".join(sections) + "</body></html>")
+
+
+def generate_stylesheet(rules=20, seed=0):
+  rng = random.Random(seed)
+  lines = []
+  for _ in range(rules):
+    tags = [rng.choice(BLOCK_TAGS + INLINE_TAGS + ["p", "pre"]) for _ in range(rng.randint(1, 3))]
+    if rng.random() < 0.5:
+      declaration = f"color: {rng.choice(COLORS)};"
+    else:
+      declaration = f"font-size: {rng.choice([90, 100, 110, 120])}%;"
+    lines.append(f"{' '.join(tags)} {{ {declaration} }}")
+  return "\n".join(lines)
+
+
+def synthetic_cases(names=None):
+  cases = {}
+  for name, params in SYNTHETIC.items():
+    if names and name not in names:
+      continue
+    params = dict(params)
+    rules = params.pop("rules", 20)
+    cases[f"synthetic/{name}"] = (generate_document(**params), generate_stylesheet(rules))
+  return cases
+
+
+def corpus_cases(directory=CORPUS_DIR):
+  cases = {}
+  for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+    with open(path, encoding="utf-8") as f:
+      body = f.read()
+    # A page's own stylesheet sits next to it with the same name, if it has one
+    css_path = path[:-len(".html")] + ".css"
+    stylesheet = ""
+    if os.path.exists(css_path):
+      with open(css_path, encoding="utf-8") as f:
+        stylesheet = f.read()
+    cases[f"corpus/{os.path.basename(path)}"] = (body, stylesheet)
+  return cases
+
+
+def count_nodes(node):
+  return sum(1 for _ in pre_order(node))
+
+
+def run_pipeline(body, rules, width=WIDTH, timings=None):
+  # Runs every stage once, recording how long each took in timings
+  def stage(name, f):
+    start = time.perf_counter()
+    result = f()
+    if timings is not None:
+      timings[name] = time.perf_counter() - start
+    return result
+
+  nodes = stage('parse', lambda: HTMLParser(body).parse())
+  stage('style', lambda: style(nodes, rules))
+  document = layout.DocumentLayout(nodes, width)
+  stage('layout', document.layout)
+  display_list = []
+  stage('paint', lambda: layout.paint_tree(document, display_list))
+  return nodes, display_list
+
+
+def peak_memory(body, rules, width=WIDTH):
+  # Peak Python allocations in each stage, from a separate run since tracing slows everything down
+  peaks = {}
+  tracemalloc.start()
+  try:
+    def measure(name, f):
+      tracemalloc.reset_peak()
+      base = tracemalloc.get_traced_memory()[0]
+      result = f()
+      peaks[name] = tracemalloc.get_traced_memory()[1] - base
+      return result
+
+    nodes = measure('parse', lambda: HTMLParser(body).parse())
+    measure('style', lambda: style(nodes, rules))
+    document = layout.DocumentLayout(nodes, width)
+    measure('layout', document.layout)
+    measure('paint', lambda: layout.paint_tree(document, []))
+  finally:
+    tracemalloc.stop()
+  return peaks
+
+
+def run_case(body, stylesheet, repeat=5, width=WIDTH, memory=True):
+  # The CSS parser prints every declaration it skips, which would bury the results
+  with contextlib.redirect_stdout(io.StringIO()):
+    rules = RuleIndex(sorted(DEFAULT_STYLE_SHEET + CSSParser(stylesheet).parse(), key=cascade_priority))
+  best = {}
+  nodes, display_list = None, []
+  try:
+    for _ in range(repeat):
+      timings = {}
+      # Collections triggered by an earlier run's garbage would otherwise land in a random stage
+      gc.collect()
+      nodes, display_list = run_pipeline(body, rules, width, timings)
+      for name, seconds in timings.items():
+        best[name] = min(best.get(name, seconds), seconds)
+  except RecursionError as e:
+    return {"error": f"RecursionError: {e}"}
+
+  node_count = count_nodes(nodes)
+  size = len(body.encode("utf-8"))
+  result = {
+    "bytes": size,
+    "nodes": node_count,
+    "commands": len(display_list),
+    "seconds": best,
+    # Parsing is measured against the input size, everything after it against the tree it built
+    "throughput": {
+      name: (size if name == 'parse' else node_count) / seconds if seconds else None
+      for name, seconds in best.items()
+    },
+  }
+  if memory:
+    result["peak_memory"] = peak_memory(body, rules, width)
+  return result
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+  # Returns (case, stage, baseline seconds, current seconds) for every stage more than threshold slower
+  regressions = []
+  for case, result in results.items():
+    old = baseline.get(case)
+    if not old or "seconds" not in old or "seconds" not in result:
+      continue
+    for name, seconds in result["seconds"].items():
+      before = old["seconds"].get(name)
+      if before and seconds > before * (1 + threshold):
+        regressions.append((case, name, before, seconds))
+  return regressions
+
+
+def load_baseline(path=BASELINE_FILE):
+  try:
+    with open(path) as f:
+      return json.load(f)["results"]
+  except (OSError, ValueError, KeyError):
+    return None
+
+
+def save_baseline(results, path=BASELINE_FILE):
+  with open(path, "w") as f:
+    json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f,
+              indent=2, sort_keys=True)
+
+
+def format_result(case, result):
+  if "error" in result:
+    return f"{case:32} {result['error']}"
+  parts = [f"{case:32} {result['bytes'] / 1024:8.1f} KiB {result['nodes']:7} nodes"]
+  for name in STAGES:
+    seconds = result["seconds"][name]
+    memory = result.get("peak_memory", {}).get(name)
+    part = f"{name} {seconds * 1000:8.2f} ms"
+    if memory is not None:
+      part += f" {memory / 1024 / 1024:6.1f} MiB"
+    parts.append(part)
+  parse_rate = result["throughput"]["parse"]
+  if parse_rate:
+    parts.append(f"{parse_rate / 1024 / 1024:6.2f} MB/s parsed")
+  return " | ".join(parts)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time parse, style, layout and paint on synthetic and real pages")
+  parser.add_argument("--cases", nargs="*", help=f"Synthetic cases to run (default: all of {', '.join(SYNTHETIC)})")
+  parser.add_argument("--corpus", default=CORPUS_DIR, help="Directory of .html pages to run as well")
+  parser.add_argument("--no-corpus", action="store_true", help="Only run the synthetic documents")
+  parser.add_argument("--repeat", type=int, default=5, help="Runs per case; the fastest one counts")
+  parser.add_argument("--width", type=int, default=WIDTH, help="Page width in pixels")
+  parser.add_argument("--fonts", choices=["stub", "pillow", "tk"], default="stub",
+                      help="Font backend for layout; tk needs a display, e.g. under Xvfb")
+  parser.add_argument("--no-memory", action="store_true", help="Skip the peak memory runs")
+  parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline file to compare against or save to")
+  parser.add_argument("--save-baseline", action="store_true", help="Save these results as the new baseline")
+  parser.add_argument("--allow-missing-baseline", action="store_true",
+                      help="Succeed when there is no baseline to compare against, rather than fail")
+  parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                      help="Fail when a stage is this fraction slower than the baseline")
+  parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+  args = parser.parse_args()
+  layout.set_font_backend(font_backend(args.fonts))
+  cases = synthetic_cases(args.cases)
+  if not args.no_corpus:
+    cases.update(corpus_cases(args.corpus))
+
+  results = {}
+  for case, (body, stylesheet) in cases.items():
+    results[case] = run_case(body, stylesheet, args.repeat, args.width, not args.no_memory)
+    if not args.json:
+      print(format_result(case, results[case]), file=sys.stderr)
+  if args.json:
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+  if args.save_baseline:
+    save_baseline(results, args.baseline)
+    print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+    sys.exit(0)
+  baseline = load_baseline(args.baseline)
+  if baseline is None:
+    # Timings depend on the machine, so there is no baseline in the repo; a run that checks nothing must not
+    # pass for one that found no regressions
+    print(f"No baseline to compare against at {args.baseline}; run with --save-baseline to make one",
+          file=sys.stderr)
+    sys.exit(0 if args.allow_missing_baseline else 1)
+  regressions = compare(results, baseline, args.threshold)
+  for case, name, before, seconds in regressions:
+    print(f"REGRESSION {case} {name}: {before * 1000:.2f} ms -> {seconds * 1000:.2f} ms "
+          f"({seconds / before - 1:+.0%})", file=sys.stderr)
+  sys.exit(1 if regressions else 0)
@@ -1,20 +1,48 @@
 import tkinter as tk
 import argparse
+import itertools
+import json
+import time
 
-from css import style, CSSParser, cascade_priority
-from url import URL
+from css import style, restyle, CSSParser, RuleIndex, cascade_priority
+from url import URL, cache, resolver
+from disk_cache import DiskCacheStore
+from fetch import fetch_all
+from preload import Preloader
+from timing import observers
 from layout import paint_tree, DocumentLayout, VSTEP, SCROLLBAR_WIDTH
 from html_parser import HTMLParser, Element
+from dom_index import DocumentIndex
+from snapshot_cache import SnapshotCache, DOMSnapshot, apply_styles, copy_dom, body_digest, style_key, layout_key
+from traversal import pre_order
 
 WIDTH, HEIGHT = 800, 600
 SCROLL_STEP = 100
-DEFAULT_STYLE_SHEET = CSSParser(open("browser.css").read()).parse()
+# Paint what has been parsed once this much of the page has arrived, then again each time the total doubles
+PROGRESSIVE_PAINT_CHARS = 4096
+# A page that has all arrived within this many seconds is looked up in the snapshot cache before it is parsed;
+# one still arriving after that is parsed as it comes, so its first paint isn't held up
+SNAPSHOT_LOOKAHEAD = 0.05
+# Send same-origin stylesheet requests back-to-back on one connection; off by default since some servers
+# mishandle pipelined requests
+PIPELINE_STYLESHEETS = False
+DEFAULT_STYLE_SHEET_TEXT = open("browser.css").read()
+DEFAULT_STYLE_SHEET = CSSParser(DEFAULT_STYLE_SHEET_TEXT).parse()
+DEFAULT_RULES = RuleIndex(sorted(DEFAULT_STYLE_SHEET, key=cascade_priority))
+# Parsed, styled and laid out pages, shared by every tab
+snapshots = SnapshotCache()
+
+
+def stylesheet_rules(stylesheets):
+  # The first stylesheet is always the default one, which is only parsed once
+  rules = DEFAULT_STYLE_SHEET.copy()
+  for text in stylesheets[1:]:
+    rules.extend(CSSParser(text).parse())
+  return RuleIndex(sorted(rules, key=cascade_priority))
 
 
 def tree_to_list(tree, lst):
-  lst.append(tree)
-  for child in tree.children:
-    tree_to_list(child, lst)
+  lst.extend(pre_order(tree))
   return lst
 
 
@@ -26,6 +54,16 @@ class Browser:
     self.display_list = []
     self.scroll = 0
     self.document = None
+    self.index = DocumentIndex()
+    # The cached DOMSnapshot that self.nodes belongs to, which other tabs may be showing too; None once the tree
+    # is this tab's own
+    self.snapshot = None
+    # Identifies the page and stylesheets that self.nodes were styled with, once they are final
+    self.style_key = None
+    # The page's stylesheet texts, default first, and their rules once something needed them
+    self.stylesheets = [DEFAULT_STYLE_SHEET_TEXT]
+    self.rules = None
+    self.timings = []
 
     self.window = tk.Tk()
     self.canvas = tk.Canvas(
@@ -64,11 +102,48 @@ class Browser:
     self.scroll = max(0, self.scroll - SCROLL_STEP)
     self.draw()
 
+  def own_nodes(self):
+    # Returns the tree to change in place. One from the snapshot cache may be on other tabs as well, so the
+    # first change copies it, styles and all, and leaves the cached one as it was parsed.
+    if self.snapshot is not None:
+      copy = copy_dom(self.snapshot)
+      apply_styles(copy.root, [node.style for node in pre_order(self.nodes)])
+      self.nodes, self.index = copy.root, copy.index
+      self.snapshot = None
+      # The copy is about to stop matching the body and stylesheets it was cached under
+      self.style_key = None
+    return self.nodes
+
+  def restyle(self):
+    # Call after changing elements of own_nodes() in place; only what changed is styled again
+    if not self.nodes:
+      return
+    self.own_nodes()
+    if self.rules is None:
+      self.rules = stylesheet_rules(self.stylesheets)
+    restyle(self.nodes, self.rules)
+    self.redraw()
+
+  def set_stylesheets(self, stylesheets):
+    self.stylesheets = [DEFAULT_STYLE_SHEET_TEXT] + stylesheets
+    self.rules = None
+    if self.nodes:
+      self.own_nodes().mark_subtree_dirty()
+    self.restyle()
+
   def redraw(self):
-    self.document = DocumentLayout(self.nodes, self.screen_width)
-    self.document.layout()
-    self.display_list = []
-    paint_tree(self.document, self.display_list)
+    key = layout_key(self.style_key, self.screen_width) if self.style_key else None
+    snapshot = snapshots.get_layout(key) if key else None
+    if snapshot:
+      self.document = snapshot
+      self.display_list = snapshot.display_list
+    else:
+      self.document = DocumentLayout(self.nodes, self.screen_width)
+      self.document.layout()
+      self.display_list = []
+      paint_tree(self.document, self.display_list)
+      if key:
+        snapshots.put_layout(key, self.document.height, self.display_list)
     self.draw()
 
   def resize(self, e):
@@ -101,39 +176,157 @@ class Browser:
 
     self.canvas.create_rectangle(x0, y0, x1, y1, fill="blue")
 
-  def load(self, url: URL, num_redirects: int = 0):
-    body = url.request(num_redirects)
-    if body:
-      if url.view_source:
-        parser = HTMLParser('')
-        parser.add_element("pre")
-        for word in body.split(' '):
-          parser.add_text(word + " ")
-        self.nodes = parser.finish()
-      else:
-        self.nodes = HTMLParser(body).parse()
+  def preresolve(self, base: URL, node: Element):
+    # Relative links stay on the page's own host, which is already resolved; only absolute ones can be new
+    href = node.attributes.get("href", "")
+    if "://" in href or href.startswith("//"):
+      target = base.resolve(href)
+      if not target.is_malformed and target.scheme in ['http', 'https']:
+        resolver.preresolve(target.host, target.port)
+
+  def parse_progressively(self, url: URL, body, preloader: Preloader):
+    parser = HTMLParser('', on_element=lambda node: self.preresolve(url, node))
+    self.index = parser.index
+    received = 0
+    next_paint = PROGRESSIVE_PAINT_CHARS
+    for chunk in body:
+      # The scanner runs ahead of the parser so stylesheet fetches are already underway while it builds the tree
+      preloader.feed(chunk)
+      parser.feed(chunk)
+      received += len(chunk)
+      if received >= next_paint and parser.partial_tree():
+        # Page stylesheets haven't been fetched yet, so early paints only use the default one
+        self.nodes = parser.partial_tree()
+        style(self.nodes, DEFAULT_RULES)
+        self.redraw()
+        self.window.update()
+        next_paint = received * 2
+    return parser.finish()
 
-    rules = DEFAULT_STYLE_SHEET.copy()
-    links = [node.attributes['href'] for node in tree_to_list(self.nodes, []) if isinstance(node, Element) \
-             and node.tag == "link" and node.attributes.get("rel") == "stylesheet" and "href" in node.attributes]
-    for link in links:
-      style_url = url.resolve(link)
+  def parse_cached(self, url: URL, body, preloader: Preloader):
+    # Returns the page's key and DOMSnapshot. The body is hashed as it arrives; if it all arrives within
+    # SNAPSHOT_LOOKAHEAD (from the HTTP cache, a file, a data: URL or a fast server), its snapshot is looked up
+    # before anything is parsed. Otherwise it is parsed as it streams in and stored for next time.
+    digest = body_digest()
+    buffered = []
+    deadline = time.perf_counter() + SNAPSHOT_LOOKAHEAD
+    body = iter(body)
+    for chunk in body:
+      digest.update(chunk.encode('utf-8'))
+      buffered.append(chunk)
+      if time.perf_counter() > deadline:
+        break
+    else:
+      key = digest.hexdigest()
+      snapshot = snapshots.get_dom(key)
+      if snapshot:
+        for chunk in buffered:
+          preloader.feed(chunk)
+        return key, snapshot
+      nodes = self.parse_progressively(url, buffered, preloader)
+      return key, snapshots.put_dom(key, nodes, self.index)
+
+    def hashed():
+      for chunk in body:
+        digest.update(chunk.encode('utf-8'))
+        yield chunk
+
+    nodes = self.parse_progressively(url, itertools.chain(buffered, hashed()), preloader)
+    key = digest.hexdigest()
+    return key, snapshots.put_dom(key, nodes, self.index)
+
+  def apply_stylesheets(self, snapshot: DOMSnapshot, key, stylesheets):
+    if snapshot.styled_with == key:
+      return
+    if snapshot.styled_with is not None:
+      # Another tab shows this tree with other stylesheets; restyling it would change that tab's page
+      snapshot = copy_dom(snapshot)
+      self.nodes, self.index = snapshot.root, snapshot.index
+      self.snapshot = None
+    styles = snapshots.get_styles(key)
+    if styles:
+      apply_styles(self.nodes, styles)
+    else:
+      self.rules = stylesheet_rules(stylesheets)
+      style(self.nodes, self.rules)
+      snapshots.put_styles(key, self.nodes)
+    snapshot.styled_with = key
+
+  def load(self, url: URL, num_redirects: int = 0):
+    # Every request made for the page, stylesheets included, ends up in self.timings
+    with observers.collect() as self.timings:
+      self.style_key = None
+      self.rules = None
+      self.snapshot = None
+      body = url.stream(num_redirects)
+      preloader = Preloader(url)
       try:
-        body = style_url.request()
-      except Exception as e:
-        print(e)
-        continue
-      rules.extend(CSSParser(body).parse())
-    style(self.nodes, sorted(rules, key=cascade_priority))
-    self.redraw()
+        snapshot = None
+        if body is not None:
+          if url.view_source:
+            parser = HTMLParser('')
+            self.index = parser.index
+            parser.add_element("pre")
+            for word in ''.join(body).split(' '):
+              parser.add_text(word + " ")
+            self.nodes = parser.finish()
+          else:
+            key, snapshot = self.parse_cached(url, body, preloader)
+            self.nodes, self.index = snapshot.root, snapshot.index
+            self.snapshot = snapshot
+
+        stylesheets = [DEFAULT_STYLE_SHEET_TEXT]
+        links = [node.attributes['href'] for node in self.index.get_elements_by_tag("link")
+                 if node.attributes.get("rel") == "stylesheet" and "href" in node.attributes]
+        # Pick up whatever the preload scanner already started and only fetch the rest now
+        preloads = [preloader.take(link) for link in links]
+        missing = [url.resolve(link) for link, preload in zip(links, preloads) if preload is None]
+        fetched = iter(fetch_all(missing, pipeline=PIPELINE_STYLESHEETS))
+        for preload in preloads:
+          if preload is None:
+            body = next(fetched)
+          else:
+            try:
+              body = preload.result()
+            except Exception as e:
+              body = e
+          if isinstance(body, Exception):
+            print(body)
+            continue
+          if body:
+            stylesheets.append(body)
+      finally:
+        # Stops the scanner's fetch thread even when the page fails to load
+        preloader.close()
+      self.stylesheets = stylesheets
+      if snapshot:
+        self.style_key = style_key(key, stylesheets)
+        self.apply_stylesheets(snapshot, self.style_key, stylesheets)
+      else:
+        self.rules = stylesheet_rules(stylesheets)
+        style(self.nodes, self.rules)
+      self.redraw()
 
 
 if __name__ == "__main__":
   TEST_FILE = 'file://localhost/Users/christalee/Documents/software/projects/browser.engineering/example.html'
   parser = argparse.ArgumentParser()
   parser.add_argument("url", help="URL(s) to open", nargs="*", default=[TEST_FILE])
+  parser.add_argument("--cache-dir", help="Directory to keep a persistent HTTP cache in")
+  parser.add_argument("--pipeline", action="store_true", help="Pipeline same-origin stylesheet requests")
+  parser.add_argument("--timings", action="store_true", help="Print a JSON timing record for every request")
+  parser.add_argument("--snapshot-dir", help="Directory to keep parsed, styled and laid out pages in")
 
   args = parser.parse_args()
+  PIPELINE_STYLESHEETS = args.pipeline
+  if args.cache_dir:
+    cache.disk = DiskCacheStore(args.cache_dir)
+  if args.snapshot_dir:
+    snapshots = SnapshotCache(directory=args.snapshot_dir)
   for url in args.url:
-    Browser().load(URL(url))
+    browser = Browser()
+    browser.load(URL(url))
+    if args.timings:
+      for record in browser.timings:
+        print(json.dumps(record.as_dict()))
   tk.mainloop()
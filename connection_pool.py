@@ -0,0 +1,120 @@
+import socket
+import ssl
+import select
+import threading
+import time
+
+MAX_CONNECTIONS_PER_HOST = 6
+IDLE_TIMEOUT = 30
+
+
+def is_alive(s):
+  # An idle keep-alive socket should have nothing to read; EOF or stray bytes both mean it can't be reused
+  if s.fileno() == -1:
+    return False
+  if isinstance(s, ssl.SSLSocket):
+    # SSL sockets refuse recv flags, so fall back to asking whether the raw socket is readable
+    if s.pending():
+      return False
+    readable, _, _ = select.select([s], [], [], 0)
+    return not readable
+  try:
+    s.setblocking(False)
+    s.recv(1, socket.MSG_PEEK)
+    return False
+  except BlockingIOError:
+    return True
+  except OSError:
+    return False
+  finally:
+    if s.fileno() != -1:
+      s.setblocking(True)
+
+
+class PooledConnection:
+  def __init__(self, s):
+    self.socket = s
+    self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+  def __init__(self, max_per_host: int = MAX_CONNECTIONS_PER_HOST, idle_timeout: float = IDLE_TIMEOUT):
+    self.max_per_host = max_per_host
+    self.idle_timeout = idle_timeout
+    self.idle = {}
+    self.active = {}
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Condition()
+
+  def stats(self):
+    with self.lock:
+      return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "idle": sum(len(conns) for conns in self.idle.values()),
+        "active": sum(self.active.values()),
+      }
+
+  def checkout(self, key, opener):
+    with self.lock:
+      self.evict_idle()
+      while True:
+        conns = self.idle.get(key, [])
+        while conns:
+          conn = conns.pop()
+          if is_alive(conn.socket):
+            self.hits += 1
+            self.active[key] = self.active.get(key, 0) + 1
+            return conn.socket, True
+          conn.socket.close()
+        if self.active.get(key, 0) < self.max_per_host:
+          break
+        self.lock.wait()
+      self.misses += 1
+      self.active[key] = self.active.get(key, 0) + 1
+
+    try:
+      return opener(), False
+    except Exception:
+      self.release(key)
+      raise
+
+  def checkin(self, key, s):
+    with self.lock:
+      self.idle.setdefault(key, []).append(PooledConnection(s))
+      self.release(key)
+
+  def discard(self, key, s):
+    s.close()
+    with self.lock:
+      self.release(key)
+
+  def release(self, key):
+    with self.lock:
+      self.active[key] -= 1
+      if not self.active[key]:
+        del self.active[key]
+      self.lock.notify_all()
+
+  def evict_idle(self):
+    now = time.monotonic()
+    with self.lock:
+      for key in list(self.idle):
+        fresh = []
+        for conn in self.idle[key]:
+          if now - conn.last_used < self.idle_timeout:
+            fresh.append(conn)
+          else:
+            conn.socket.close()
+        if fresh:
+          self.idle[key] = fresh
+        else:
+          del self.idle[key]
+
+  def close_all(self):
+    with self.lock:
+      for conns in self.idle.values():
+        for conn in conns:
+          conn.socket.close()
+      self.idle = {}
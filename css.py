@@ -1,4 +1,8 @@
-from html_parser import Element
+from collections import OrderedDict
+from types import MappingProxyType
+
+from html_parser import Element, Text, EMPTY_STYLE, CLEAN, STYLE_DIRTY, CHILDREN_DIRTY, SUBTREE_DIRTY
+from traversal import enter_exit, ENTER, EXIT
 
 INHERITED_PROPERTIES = {
   "font-size": "16px",
@@ -6,36 +10,254 @@ INHERITED_PROPERTIES = {
   "font-weight": "normal",
   "color": "black",
 }
+# Distinct computed styles, shared read-only by all the nodes that have them. Only the most recently used are
+# kept, so a long-running process doesn't hold on to every style it has ever seen.
+COMPUTED_STYLES = OrderedDict()
+COMPUTED_STYLES_MAX_ENTRIES = 4096
+# The ancestor path of a node with no parent
+NO_PATH = -1
+# Counters in the ancestor filter; more means fewer ancestor walks that turn out to be for nothing
+ANCESTOR_FILTER_SIZE = 1024
+
+
+class RuleIndex:
+  # Buckets a stylesheet's rules by the tag their selector's rightmost part needs, so each node only tests the
+  # rules that could apply to it. Rules that can't be bucketed by tag go in every bucket. Every bucket keeps
+  # the rules in the order they were given, which is cascade order once they're sorted by cascade_priority.
+  def __init__(self, rules):
+    self.rules = list(rules)
+    self.universal = []
+    self.by_tag = {}
+    for rule in self.rules:
+      tag = rightmost_tag(rule[0])
+      if tag is None:
+        self.universal.append(rule)
+        for bucket in self.by_tag.values():
+          bucket.append(rule)
+      else:
+        self.by_tag.setdefault(tag, list(self.universal)).append(rule)
+
+  def __len__(self):
+    return len(self.rules)
+
+  def __iter__(self):
+    return iter(self.rules)
+
+  def candidates(self, node):
+    if isinstance(node, Element):
+      return self.by_tag.get(node.tag, self.universal)
+    return self.universal
+
+
+def rightmost_tag(selector):
+  while isinstance(selector, DescendantSelector):
+    selector = selector.descendant
+  if isinstance(selector, TagSelector):
+    return selector.tag
+  return None
+
+
+class FilterStats:
+  # How often the ancestor filter settled a descendant selector on its own, and how often the selector still
+  # had to walk up the tree; walks that find nothing are the filter's false positives
+  def __init__(self):
+    self.rejected = 0
+    self.walked = 0
+    self.false_positives = 0
+
+  def reset(self):
+    self.rejected = self.walked = self.false_positives = 0
 
+  def as_dict(self):
+    return {"rejected": self.rejected, "walked": self.walked, "false_positives": self.false_positives}
 
-def style(node, rules):
-  node.style = {}
+
+filter_stats = FilterStats()
+
+
+class AncestorFilter:
+  # A counting Bloom filter over the tags of the node being styled's ancestors. Each tag bumps two counters;
+  # a tag whose counters aren't both set is certainly not an ancestor, while one whose counters are set
+  # probably is. Counting, rather than setting bits, lets a tag be removed again on the way back up.
+  def __init__(self, size: int = None):
+    size = size or ANCESTOR_FILTER_SIZE
+    self.counts = [0] * size
+    self.size = size
+
+  def slots(self, tag):
+    h = hash(tag)
+    return h % self.size, (h >> 16) % self.size
+
+  def push(self, tag):
+    first, second = self.slots(tag)
+    self.counts[first] += 1
+    self.counts[second] += 1
+
+  def pop(self, tag):
+    first, second = self.slots(tag)
+    self.counts[first] -= 1
+    self.counts[second] -= 1
+
+  def may_contain(self, tag):
+    first, second = self.slots(tag)
+    return self.counts[first] > 0 and self.counts[second] > 0
+
+
+def style(tree, rules):
+  # rules is a sorted rule list, or a RuleIndex built from one so a stylesheet used again isn't indexed again
+  if not isinstance(rules, RuleIndex):
+    rules = RuleIndex(rules)
+  ancestors = ancestor_filter(tree)
+  # Every distinct sequence of ancestor tags gets a number, built up one tag at a time from the parent's
+  paths = {}
+  path = NO_PATH
+  above = []
+  node = tree.parent
+  while node:
+    above.append(node.tag)
+    node = node.parent
+  for tag in reversed(above):
+    path = paths.setdefault((path, tag), len(paths))
+  open_paths = [path]
+
+  # Tag selectors only look at a node's tag and its ancestors' tags, so two nodes with the same tag, the same
+  # ancestor tags and the same parent style end up with the same style: the second one just reuses it. Rules
+  # in the universal bucket might look at anything else, so nothing is shared while there are any.
+  shared = {}
+  sharing = not rules.universal
+  # Parents are entered before their children, so every node can inherit from an already styled parent, and
+  # the filter holds exactly the elements entered but not yet exited
+  for node, entering in enter_exit(tree):
+    if entering:
+      key = sharing_key(node, open_paths[-1]) if sharing else None
+      if key in shared:
+        node.style = shared[key]
+      else:
+        style_node(node, rules.candidates(node), ancestors)
+        if key:
+          shared[key] = node.style
+      if isinstance(node, Element):
+        node.dirty = CLEAN
+        ancestors.push(node.tag)
+        open_paths.append(paths.setdefault((open_paths[-1], node.tag), len(paths)))
+    elif isinstance(node, Element):
+      ancestors.pop(node.tag)
+      open_paths.pop()
+
+
+# How much of a node restyle() has to redo because of what happened above it
+KEEP = 0
+# Its parent's inherited values changed
+INHERITED = 1
+# Everything above it is being styled from scratch
+EVERYTHING = 2
+
+
+def restyle(tree, rules):
+  # Styles again only what the dirty bits say has changed since tree was last styled. A dirty element is
+  # styled again; its children only follow if that changed a value they inherit, or if they are dirty
+  # themselves. Subtrees with nothing dirty in them are never visited.
+  if not isinstance(rules, RuleIndex):
+    rules = RuleIndex(rules)
+  ancestors = ancestor_filter(tree)
+  stack = [(tree, KEEP, ENTER)]
+  while stack:
+    node, reason, entering = stack.pop()
+    if not entering:
+      ancestors.pop(node.tag)
+      continue
+    if isinstance(node, Text):
+      # Text has no dirty bits; new text is recognizable by never having been styled
+      if reason != KEEP or node.style is EMPTY_STYLE:
+        style_node(node, rules.candidates(node), ancestors)
+      continue
+
+    dirty = node.dirty
+    node.dirty = CLEAN
+    changed = False
+    if reason != KEEP or dirty & (STYLE_DIRTY | SUBTREE_DIRTY):
+      before = node.style
+      style_node(node, rules.candidates(node), ancestors)
+      changed = any(before.get(prop) != node.style[prop] for prop in INHERITED_PROPERTIES)
+
+    if reason == EVERYTHING or dirty & SUBTREE_DIRTY:
+      child_reason = EVERYTHING
+    elif changed:
+      child_reason = INHERITED
+    elif dirty & CHILDREN_DIRTY:
+      child_reason = KEEP
+    else:
+      continue
+    ancestors.push(node.tag)
+    stack.append((node, reason, EXIT))
+    for child in reversed(node.children):
+      # Clean elements only need a visit if there is something to redo
+      if child_reason != KEEP or isinstance(child, Text) or child.dirty:
+        stack.append((child, child_reason, ENTER))
+
+
+def ancestor_filter(tree):
+  # Styling part of a tree starts with the ancestors above it already in the filter
+  ancestors = AncestorFilter()
+  node = tree.parent
+  while node:
+    ancestors.push(node.tag)
+    node = node.parent
+  return ancestors
+
+
+def sharing_key(node, path):
+  # Everything that decides a node's style, or None if it has an inline style of its own. The parent keeps its
+  # style for the rest of the style() call, so the style can stand in by its id.
+  parent_style = id(node.parent.style) if node.parent else None
+  if not isinstance(node, Element):
+    return path, parent_style, "#text"
+  attributes = node.attributes
+  if "style" in attributes:
+    return None
+  return path, parent_style, node.tag, attributes.get("id"), attributes.get("class")
+
+
+def intern_style(computed):
+  # Properties are always filled in the same order, inherited ones first and then in cascade order, so equal
+  # styles nearly always have their items in the same order too
+  key = tuple(computed.items())
+  if key in COMPUTED_STYLES:
+    COMPUTED_STYLES.move_to_end(key)
+    return COMPUTED_STYLES[key]
+  COMPUTED_STYLES[key] = MappingProxyType(computed)
+  # Nodes keep a style that has been evicted; only new nodes stop sharing it
+  while len(COMPUTED_STYLES) > COMPUTED_STYLES_MAX_ENTRIES:
+    COMPUTED_STYLES.popitem(last=False)
+  return COMPUTED_STYLES[key]
+
+
+def style_node(node, rules, ancestors: AncestorFilter = None):
+  computed = {}
   for prop, default in INHERITED_PROPERTIES.items():
     if node.parent:
-      node.style[prop] = node.parent.style[prop]
+      computed[prop] = node.parent.style[prop]
     else:
-      node.style[prop] = default
+      computed[prop] = default
   for selector, body in rules:
-    if not selector.matches(node):
+    if not selector.matches(node, ancestors):
       continue
     for prop, value in body.items():
-      node.style[prop] = value
+      computed[prop] = value
   if isinstance(node, Element) and "style" in node.attributes:
     pairs = CSSParser(node.attributes['style']).body()
     for prop, value in pairs.items():
-      node.style[prop] = value
+      computed[prop] = value
 
-  if node.style['font-size'].endswith("%"):
+  if computed['font-size'].endswith("%"):
     if node.parent:
       parent_font_size = node.parent.style["font-size"]
     else:
       parent_font_size = INHERITED_PROPERTIES['font-size']
-    node_pct = float(node.style["font-size"][:-1]) / 100
+    node_pct = float(computed["font-size"][:-1]) / 100
     parent_px = float(parent_font_size[:-2])
-    node.style["font-size"] = f"{str(node_pct * parent_px)}px"
-
-  for child in node.children:
-    style(child, rules)
+    computed["font-size"] = f"{str(node_pct * parent_px)}px"
+  node.style = intern_style(computed)
 
 
 def cascade_priority(rule):
@@ -48,23 +270,39 @@ class TagSelector:
     self.tag = tag
     self.priority = 1
 
-  def matches(self, node):
+  def matches(self, node, ancestors: AncestorFilter = None):
     return isinstance(node, Element) and self.tag == node.tag
 
+  def tags(self):
+    return [self.tag]
+
 
 class DescendantSelector:
   def __init__(self, ancestor, descendant):
     self.ancestor = ancestor
     self.descendant = descendant
     self.priority = ancestor.priority + descendant.priority
+    # Every one of these has to be somewhere above a matching node
+    self.ancestor_tags = ancestor.tags()
+
+  def tags(self):
+    return self.ancestor_tags + self.descendant.tags()
 
-  def matches(self, node):
+  def matches(self, node, ancestors: AncestorFilter = None):
     if not self.descendant.matches(node):
       return False
+    if ancestors:
+      for tag in self.ancestor_tags:
+        if not ancestors.may_contain(tag):
+          filter_stats.rejected += 1
+          return False
+      filter_stats.walked += 1
     while node.parent:
       if self.ancestor.matches(node.parent):
         return True
       node = node.parent
+    if ancestors:
+      filter_stats.false_positives += 1
     return False
 
 
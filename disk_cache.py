@@ -0,0 +1,281 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+DISK_CACHE_MAX_BYTES = 256 * 1024 * 1024
+INDEX_MAGIC = b"BECACHE2"
+# magic, slots per table, then running counts: non-empty url slots, non-empty body slots, live entries and the
+# total size of the bodies they point to
+INDEX_HEADER = struct.Struct("<8sIIIIQ")
+COUNTS = ('used', 'bodies_used', 'live', 'bytes')
+# url digest, body digest, body size, last used
+SLOT = struct.Struct("<16s16sQd")
+# body digest, number of url slots pointing at it, body size
+BODY_SLOT = struct.Struct("<16sIQ")
+INITIAL_SLOTS = 1024
+MAX_LOAD = 0.5
+EMPTY = bytes(16)
+TOMBSTONE = b"\xff" * 16
+
+
+def digest(data: bytes):
+  return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def atomic_write(path, data: bytes):
+  # Readers only ever see the old file or the complete new one, even if we crash halfway through
+  fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      f.write(data)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp, path)
+  except BaseException:
+    if os.path.exists(tmp):
+      os.unlink(tmp)
+    raise
+
+
+# The index is an open-addressing hash table of fixed-size slots that is memory-mapped rather than read at
+# startup. Bodies are stored once per content digest and per-URL metadata sits in small JSON files. A second
+# table after the first counts the references to each body, and the header keeps running totals, so neither a
+# put nor an eviction has to scan the index.
+# Every operation holds a flock on the lock file so several browser processes can share one directory;
+# a grown index is published with an atomic rename, which other processes notice by its inode changing.
+class DiskCacheStore:
+  def __init__(self, directory, max_bytes: int = DISK_CACHE_MAX_BYTES):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    os.makedirs(os.path.join(directory, "bodies"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "meta"), exist_ok=True)
+    self.index_path = os.path.join(directory, "index")
+    self.lock_file = open(os.path.join(directory, "lock"), "a+b")
+    self.index = None
+    self.index_inode = None
+    self.slots = 0
+
+    self.lock(fcntl.LOCK_EX)
+    try:
+      if self.read_magic() != INDEX_MAGIC:
+        # Missing, or laid out by another version; start over rather than misread it
+        self.clear_files()
+        self.write_index(INITIAL_SLOTS, [], [])
+      self.map_index()
+    finally:
+      self.unlock()
+
+  def body_path(self, body_digest):
+    return os.path.join(self.directory, "bodies", body_digest.hex())
+
+  def meta_path(self, url_digest):
+    return os.path.join(self.directory, "meta", url_digest.hex() + ".json")
+
+  def lock(self, operation):
+    fcntl.flock(self.lock_file, operation)
+    if self.index and os.stat(self.index_path).st_ino != self.index_inode:
+      self.map_index()
+
+  def unlock(self):
+    fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+  def read_magic(self):
+    try:
+      with open(self.index_path, "rb") as f:
+        return f.read(len(INDEX_MAGIC))
+    except FileNotFoundError:
+      return None
+
+  def clear_files(self):
+    for name in ["bodies", "meta"]:
+      for file in os.listdir(os.path.join(self.directory, name)):
+        os.unlink(os.path.join(self.directory, name, file))
+
+  def write_index(self, slots, records, bodies):
+    table = bytearray(INDEX_HEADER.size + slots * (SLOT.size + BODY_SLOT.size))
+    INDEX_HEADER.pack_into(table, 0, INDEX_MAGIC, slots, len(records), len(bodies), len(records),
+                           sum(record[2] for record in bodies))
+    for record in records:
+      i = self.probe(record[0], slots, table)[0]
+      self.write_slot(i, *record, table=table)
+    for record in bodies:
+      i = self.probe(record[0], slots, table, bodies=True)[0]
+      self.write_slot(i, *record, table=table, slots=slots, bodies=True)
+    atomic_write(self.index_path, bytes(table))
+
+  def map_index(self):
+    if self.index:
+      self.index.close()
+    with open(self.index_path, "r+b") as f:
+      self.index = mmap.mmap(f.fileno(), 0)
+      self.index_inode = os.fstat(f.fileno()).st_ino
+    magic, self.slots = INDEX_HEADER.unpack_from(self.index, 0)[:2]
+    if magic != INDEX_MAGIC:
+      raise ValueError(f"{self.index_path} is not a cache index")
+
+  def counts(self):
+    return dict(zip(COUNTS, INDEX_HEADER.unpack_from(self.index, 0)[2:]))
+
+  def add_counts(self, **deltas):
+    magic, slots, *values = INDEX_HEADER.unpack_from(self.index, 0)
+    INDEX_HEADER.pack_into(self.index, 0, magic, slots,
+                           *(value + deltas.get(name, 0) for name, value in zip(COUNTS, values)))
+
+  def slot_offset(self, i, slots=None, bodies=False):
+    # The body table follows the url table and has as many slots
+    if bodies:
+      return INDEX_HEADER.size + (slots or self.slots) * SLOT.size + i * BODY_SLOT.size
+    return INDEX_HEADER.size + i * SLOT.size
+
+  def read_slot(self, i, table=None, slots=None, bodies=False):
+    return (BODY_SLOT if bodies else SLOT).unpack_from(self.index if table is None else table,
+                                                       self.slot_offset(i, slots, bodies))
+
+  def write_slot(self, i, *record, table=None, slots=None, bodies=False):
+    (BODY_SLOT if bodies else SLOT).pack_into(self.index if table is None else table,
+                                              self.slot_offset(i, slots, bodies), *record)
+
+  def probe(self, target, slots=None, table=None, bodies=False):
+    # Returns the slot holding the target digest, or the first reusable slot along its probe sequence
+    slots = slots or self.slots
+    start = int.from_bytes(target[:8], "little") % slots
+    reusable = None
+    for step in range(slots):
+      i = (start + step) % slots
+      key = self.read_slot(i, table, slots, bodies)[0]
+      if key == target:
+        return i, True
+      if key == TOMBSTONE and reusable is None:
+        reusable = i
+      elif key == EMPTY:
+        return (i if reusable is None else reusable), False
+    return reusable, False
+
+  def records(self, bodies=False):
+    for i in range(self.slots):
+      record = self.read_slot(i, bodies=bodies)
+      if record[0] not in [EMPTY, TOMBSTONE]:
+        yield i, record
+
+  def get(self, url):
+    url_digest = digest(url.encode('utf-8'))
+    self.lock(fcntl.LOCK_EX)
+    try:
+      i, found = self.probe(url_digest)
+      if not found:
+        return None
+      _, body_digest, size, _ = self.read_slot(i)
+      try:
+        with open(self.meta_path(url_digest), "rb") as f:
+          meta = json.load(f)
+        with open(self.body_path(body_digest), "rb") as f:
+          body = f.read()
+      except (OSError, ValueError):
+        meta, body = None, None
+      if meta is None or meta.get("url") != url or meta.get("body") != body_digest.hex() \
+        or digest(body) != body_digest:
+        # A torn write or a file removed out from under us; forget the entry instead of serving it
+        self.remove_slot(i)
+        return None
+      self.write_slot(i, url_digest, body_digest, size, time.time())
+      return meta, body
+    finally:
+      self.unlock()
+
+  def put(self, url, meta, body: bytes):
+    url_digest = digest(url.encode('utf-8'))
+    body_digest = digest(body)
+    self.lock(fcntl.LOCK_EX)
+    try:
+      if not os.path.exists(self.body_path(body_digest)):
+        atomic_write(self.body_path(body_digest), body)
+      atomic_write(self.meta_path(url_digest), json.dumps({**meta, "url": url, "body": body_digest.hex()}).encode('utf-8'))
+
+      i, found = self.probe(url_digest)
+      key, old_body = self.read_slot(i)[:2]
+      # The slot is published last, so a crash before this point leaves the old entry intact
+      self.write_slot(i, url_digest, body_digest, len(body), time.time())
+      if not found:
+        self.add_counts(used=int(key == EMPTY), live=1)
+      if not found or old_body != body_digest:
+        self.add_reference(body_digest, len(body))
+      if found and old_body != body_digest:
+        self.remove_reference(old_body)
+
+      counts = self.counts()
+      if max(counts['used'], counts['bodies_used']) > self.slots * MAX_LOAD:
+        self.resize()
+      self.evict()
+    finally:
+      self.unlock()
+
+  def remove(self, url):
+    url_digest = digest(url.encode('utf-8'))
+    self.lock(fcntl.LOCK_EX)
+    try:
+      i, found = self.probe(url_digest)
+      if found:
+        self.remove_slot(i)
+    finally:
+      self.unlock()
+
+  def remove_slot(self, i):
+    url_digest, body_digest, _, _ = self.read_slot(i)
+    self.write_slot(i, TOMBSTONE, EMPTY, 0, 0)
+    self.add_counts(live=-1)
+    if os.path.exists(self.meta_path(url_digest)):
+      os.unlink(self.meta_path(url_digest))
+    self.remove_reference(body_digest)
+
+  def add_reference(self, body_digest, size):
+    i, found = self.probe(body_digest, bodies=True)
+    if found:
+      _, references, size = self.read_slot(i, bodies=True)
+      self.write_slot(i, body_digest, references + 1, size, bodies=True)
+      return
+    key = self.read_slot(i, bodies=True)[0]
+    self.write_slot(i, body_digest, 1, size, bodies=True)
+    self.add_counts(bodies_used=int(key == EMPTY), bytes=size)
+
+  def remove_reference(self, body_digest):
+    # The body file goes once no url points at it any more
+    i, found = self.probe(body_digest, bodies=True)
+    if found:
+      _, references, size = self.read_slot(i, bodies=True)
+      if references > 1:
+        self.write_slot(i, body_digest, references - 1, size, bodies=True)
+        return
+      self.write_slot(i, TOMBSTONE, 0, 0, bodies=True)
+      self.add_counts(bytes=-size)
+    if os.path.exists(self.body_path(body_digest)):
+      os.unlink(self.body_path(body_digest))
+
+  def resize(self):
+    live = [record for _, record in self.records()]
+    bodies = [record for _, record in self.records(bodies=True)]
+    self.write_index(max(INITIAL_SLOTS, len(live) * 4), live, bodies)
+    self.map_index()
+
+  def size(self):
+    # Bodies shared between URLs are only stored once, so only count them once
+    return self.counts()['bytes']
+
+  def evict(self):
+    if self.size() <= self.max_bytes:
+      return
+    # One scan and sort, least recently used first, then drop entries until the bodies fit
+    for i, record in sorted(self.records(), key=lambda item: item[1][3]):
+      self.remove_slot(i)
+      if self.size() <= self.max_bytes:
+        break
+
+  def close(self):
+    if self.index:
+      self.index.close()
+      self.index = None
+    self.lock_file.close()
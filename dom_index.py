@@ -0,0 +1,112 @@
+import bisect
+
+
+class DocumentIndex:
+  # Lookups the parser keeps up to date as it creates elements, so finding elements never needs a walk over
+  # the whole tree. Elements are indexed in the order they were created, which is document order. Each
+  # element points back at its index, which Element.set_attribute and remove_attribute keep up to date too.
+  def __init__(self):
+    self.by_tag = {}
+    self.by_id = {}
+    self.by_class = {}
+    self.by_attribute = {}
+    # Creation order of every element, for placing one that gains an attribute among those that have it
+    self.position = {}
+
+  def add(self, element):
+    element.index = self
+    self.position[element] = len(self.position)
+    self.by_tag.setdefault(element.tag, []).append(element)
+    for name, value in element.attributes.items():
+      self.add_attribute(element, name, value)
+
+  def insert(self, table, key, element):
+    elements = table.setdefault(key, [])
+    if not elements or self.position[elements[-1]] < self.position[element]:
+      # Always the case while parsing
+      elements.append(element)
+    else:
+      bisect.insort(elements, element, key=self.position.__getitem__)
+
+  def add_attribute(self, element, name, value):
+    self.insert(self.by_attribute, name, element)
+    if name == "id" and value:
+      # The first element with an id wins, as in the DOM
+      first = self.by_id.get(value)
+      if first is None or self.position[element] < self.position[first]:
+        self.by_id[value] = element
+    elif name == "class":
+      for class_name in dict.fromkeys(value.split()):
+        self.insert(self.by_class, class_name, element)
+
+  def remove_attribute(self, element, name, value):
+    # Called once the element no longer has the attribute
+    self.by_attribute[name].remove(element)
+    if name == "id" and self.by_id.get(value) is element:
+      del self.by_id[value]
+      for other in self.by_attribute.get("id", []):
+        if other.attributes["id"] == value:
+          self.by_id[value] = other
+          break
+    elif name == "class":
+      for class_name in dict.fromkeys(value.split()):
+        self.by_class[class_name].remove(element)
+
+  def get_elements_by_tag(self, tag):
+    return list(self.by_tag.get(tag.casefold(), []))
+
+  def get_element_by_id(self, id):
+    return self.by_id.get(id)
+
+  def get_elements_by_class(self, name):
+    return list(self.by_class.get(name, []))
+
+  def get_elements_with_attribute(self, name):
+    return list(self.by_attribute.get(name.casefold(), []))
+
+  def candidates(self, word):
+    if word.startswith("#"):
+      element = self.get_element_by_id(word[1:])
+      return [element] if element else []
+    elif word.startswith("."):
+      return self.by_class.get(word[1:], [])
+    return self.by_tag.get(word.casefold(), [])
+
+  def query_selector_all(self, selector):
+    # Takes a selector string or a TagSelector/DescendantSelector. Each part is a tag name, #id or .class;
+    # the last part picks the candidates from an index and only their ancestors are checked for the rest.
+    words = selector_words(selector)
+    *ancestors, last = words
+    return [element for element in self.candidates(last) if has_ancestors(element, ancestors)]
+
+
+def selector_words(selector):
+  if isinstance(selector, str):
+    return selector.split()
+  words = []
+  while hasattr(selector, "descendant"):
+    words.append(selector.descendant.tag)
+    selector = selector.ancestor
+  words.append(selector.tag)
+  return words[::-1]
+
+
+def matches_word(element, word):
+  if word.startswith("#"):
+    return element.attributes.get("id") == word[1:]
+  elif word.startswith("."):
+    return word[1:] in element.attributes.get("class", "").split()
+  return element.tag == word.casefold()
+
+
+def has_ancestors(element, words):
+  # Matching each word against the nearest ancestor that fits is enough when every combinator is a
+  # descendant one
+  node = element.parent
+  for word in reversed(words):
+    while node and not matches_word(node, word):
+      node = node.parent
+    if not node:
+      return False
+    node = node.parent
+  return True
@@ -0,0 +1,148 @@
+import sys
+from array import array
+
+from html_parser import HTMLParser, Element, Text, EMPTY_ATTRIBUTES
+
+NO_NODE = -1
+
+
+class NodeStore:
+  # Keeps a whole document in parallel arrays rather than one object per node, for documents too big to hold
+  # as a tree. Node i has tag self.tags[self.tag_id[i]] and is linked into the tree by its parent, first child
+  # and next sibling indexes (NO_NODE when there is none). self.data[i] is the text of a text node or the
+  # attributes of an element. Node 0 is the root.
+  # Text nodes have tag id 0, which is never handed to an element; even one the parser read from <#text>
+  TEXT = 0
+
+  def __init__(self):
+    self.tags = ["#text"]
+    # Element tags only
+    self.tag_ids = {}
+    self.tag_id = array('i')
+    self.parent = array('i')
+    self.first_child = array('i')
+    self.next_sibling = array('i')
+    self.data = []
+
+  def __len__(self):
+    return len(self.tag_id)
+
+  def add(self, tag, parent=NO_NODE, previous=NO_NODE, attributes=None):
+    # Appends an element after previous, which must be the parent's current last child
+    if tag not in self.tag_ids:
+      self.tag_ids[tag] = len(self.tags)
+      self.tags.append(sys.intern(tag))
+    return self.link(self.tag_ids[tag], parent, previous, attributes or EMPTY_ATTRIBUTES)
+
+  def add_text(self, text, parent, previous=NO_NODE):
+    return self.link(self.TEXT, parent, previous, text)
+
+  def link(self, tag_id, parent, previous, data):
+    index = len(self.tag_id)
+    self.tag_id.append(tag_id)
+    self.parent.append(parent)
+    self.first_child.append(NO_NODE)
+    self.next_sibling.append(NO_NODE)
+    if previous != NO_NODE:
+      self.next_sibling[previous] = index
+    elif parent != NO_NODE:
+      self.first_child[parent] = index
+    self.data.append(data)
+    return index
+
+  def tag(self, index):
+    return self.tags[self.tag_id[index]]
+
+  def is_text(self, index):
+    return self.tag_id[index] == self.TEXT
+
+  def text(self, index):
+    return self.data[index] if self.is_text(index) else None
+
+  def attributes(self, index):
+    return EMPTY_ATTRIBUTES if self.is_text(index) else self.data[index]
+
+  def children(self, index):
+    child = self.first_child[index]
+    while child != NO_NODE:
+      yield child
+      child = self.next_sibling[child]
+
+  def descendants(self, index=0):
+    # Document order, without recursion, so deep documents don't hit the recursion limit
+    stack = [index]
+    while stack:
+      node = stack.pop()
+      yield node
+      stack.extend(reversed(list(self.children(node))))
+
+  @classmethod
+  def from_tree(cls, root):
+    store = cls()
+    # (node, parent index) pairs, and the last child added so far under each parent
+    stack = [(root, NO_NODE)]
+    last_child = {}
+    while stack:
+      node, parent = stack.pop()
+      previous = last_child.get(parent, NO_NODE)
+      if isinstance(node, Text):
+        index = store.add_text(node.text, parent, previous)
+      else:
+        index = store.add(node.tag, parent, previous, attributes=node.attributes)
+      last_child[parent] = index
+      stack.extend((child, index) for child in reversed(node.children))
+    return store
+
+  def to_tree(self, index=0, parent=None):
+    # Rebuilds Text and Element objects, e.g. to style and lay out part of a stored document
+    stack = [(index, parent)]
+    root = None
+    while stack:
+      index, parent = stack.pop()
+      if self.is_text(index):
+        node = Text(self.data[index], parent)
+      else:
+        node = Element(self.tag(index), self.data[index], parent)
+      if parent:
+        parent.append_child(node)
+      else:
+        root = node
+      stack.extend((child, node) for child in reversed(list(self.children(index))))
+    return root
+
+
+class StoreNode:
+  # Stands in for an Element while the parser has it open; the node itself lives in the store
+  __slots__ = ('store', 'index', 'tag', 'last_child')
+
+  def __init__(self, store, index, tag):
+    self.store = store
+    self.index = index
+    self.tag = tag
+    self.last_child = NO_NODE
+
+  @property
+  def attributes(self):
+    return self.store.attributes(self.index)
+
+
+class NodeStoreParser(HTMLParser):
+  # Parses straight into a NodeStore, so a large document never exists as a tree of objects
+  def __init__(self, body, on_element=None):
+    super().__init__(body, on_element)
+    self.store = NodeStore()
+
+  def create_text(self, text, parent):
+    parent.last_child = self.store.add_text(text, parent.index, parent.last_child)
+
+  def create_element(self, tag, attributes, parent):
+    if parent:
+      index = self.store.add(tag, parent.index, parent.last_child, attributes=attributes)
+      parent.last_child = index
+    else:
+      index = self.store.add(tag, attributes=attributes)
+    return StoreNode(self.store, index, tag)
+
+  def finish(self):
+    super().finish()
+    return self.store
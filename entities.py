@@ -0,0 +1,128 @@
+import json
+import marshal
+import os
+import re
+import threading
+
+ENTITIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'entities.json')
+# entities.json compiled down to plain dicts, which marshal loads far faster than json parses the original
+COMPILED_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__', 'entities.marshal')
+COMPILED_VERSION = 1
+
+REFERENCE = re.compile(r"&(?:#[xX]([0-9A-Fa-f]+);?|#([0-9]+);?|([0-9A-Za-z]+;?))")
+# What numeric references to the C1 control range mean in practice: windows-1252
+WINDOWS_1252 = {
+  0x80: "€", 0x82: "‚", 0x83: "ƒ", 0x84: "„", 0x85: "…", 0x86: "†", 0x87: "‡",
+  0x88: "ˆ", 0x89: "‰", 0x8a: "Š", 0x8b: "‹", 0x8c: "Œ", 0x8e: "Ž", 0x91: "‘",
+  0x92: "’", 0x93: "“", 0x94: "”", 0x95: "•", 0x96: "–", 0x97: "—", 0x98: "˜",
+  0x99: "™", 0x9a: "š", 0x9b: "›", 0x9c: "œ", 0x9e: "ž", 0x9f: "Ÿ",
+}
+
+
+class EntityTable:
+  def __init__(self, named, legacy):
+    # "amp;" -> "&" for every entity, and "amp" -> "&" for the old ones that may leave off the semicolon
+    self.named = named
+    self.legacy = legacy
+    self.longest_name = max(map(len, named))
+    self.longest_legacy = max(map(len, legacy))
+
+
+_table = None
+_lock = threading.Lock()
+
+
+def compile_entities(path=ENTITIES_FILE):
+  with open(path, 'r', encoding='utf-8') as f:
+    entities = json.load(f)
+  named = {}
+  legacy = {}
+  for entity, value in entities.items():
+    name = entity[1:]
+    if name.endswith(";"):
+      named[name] = value['characters']
+    else:
+      legacy[name] = value['characters']
+  return named, legacy
+
+
+def load_entities(path=ENTITIES_FILE, compiled_path=COMPILED_FILE):
+  stat = os.stat(path)
+  source = (COMPILED_VERSION, stat.st_mtime_ns, stat.st_size)
+  try:
+    with open(compiled_path, 'rb') as f:
+      compiled_source, named, legacy = marshal.load(f)
+    if compiled_source == source:
+      return EntityTable(named, legacy)
+  except (OSError, EOFError, ValueError, TypeError):
+    pass
+
+  named, legacy = compile_entities(path)
+  try:
+    os.makedirs(os.path.dirname(compiled_path), exist_ok=True)
+    temp = f"{compiled_path}.{os.getpid()}.tmp"
+    with open(temp, 'wb') as f:
+      marshal.dump((source, named, legacy), f)
+    os.replace(temp, compiled_path)
+  except OSError:
+    # Nowhere to keep the compiled table; every process will just compile its own
+    pass
+  return EntityTable(named, legacy)
+
+
+def entity_table():
+  # Loaded on first use and then shared by every parser in the process
+  global _table
+  if _table is None:
+    with _lock:
+      if _table is None:
+        _table = load_entities()
+  return _table
+
+
+def numeric_character(codepoint):
+  if codepoint in WINDOWS_1252:
+    return WINDOWS_1252[codepoint]
+  if codepoint == 0 or codepoint > 0x10FFFF or 0xD800 <= codepoint <= 0xDFFF:
+    return "�"
+  return chr(codepoint)
+
+
+def replace_reference(m):
+  hexadecimal, decimal, name = m.groups()
+  if hexadecimal:
+    return numeric_character(int(hexadecimal, 16))
+  if decimal:
+    return numeric_character(int(decimal))
+
+  table = entity_table()
+  if name in table.named:
+    return table.named[name]
+  # Old entities like "&copy" still count without their semicolon, and match the longest one that fits, so
+  # "&copy2024" is "©2024"
+  letters = name.rstrip(";")
+  for length in range(min(len(letters), table.longest_legacy), 1, -1):
+    if letters[:length] in table.legacy:
+      return table.legacy[letters[:length]] + name[length:]
+  if name.endswith(";"):
+    # Unknown "&name;" references are dropped, as they always have been
+    return ""
+  return m.group(0)
+
+
+def decode(text):
+  if "&" not in text:
+    return text
+  return REFERENCE.sub(replace_reference, text)
+
+
+def incomplete_reference(text):
+  # Returns where a reference at the very end of text starts if more text could still change what it means,
+  # otherwise -1
+  amp = text.rfind("&")
+  if amp == -1:
+    return -1
+  tail = text[amp + 1:]
+  if len(tail) <= entity_table().longest_name and re.fullmatch(r"#?[xX]?[0-9A-Za-z]*", tail):
+    return amp
+  return -1
@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+from timing import RequestTiming
+from url import URL, MAX_REDIRECTS, cache, resolver, tls, parse_header, request_pipelined
+
+PER_HOST_LIMIT = 6
+FETCH_TIMEOUT = 10
+
+
+class AsyncFetcher:
+  def __init__(self, per_host_limit: int = PER_HOST_LIMIT, timeout: float = FETCH_TIMEOUT):
+    self.per_host_limit = per_host_limit
+    self.timeout = timeout
+    # Semaphores belong to the running event loop, so a fetcher is only good for one asyncio.run()
+    self.semaphores = {}
+
+  def semaphore(self, url: URL):
+    key = (url.host, url.port)
+    if key not in self.semaphores:
+      self.semaphores[key] = asyncio.Semaphore(self.per_host_limit)
+    return self.semaphores[key]
+
+  async def fetch(self, url: URL, num_redirects: int = 0):
+    if url.is_malformed:
+      return None
+    if url.scheme not in ['http', 'https']:
+      # file: and data: URLs don't touch the network
+      return url.request(num_redirects)
+
+    timing = RequestTiming(url.cache_key())
+    entry = cache.lookup(url.cache_key(), url.request_headers())
+    if entry and entry.is_fresh():
+      print(f"Returning content from cache: {url.cache_key()}")
+      timing.cache = 'hit'
+      timing.finish()
+      return entry.content()
+
+    timing.cache = 'miss'
+    timing.reused = False
+    try:
+      async with self.semaphore(url):
+        request_time = time.time()
+        validators = entry.validators() if entry else []
+        status, response_headers, content = await asyncio.wait_for(self.exchange(url, timing, validators),
+                                                                   self.timeout)
+        response_time = time.time()
+    except (Exception, asyncio.CancelledError) as e:
+      timing.finish(e)
+      raise
+    timing.status = status
+
+    location = url.redirect_url(status, response_headers)
+    if location:
+      timing.finish()
+      if num_redirects < MAX_REDIRECTS:
+        print(f"Redirecting to: {location}")
+        return await self.fetch(URL(location), num_redirects + 1)
+      else:
+        print("Too many redirects, sorry")
+        return None
+
+    if status == '304' and entry:
+      timing.cache = 'revalidated'
+    with timing.measure('decompress'):
+      content = url.cache_response(entry, status, response_headers, content, request_time, response_time)
+    timing.finish()
+    return content
+
+  async def exchange(self, url: URL, timing: RequestTiming, extra_headers=()):
+    # Go through the shared resolver so lookups are cached across the sync and async paths
+    with timing.measure('dns'):
+      address = await asyncio.get_running_loop().run_in_executor(None, resolver.resolve, url.host, url.port)
+    # open_connection does the TLS handshake as part of connecting, so https connects include it. asyncio has no
+    # way to offer a saved session, so these connections share the context but never resume.
+    with timing.measure('connect'):
+      if url.scheme == 'https':
+        reader, writer = await asyncio.open_connection(address, url.port, ssl=tls.context(),
+                                                       server_hostname=url.host)
+      else:
+        reader, writer = await asyncio.open_connection(address, url.port)
+
+    try:
+      with timing.measure('write'):
+        writer.write(url.request_text([*extra_headers, "Connection: close"]).encode('utf-8'))
+        await writer.drain()
+
+      with timing.measure('ttfb'):
+        statusline = (await reader.readline()).decode(encoding='utf-8')
+      version, status, explanation = statusline.split(" ", 2)
+      with timing.measure('transfer'):
+        response_headers = {}
+        while True:
+          line = (await reader.readline()).decode(encoding='utf-8')
+          if line in ['\r\n', '']:
+            break
+          header, value = parse_header(line)
+          response_headers[header] = value
+
+        if response_headers.get('transfer-encoding') == 'chunked':
+          chunks = []
+          while True:
+            size = (await reader.readline()).strip().decode(encoding='utf-8')
+            if size == '0' or not size:
+              await reader.readline()
+              break
+            chunks.append(await reader.readexactly(int(size, 16)))
+            # need to read past \r\n
+            await reader.readexactly(2)
+          content = b''.join(chunks)
+        elif 'content-length' in response_headers:
+          content = await reader.readexactly(int(response_headers['content-length']))
+        else:
+          content = await reader.read()
+    finally:
+      writer.close()
+
+    return status, response_headers, content
+
+  async def fetch_pipelined(self, urls):
+    # The pipelined path runs on blocking pooled sockets, so give it a thread and let other origins carry on.
+    # wait_for can't stop that thread, and asyncio.run waits for it, so its sockets time out on their own.
+    return await asyncio.wait_for(asyncio.to_thread(request_pipelined, urls, self.timeout), self.timeout)
+
+  async def fetch_all(self, urls, pipeline: bool = False):
+    origins = {}
+    if pipeline:
+      for i, url in enumerate(urls):
+        if not url.is_malformed and url.scheme in ['http', 'https']:
+          origins.setdefault((url.scheme, url.host, url.port), []).append(i)
+    batches = [indices for indices in origins.values() if len(indices) > 1]
+    batched = {i for indices in batches for i in indices}
+    singles = [i for i in range(len(urls)) if i not in batched]
+
+    tasks = [self.fetch(urls[i]) for i in singles] + [self.fetch_pipelined([urls[i] for i in indices])
+                                                       for indices in batches]
+    done = await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Put everything back in document order, so the cascade sees stylesheets in the order the page lists them
+    results = [None] * len(urls)
+    for i, result in zip(singles, done):
+      results[i] = result
+    for indices, batch in zip(batches, done[len(singles):]):
+      if isinstance(batch, Exception):
+        batch = [batch] * len(indices)
+      for i, result in zip(indices, batch):
+        results[i] = result
+    return results
+
+
+def fetch_all(urls, per_host_limit: int = PER_HOST_LIMIT, timeout: float = FETCH_TIMEOUT, pipeline: bool = False):
+  if not urls:
+    # Most pages have no stylesheets left to fetch; don't spin up an event loop for them
+    return []
+  return asyncio.run(AsyncFetcher(per_host_limit, timeout).fetch_all(urls, pipeline))
@@ -0,0 +1,73 @@
+import codecs
+import io
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+FILE_CHUNK_SIZE = 64 * 1024
+FILE_CACHE_MAX_CHARS = 64 * 1024 * 1024
+
+
+def iter_mapped(path, chunk_size: int = FILE_CHUNK_SIZE):
+  # Decodes straight out of the page cache a chunk at a time, so the raw bytes are never copied into memory
+  # as a whole. Newlines are translated the same way open(path, 'r') would.
+  decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+  with open(path, 'rb') as f:
+    size = os.fstat(f.fileno()).st_size
+    if size:
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        for start in range(0, size, chunk_size):
+          text = decoder.decode(m[start:start + chunk_size])
+          if text:
+            yield text
+  text = decoder.decode(b'', final=True)
+  if text:
+    yield text
+
+
+class FileCache:
+  # Keeps decoded files keyed by (path, mtime, size), so reloading an unchanged file costs one stat()
+  def __init__(self, max_chars: int = FILE_CACHE_MAX_CHARS):
+    self.max_chars = max_chars
+    self.entries = OrderedDict()
+    self.size = 0
+    self.lock = threading.Lock()
+
+  def stream(self, path):
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with self.lock:
+      if key in self.entries:
+        self.entries.move_to_end(key)
+        return iter(self.entries[key])
+    return self.load(key)
+
+  def load(self, key):
+    # The decoded chunks are kept as they are rather than joined, so caching doesn't cost another copy
+    chunks = []
+    size = 0
+    for text in iter_mapped(key[0]):
+      if chunks is not None:
+        chunks.append(text)
+        size += len(text)
+        if size > self.max_chars:
+          chunks = None
+      yield text
+    if chunks is not None:
+      self.store(key, chunks, size)
+
+  def store(self, key, chunks, size):
+    with self.lock:
+      for old in [old for old in self.entries if old[0] == key[0]]:
+        self.size -= sum(len(text) for text in self.entries.pop(old))
+      self.entries[key] = chunks
+      self.size += size
+      while self.size > self.max_chars and self.entries:
+        _, evicted = self.entries.popitem(last=False)
+        self.size -= sum(len(text) for text in evicted)
+
+  def clear(self):
+    with self.lock:
+      self.entries = OrderedDict()
+      self.size = 0
@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from PIL import Image, ImageDraw, ImageFont
+
+import layout
+from browser import DEFAULT_STYLE_SHEET, WIDTH
+from css import style, CSSParser, cascade_priority
+from disk_cache import DiskCacheStore
+from draw import DrawText, DrawRect, DrawEmoji
+from fetch import fetch_all
+from html_parser import HTMLParser
+from url import URL, cache
+
+# Tried in order for each font; Pillow's built-in font is the last resort, but it has no bold or italic
+FONT_FILES = {
+  (False, False, False): ["DejaVuSans.ttf"],
+  (True, False, False): ["DejaVuSans-Bold.ttf"],
+  (False, True, False): ["DejaVuSans-Oblique.ttf"],
+  (True, True, False): ["DejaVuSans-BoldOblique.ttf"],
+  (False, False, True): ["DejaVuSansMono.ttf"],
+  (True, False, True): ["DejaVuSansMono-Bold.ttf"],
+  (False, True, True): ["DejaVuSansMono-Oblique.ttf"],
+  (True, True, True): ["DejaVuSansMono-BoldOblique.ttf"],
+}
+
+# Parsed stylesheets, keyed by their text, kept for as long as the worker lives
+STYLESHEETS = {}
+
+
+def load_font(size, weight, style):
+  variant = (weight == "bold", "italic" in style, "fixed_width" in style)
+  for name in FONT_FILES[variant]:
+    try:
+      return ImageFont.truetype(name, size)
+    except OSError:
+      continue
+  return ImageFont.load_default(size)
+
+
+class HeadlessFont:
+  # Stands in for tkinter.font.Font, measuring text with Pillow so layout runs without a display
+  def __init__(self, size, weight, style):
+    self.key = (size, weight, style)
+    self.font = load_font(size, weight, style)
+    ascent, descent = self.font.getmetrics()
+    self.font_metrics = {"ascent": ascent, "descent": descent, "linespace": ascent + descent,
+                         "fixed": int("fixed_width" in style)}
+
+  def measure(self, text):
+    return round(self.font.getlength(text))
+
+  def metrics(self, *options):
+    if options:
+      return self.font_metrics[options[0]]
+    return dict(self.font_metrics)
+
+
+def init_worker(cache_dir=None):
+  # Progress messages from the network code would otherwise end up mixed into the JSON results
+  sys.stdout = sys.stderr
+  layout.set_font_backend(HeadlessFont)
+  if cache_dir:
+    # The disk cache locks its index, so every worker can share one directory
+    cache.disk = DiskCacheStore(cache_dir)
+
+
+def parse_stylesheet(text):
+  if text not in STYLESHEETS:
+    STYLESHEETS[text] = CSSParser(text).parse()
+  return STYLESHEETS[text]
+
+
+def describe(cmd):
+  # Display list entries as plain data, so they can leave the worker process
+  if isinstance(cmd, DrawText):
+    return {"type": "text", "left": cmd.left, "top": cmd.top, "text": cmd.text, "font": list(cmd.font.key),
+            "color": cmd.color}
+  elif isinstance(cmd, DrawRect):
+    return {"type": "rect", "left": cmd.left, "top": cmd.top, "right": cmd.right, "bottom": cmd.bottom,
+            "color": cmd.color}
+  elif isinstance(cmd, DrawEmoji):
+    return {"type": "emoji", "left": cmd.left, "top": cmd.top, "text": cmd.emoji}
+
+
+def raster(display_list, width, height):
+  image = Image.new("RGB", (width, max(int(height), 1)), "white")
+  draw = ImageDraw.Draw(image)
+  for cmd in display_list:
+    try:
+      if isinstance(cmd, DrawText):
+        draw.text((cmd.left, cmd.top), cmd.text, font=cmd.font.font, fill=cmd.color)
+      elif isinstance(cmd, DrawRect):
+        draw.rectangle((cmd.left, cmd.top, cmd.right, cmd.bottom), fill=cmd.color)
+    except ValueError:
+      # Pillow doesn't know every CSS color name; leave those out rather than fail the page
+      continue
+  return image
+
+
+class Renderer:
+  def __init__(self, width: int = WIDTH, image_dir=None):
+    self.width = width
+    self.image_dir = image_dir
+    self.timings = {}
+
+  @contextmanager
+  def stage(self, name):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.timings[name] = time.perf_counter() - start
+
+  def render(self, target, index: int = 0):
+    self.timings = {}
+    result = {"url": target, "display_list": None, "height": None, "image": None, "error": None}
+    try:
+      url = URL(target)
+      with self.stage('fetch'):
+        body = url.request()
+      if body is None:
+        raise ValueError(f"Nothing to render at {target}")
+      with self.stage('parse'):
+        parser = HTMLParser(body)
+        nodes = parser.parse()
+
+      with self.stage('stylesheets'):
+        rules = DEFAULT_STYLE_SHEET.copy()
+        links = [node.attributes['href'] for node in parser.index.get_elements_by_tag("link")
+                 if node.attributes.get("rel") == "stylesheet" and "href" in node.attributes]
+        for text in fetch_all([url.resolve(link) for link in links]):
+          if text and not isinstance(text, Exception):
+            rules.extend(parse_stylesheet(text))
+      with self.stage('style'):
+        style(nodes, sorted(rules, key=cascade_priority))
+      with self.stage('layout'):
+        document = layout.DocumentLayout(nodes, self.width)
+        document.layout()
+      with self.stage('paint'):
+        display_list = []
+        layout.paint_tree(document, display_list)
+
+      result["display_list"] = [describe(cmd) for cmd in display_list]
+      result["height"] = document.height
+      if self.image_dir:
+        with self.stage('raster'):
+          path = os.path.join(self.image_dir, f"{index}.png")
+          raster(display_list, self.width, document.height + 2 * layout.VSTEP).save(path)
+        result["image"] = path
+    except Exception as e:
+      result["error"] = f"{type(e).__name__}: {e}"
+    result["timings"] = dict(self.timings)
+    return result
+
+
+def render_one(job):
+  # Runs in a worker; the font, measurement, HTTP and stylesheet caches stay warm between jobs
+  index, target, width, image_dir = job
+  return Renderer(width, image_dir).render(target, index)
+
+
+def as_url(target):
+  # Bare paths are taken to be local files
+  if "://" in target or target.startswith(("data:", "about:")):
+    return target
+  return f"file://{os.path.abspath(target)}"
+
+
+def render_all(targets, workers=None, width: int = WIDTH, image_dir=None, cache_dir=None):
+  # Results come back in the order the targets were given, however the pages were spread over the workers
+  if image_dir:
+    os.makedirs(image_dir, exist_ok=True)
+  workers = workers or os.cpu_count() or 1
+  jobs = [(i, as_url(target), width, image_dir) for i, target in enumerate(targets)]
+  # Big enough chunks to keep the inter-process traffic down, small enough that workers finish together
+  chunksize = max(1, len(jobs) // (4 * workers))
+  with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(cache_dir,)) as executor:
+    yield from executor.map(render_one, jobs, chunksize=chunksize)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Render pages without a display, one JSON result per line")
+  parser.add_argument("url", help="URL(s) or file(s) to render", nargs="*")
+  parser.add_argument("--list", help="File with one URL or path per line")
+  parser.add_argument("--workers", type=int, help="Worker processes (default: one per core)")
+  parser.add_argument("--width", type=int, default=WIDTH, help="Page width in pixels")
+  parser.add_argument("--images", help="Directory to write a PNG of each page to")
+  parser.add_argument("--cache-dir", help="Directory for an HTTP cache shared by the workers")
+  parser.add_argument("--no-display-list", action="store_true", help="Leave display lists out of the output")
+
+  args = parser.parse_args()
+  targets = list(args.url)
+  if args.list:
+    with open(args.list) as f:
+      targets.extend(line.strip() for line in f if line.strip())
+  for result in render_all(targets, args.workers, args.width, args.images, args.cache_dir):
+    if args.no_display_list:
+      del result["display_list"]
+    print(json.dumps(result))
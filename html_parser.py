@@ -1,157 +1,340 @@
-import json
 import re
+import sys
+from types import MappingProxyType
 from typing import Union, Dict
 
+from dom_index import DocumentIndex
+from entities import decode, incomplete_reference
+from traversal import with_depth
+
+TAG_NAME = re.compile(r"\s*(/?[^\s/]*)")
+ATTRIBUTE = re.compile(r"""([^\s=/][^\s=]*)(?:\s*=\s*("[^"]*"|'[^']*'|\S*))?""")
+# Opens a quoted attribute value, inside which a ">" doesn't end the tag
+ATTRIBUTE_QUOTE = re.compile(r"""=\s*(["'])""")
+# Shared by every node without attributes or style of its own, and read-only so nobody fills in the shared copy
+EMPTY_ATTRIBUTES = MappingProxyType({})
+EMPTY_STYLE = MappingProxyType({})
+# Dirty bits on an Element, saying what css.restyle() has to redo: the element's own style, the style of
+# something below it, or everything below it
+CLEAN = 0
+STYLE_DIRTY = 1
+CHILDREN_DIRTY = 2
+SUBTREE_DIRTY = 4
+
+
+def find_tag_end(text, start):
+  # Returns the index of the ">" that closes the tag starting at start, or -1 if it hasn't arrived yet
+  i = start
+  while True:
+    end = text.find(">", i)
+    if end == -1:
+      return -1
+    quote = ATTRIBUTE_QUOTE.search(text, i, end)
+    if not quote:
+      return end
+    close = text.find(quote.group(1), quote.end())
+    if close == -1:
+      return -1
+    i = close + 1
+
 
 def print_tree(node, indent=0):
-  print(" " * indent, node)
-  for child in node.children:
-    print_tree(child, indent + 2)
+  for node, depth in with_depth(node):
+    print(" " * (indent + 2 * depth), node)
 
 
 class Text:
+  __slots__ = ('text', 'parent', 'style')
+  # Text never has children, so every Text node shares the same empty tuple
+  children = ()
+
   def __init__(self, text: str, parent: Union["Text", "Element"]):
     self.text = text
-    self.children = []
     self.parent = parent
+    self.style = EMPTY_STYLE
 
   def __repr__(self):
     return self.text
 
 
 class Element:
+  __slots__ = ('tag', 'attributes', 'children', 'parent', 'style', 'dirty', 'index')
+
   def __init__(self, tag: str, attributes: Dict[str, str], parent: Union['Text', 'Element']):
     self.tag = tag
-    self.attributes = attributes
-    self.children = []
+    self.attributes = attributes or EMPTY_ATTRIBUTES
+    # An empty tuple until the first child arrives, since most elements in a big document are leaves
+    self.children = ()
     self.parent = parent
-    self.style = {}
+    self.style = EMPTY_STYLE
+    # Never styled yet, and neither is anything added below it, which saves marking it again for every child
+    self.dirty = STYLE_DIRTY | CHILDREN_DIRTY
+    # The DocumentIndex the element is in, if any
+    self.index = None
+
+  def append_child(self, node):
+    if self.children:
+      self.children.append(node)
+    else:
+      self.children = [node]
+    if not self.dirty & CHILDREN_DIRTY:
+      self.mark_children_dirty()
+
+  def set_attribute(self, name, value):
+    # Attribute dicts may be shared with other elements, so changes go into a copy of our own
+    old = self.attributes.get(name)
+    attributes = dict(self.attributes)
+    attributes[name] = value
+    self.attributes = attributes
+    if self.index is not None:
+      if old is not None:
+        self.index.remove_attribute(self, name, old)
+      self.index.add_attribute(self, name, value)
+    self.mark_style_dirty()
+
+  def remove_attribute(self, name):
+    if name in self.attributes:
+      attributes = dict(self.attributes)
+      old = attributes.pop(name)
+      self.attributes = attributes or EMPTY_ATTRIBUTES
+      if self.index is not None:
+        self.index.remove_attribute(self, name, old)
+      self.mark_style_dirty()
+
+  def mark_style_dirty(self):
+    self.dirty |= STYLE_DIRTY
+    if self.parent:
+      self.parent.mark_children_dirty()
+
+  def mark_subtree_dirty(self):
+    # For changes that can reach every descendant's style, like a new set of stylesheets
+    self.dirty |= SUBTREE_DIRTY
+    if self.parent:
+      self.parent.mark_children_dirty()
+
+  def mark_children_dirty(self):
+    # Stops at the first ancestor that is already marked, since everything above it is marked too
+    node = self
+    while node and not node.dirty & CHILDREN_DIRTY:
+      node.dirty |= CHILDREN_DIRTY
+      node = node.parent
 
   def __repr__(self):
-    return f"<{self.tag} {self.attributes}>"
+    return f"<{self.tag} {dict(self.attributes)}>"
 
 
 class HTMLParser:
-  SELF_CLOSING_TAGS = [
+  SELF_CLOSING_TAGS = {
     "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr",
-  ]
+  }
 
-  HEAD_TAGS = [
+  HEAD_TAGS = {
     "base", "basefont", "bgsound", "noscript", "link", "meta", "title", "style", "script",
-  ]
+  }
+
+  # Insertion modes, named for where the next token goes. Tags are only ever implied at the top of the tree,
+  # so "in body" covers every position below <body> or nested inside anything else.
+  INITIAL = "initial"
+  IN_HTML = "in html"
+  IN_HEAD = "in head"
+  IN_BODY = "in body"
 
-  def __init__(self, body):
+  def __init__(self, body, on_element=None):
     self.body = body
     self.unfinished = []
+    self.mode = self.INITIAL
+    self.attribute_sets = {}
+    self.index = DocumentIndex()
+    # Called with each new Element as soon as it is created, e.g. to start work on the URLs it mentions
+    self.on_element = on_element
+
+    # Tokenizer state carried between feed() calls
+    self.pending = ''
+    self.buffer = ''
+    self.in_comment = False
 
   def get_attributes(self, text):
-    parts = text.split()
-    tag = parts[0].casefold()
+    # Quoted values may hold spaces and ">"; the quotes themselves are not part of the value
+    m = TAG_NAME.match(text)
+    # Tags and attribute names repeat endlessly, so each distinct one is only kept in memory once
+    tag = sys.intern(m.group(1).casefold())
     attributes = {}
-    for pair in parts[1:]:
-      if pair.startswith("/"):
-        continue
-      if "=" in pair:
-        key, value = pair.split("=", 1)
-        attributes[key.casefold()] = value.strip("'\"")
+    for key, value in ATTRIBUTE.findall(text, m.end()):
+      if len(value) > 1 and value[0] in "'\"" and value[-1] == value[0]:
+        value = value[1:-1]
       else:
-        attributes[pair.casefold()] = ""
+        value = value.strip("'\"")
+      attributes[sys.intern(key.casefold())] = value
 
     return tag, attributes
 
+  def push(self, node):
+    self.unfinished.append(node)
+    self.update_mode()
+
+  def pop(self):
+    node = self.unfinished.pop()
+    self.update_mode()
+    return node
+
+  def update_mode(self):
+    # Only the bottom two open elements decide the mode, so this costs the same however deep the tree is
+    depth = len(self.unfinished)
+    if depth == 0:
+      self.mode = self.INITIAL
+    elif depth == 1 and self.unfinished[0].tag == "html":
+      self.mode = self.IN_HTML
+    elif depth == 2 and self.unfinished[0].tag == "html" and self.unfinished[1].tag == "head":
+      self.mode = self.IN_HEAD
+    else:
+      self.mode = self.IN_BODY
+
   def implicit_tags(self, tag):
     while True:
-      open_tags = [node.tag for node in self.unfinished]
-      if open_tags == [] and tag != "html":
+      if self.mode == self.INITIAL and tag != "html":
         self.add_element("html")
-      elif open_tags == ["html"] and tag not in ["head", "body", "/html"]:
+      elif self.mode == self.IN_HTML and tag not in ("head", "body", "/html"):
         if tag in self.HEAD_TAGS:
           self.add_element("head")
         else:
           self.add_element("body")
-      elif open_tags == ["html", "head"] and tag not in ["/head"] + self.HEAD_TAGS:
+      elif self.mode == self.IN_HEAD and tag != "/head" and tag not in self.HEAD_TAGS:
         self.add_element("/head")
       else:
         break
 
+  def share_attributes(self, attributes):
+    # Elements with identical attributes, like the rows of a big table, share one read-only copy
+    if not attributes:
+      return EMPTY_ATTRIBUTES
+    key = tuple(attributes.items())
+    if key not in self.attribute_sets:
+      self.attribute_sets[key] = MappingProxyType(attributes)
+    return self.attribute_sets[key]
+
+  def create_text(self, text, parent):
+    node = Text(text, parent)
+    parent.append_child(node)
+    return node
+
+  def create_element(self, tag, attributes, parent):
+    node = Element(tag, attributes, parent)
+    if parent:
+      parent.append_child(node)
+    self.index.add(node)
+    return node
+
   def add_text(self, text):
     if text.isspace():
       return
     self.implicit_tags(None)
-    parent = self.unfinished[-1]
-    node = Text(text, parent)
-    parent.children.append(node)
+    self.create_text(text, self.unfinished[-1])
 
   def add_element(self, tag):
     tag, attributes = self.get_attributes(tag)
+    attributes = self.share_attributes(attributes)
     self.implicit_tags(tag)
     if tag.startswith("!"):
       return
     elif tag in self.SELF_CLOSING_TAGS:
-      parent = self.unfinished[-1]
-      node = Element(tag, attributes, parent)
-      parent.children.append(node)
+      node = self.create_element(tag, attributes, self.unfinished[-1])
     elif tag.startswith("/"):
       if len(self.unfinished) == 1:
         return
-      node = self.unfinished.pop()
-      parent = self.unfinished[-1]
-      parent.children.append(node)
+      self.pop()
+      return
     else:
-      parent = self.unfinished[-1] if self.unfinished else None
-      node = Element(tag, attributes, parent)
-      self.unfinished.append(node)
+      # Elements join their parent as soon as they open, so the tree is complete at every point of the parse
+      node = self.create_element(tag, attributes, self.unfinished[-1] if self.unfinished else None)
+      self.push(node)
+    if self.on_element:
+      self.on_element(node)
+
+  def partial_tree(self):
+    return self.unfinished[0] if self.unfinished else None
 
   def finish(self):
+    self.consume(final=True)
+    self.flush_text()
+
     if not self.unfinished:
       self.implicit_tags(None)
     while len(self.unfinished) > 1:
-      node = self.unfinished.pop()
-      parent = self.unfinished[-1]
-      parent.children.append(node)
+      self.pop()
     if self.unfinished:
-      return self.unfinished.pop()
+      return self.pop()
     else:
       return []
 
-  def parse(self):
-    with open('entities.json', 'r', encoding='utf-8') as f:
-      entities = json.load(f)
+  def feed(self, chunk):
+    self.pending += chunk
+    self.consume(final=False)
+
+  def flush_text(self):
+    if self.buffer:
+      self.add_text(self.buffer)
+    self.buffer = ''
 
-    buffer = ''
-    in_comment = False
-    in_tag = False
+  def add_run(self, text, start, end, final):
+    # Adds text[start:end] to the text buffer and returns how far it got, which falls short of end when the
+    # run finishes with an "&" that more text could still turn into an entity
+    run = text[start:end]
+    if not final:
+      amp = incomplete_reference(run)
+      if amp != -1:
+        run = run[:amp]
+        end = start + amp
+    self.buffer += decode(run)
+    return end
+
+  def consume(self, final):
+    # Jumps from one "<" to the next rather than walking every character. Anything whose meaning depends on
+    # text that hasn't arrived yet (an unclosed tag, a possible "<!--" or entity) waits in self.pending for
+    # the next feed() or for finish().
+    text = self.pending
     i = 0
-    while i < len(self.body):
-      c = self.body[i]
-      if c == "<":
-        if i + 4 < len(self.body) and self.body[i + 1:i + 4] == "!--":
-          in_comment = True
-        if not in_comment:
-          in_tag = True
-          if buffer:
-            self.add_text(buffer)
-          buffer = ""
-      elif c == ">":
-        if not in_comment:
-          in_tag = False
-          self.add_element(buffer)
-          buffer = ''
-        if self.body[i - 2:i] == "--":
-          in_comment = False
-          buffer = ''
-      elif not in_comment and not in_tag and c == "&":
-        m = re.search(r"&.*?;", self.body[i:])
-        if m:
-          entity = m.group(0)
-          if entity in entities:
-            buffer += entities[entity]['characters']
-          i += len(entity) - 1
-      elif not in_comment:
-        buffer += c
-      i += 1
-
-    if not in_tag and buffer:
-      self.add_text(buffer)
+    while i < len(text):
+      if self.in_comment:
+        end = text.find("-->", i)
+        if end == -1:
+          # Keep enough of the tail to spot a "-->" that straddles the next chunk
+          i = max(i, len(text) - 2)
+          break
+        self.in_comment = False
+        i = end + 3
+        continue
+
+      lt = text.find("<", i)
+      if lt == -1:
+        lt = len(text)
+      if lt > i:
+        i = self.add_run(text, i, lt, final or lt < len(text))
+        if i < lt:
+          break
+      if lt == len(text):
+        break
+
+      if text.startswith("<!--", lt):
+        self.flush_text()
+        self.in_comment = True
+        # "<!-->" is an empty comment, so the "-->" may overlap the opening
+        i = lt + 2
+        continue
+      if not final and len(text) - lt < 4 and "<!--".startswith(text[lt:]):
+        break
+      end = find_tag_end(text, lt + 1)
+      if end == -1:
+        if final:
+          # A tag still open when the document ends is dropped
+          i = len(text)
+        break
+      self.flush_text()
+      if text[lt + 1:end].strip():
+        self.add_element(text[lt + 1:end])
+      i = end + 1
 
+    self.pending = text[i:]
+
+  def parse(self):
+    self.feed(self.body)
     return self.finish()
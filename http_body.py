@@ -0,0 +1,101 @@
+import codecs
+import zlib
+
+BUFFER_SIZE = 64 * 1024
+
+
+def has_body(status):
+  # 1xx, 204 and 304 responses end at their headers, whatever framing headers they carry (RFC 9112 section 6.3)
+  return not (status is not None and (status.startswith('1') or status in ('204', '304')))
+
+
+def iter_framed(raw_response, response_headers, buffer_size: int = BUFFER_SIZE, status=None):
+  # Yields views into one reusable buffer, so each piece must be consumed (or copied) before the next is read
+  buffer = bytearray(buffer_size)
+  view = memoryview(buffer)
+  # readinto1 hands back whatever has arrived instead of waiting for the whole buffer to fill
+  readinto = getattr(raw_response, 'readinto1', raw_response.readinto)
+
+  def read_exactly(length):
+    while length:
+      n = readinto(view[:min(length, buffer_size)])
+      if not n:
+        # Anything short of what the framing promised is a cut-off body, not a complete one
+        raise ConnectionError(f"connection closed with {length} bytes of the body still to come")
+      length -= n
+      yield view[:n]
+
+  if not has_body(status):
+    return
+  elif response_headers.get('transfer-encoding') == 'chunked':
+    while True:
+      line = raw_response.readline()
+      if not line:
+        raise ConnectionError("connection closed before the last chunk")
+      size = line.split(b";", 1)[0].strip()
+      length = int(size, 16) if size else 0
+      if not length:
+        # Skip any trailers up to the blank line that ends the body
+        while raw_response.readline() not in [b'\r\n', b'\n', b'']:
+          pass
+        return
+      yield from read_exactly(length)
+      # need to read past \r\n
+      raw_response.readline()
+  elif 'content-length' in response_headers:
+    yield from read_exactly(int(response_headers['content-length']))
+  else:
+    while True:
+      n = readinto(view)
+      if not n:
+        return
+      yield view[:n]
+
+
+def decompressor(content_encoding):
+  if content_encoding == 'gzip':
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+  elif content_encoding == 'deflate':
+    return zlib.decompressobj(zlib.MAX_WBITS)
+  return None
+
+
+def iter_decompressed(chunks, content_encoding):
+  d = decompressor(content_encoding)
+  if d is None:
+    yield from chunks
+    return
+  started = False
+  for chunk in chunks:
+    try:
+      data = d.decompress(chunk)
+    except zlib.error:
+      if started or content_encoding != 'deflate':
+        raise
+      # Plenty of servers send raw deflate data without the zlib wrapper the spec asks for
+      d = zlib.decompressobj(-zlib.MAX_WBITS)
+      data = d.decompress(chunk)
+    started = True
+    while d.unused_data and content_encoding == 'gzip':
+      # A gzip body may hold several members back to back
+      rest = d.unused_data
+      data += d.flush()
+      d = decompressor(content_encoding)
+      data += d.decompress(rest)
+    if data:
+      yield data
+  data = d.flush()
+  if data:
+    yield data
+
+
+def iter_decoded(chunks, response_headers, encoding='utf-8'):
+  # An incremental decoder holds back the bytes of a character split across two chunks
+  decoder = codecs.getincrementaldecoder(encoding)()
+  for chunk in iter_decompressed(chunks, response_headers.get('content-encoding')):
+    text = decoder.decode(chunk)
+    if text:
+      yield text
+  text = decoder.decode(b'', final=True)
+  if text:
+    yield text
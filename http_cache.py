@@ -0,0 +1,244 @@
+import gzip
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from http_body import iter_decompressed
+
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+CACHEABLE_STATUSES = ['200']
+# Share of (Date - Last-Modified) a response with no explicit lifetime stays fresh for, per RFC 9111 4.2.2
+HEURISTIC_FRACTION = 0.1
+# Framing headers describe the original transfer, not the stored body, so a 304 must not overwrite them
+UNREFRESHABLE_HEADERS = ['content-length', 'content-encoding', 'transfer-encoding']
+
+
+def parse_cache_control(value: str):
+  directives = {}
+  for part in value.split(","):
+    part = part.strip()
+    if not part:
+      continue
+    if "=" in part:
+      name, arg = part.split("=", 1)
+      directives[name.strip().casefold()] = arg.strip().strip('"')
+    else:
+      directives[part.casefold()] = None
+  return directives
+
+
+def parse_date(value):
+  try:
+    return parsedate_to_datetime(value).timestamp()
+  except (TypeError, ValueError, IndexError):
+    return None
+
+
+def parse_seconds(value):
+  try:
+    return max(0, int(value))
+  except (TypeError, ValueError):
+    return 0
+
+
+class CacheEntry:
+  def __init__(self, url, status, response_headers, body, compressed, vary, request_time, response_time):
+    self.url = url
+    self.status = status
+    self.headers = response_headers
+    self.body = body
+    self.compressed = compressed
+    self.vary = vary
+    self.request_time = request_time
+    self.response_time = response_time
+    self.size = len(body) + sum(len(k) + len(v) for k, v in response_headers.items())
+
+  def directives(self):
+    return parse_cache_control(self.headers.get('cache-control', ''))
+
+  def freshness_lifetime(self):
+    directives = self.directives()
+    if 'max-age' in directives:
+      return parse_seconds(directives['max-age'])
+    date = parse_date(self.headers.get('date'))
+    if date is None:
+      date = self.response_time
+    if 'expires' in self.headers:
+      expires = parse_date(self.headers['expires'])
+      # An unparseable Expires means "already expired"
+      return max(0, expires - date) if expires is not None else 0
+    last_modified = parse_date(self.headers.get('last-modified'))
+    if last_modified is not None:
+      return max(0, date - last_modified) * HEURISTIC_FRACTION
+    return 0
+
+  def current_age(self, now=None):
+    if now is None:
+      now = time.time()
+    date = parse_date(self.headers.get('date'))
+    apparent_age = max(0, self.response_time - date) if date is not None else 0
+    response_delay = self.response_time - self.request_time
+    corrected_initial_age = max(apparent_age, parse_seconds(self.headers.get('age')) + response_delay)
+    return corrected_initial_age + (now - self.response_time)
+
+  def is_fresh(self, now=None):
+    if 'no-cache' in self.directives():
+      return False
+    return self.current_age(now) < self.freshness_lifetime()
+
+  def validators(self):
+    headers = []
+    if 'etag' in self.headers:
+      headers.append(f"If-None-Match: {self.headers['etag']}")
+    if 'last-modified' in self.headers:
+      headers.append(f"If-Modified-Since: {self.headers['last-modified']}")
+    return headers
+
+  def matches(self, request_headers):
+    return all(request_headers.get(name) == value for name, value in self.vary.items())
+
+  def metadata(self):
+    return {
+      "status": self.status,
+      "headers": self.headers,
+      "compressed": self.compressed,
+      "vary": self.vary,
+      "request_time": self.request_time,
+      "response_time": self.response_time,
+    }
+
+  def content(self):
+    body = gzip.decompress(self.body) if self.compressed else self.body
+    return body.decode(encoding='utf-8')
+
+
+class HTTPCache:
+  def __init__(self, max_bytes: int = CACHE_MAX_BYTES, compress: bool = False, disk=None):
+    self.max_bytes = max_bytes
+    self.compress = compress
+    # Optional DiskCacheStore that entries are written through to and loaded back from after a restart
+    self.disk = disk
+    self.entries = OrderedDict()
+    self.size = 0
+    # Preloads and pipelined batches fill the cache from other threads
+    self.lock = threading.RLock()
+
+  def __contains__(self, url):
+    with self.lock:
+      return url in self.entries
+
+  def lookup(self, url, request_headers):
+    with self.lock:
+      entry = self.entries.get(url)
+      if entry is None and self.disk:
+        entry = self.load(url)
+      if entry is None or not entry.matches(casefold_keys(request_headers)):
+        return None
+      self.entries.move_to_end(url)
+      return entry
+
+  def load(self, url):
+    record = self.disk.get(url)
+    if record is None:
+      return None
+    meta, body = record
+    entry = CacheEntry(url, meta['status'], meta['headers'], body, meta['compressed'], meta['vary'],
+                       meta['request_time'], meta['response_time'])
+    if entry.size > self.max_bytes:
+      return entry
+    self.entries[url] = entry
+    self.size += entry.size
+    self.evict()
+    return entry
+
+  def cacheable(self, status, response_headers):
+    directives = parse_cache_control(response_headers.get('cache-control', ''))
+    vary = response_headers.get('vary', '')
+    return status in CACHEABLE_STATUSES and 'no-store' not in directives and vary.strip() != '*'
+
+  def reusable(self, status, response_headers):
+    # Whether a later request could use the stored response: while it is fresh, or by revalidating it
+    if not self.cacheable(status, response_headers):
+      return False
+    directives = parse_cache_control(response_headers.get('cache-control', ''))
+    return ('etag' in response_headers or 'last-modified' in response_headers or 'expires' in response_headers
+            or parse_seconds(directives.get('max-age')) > 0)
+
+  def store(self, url, status, response_headers, body, request_headers, request_time, response_time):
+    # body may be any bytes-like object, which is kept as it is when there is nothing to decode
+    vary = response_headers.get('vary', '')
+    if not self.cacheable(status, response_headers):
+      self.forget(url)
+      return None
+
+    request_headers = casefold_keys(request_headers)
+    varied = {}
+    for name in vary.split(","):
+      name = name.strip().casefold()
+      if name:
+        varied[name] = request_headers.get(name)
+
+    content_encoding = response_headers.get('content-encoding')
+    if not (self.compress and content_encoding == 'gzip'):
+      if content_encoding:
+        body = b''.join(iter_decompressed([body], content_encoding))
+      if self.compress:
+        body = gzip.compress(body)
+
+    entry = CacheEntry(url, status, dict(response_headers), body, self.compress, varied, request_time, response_time)
+    with self.lock:
+      if self.disk:
+        self.disk.put(url, entry.metadata(), entry.body)
+      self.remove(url)
+      if entry.size > self.max_bytes:
+        return entry
+      self.entries[url] = entry
+      self.size += entry.size
+      self.evict()
+    return entry
+
+  def refresh(self, entry, response_headers, request_time, response_time):
+    with self.lock:
+      # The entry may have been evicted, or never fit in memory, since it was looked up
+      in_memory = self.entries.get(entry.url) is entry
+      if in_memory:
+        self.size -= entry.size
+      for header, value in response_headers.items():
+        if header not in UNREFRESHABLE_HEADERS:
+          entry.headers[header] = value
+      entry.request_time = request_time
+      entry.response_time = response_time
+      entry.size = len(entry.body) + sum(len(k) + len(v) for k, v in entry.headers.items())
+      if in_memory:
+        self.size += entry.size
+        self.evict()
+      if self.disk:
+        self.disk.put(entry.url, entry.metadata(), entry.body)
+
+  def forget(self, url):
+    # From memory and disk, e.g. once a new response says the old one mustn't be reused
+    with self.lock:
+      self.remove(url)
+      if self.disk:
+        self.disk.remove(url)
+
+  def remove(self, url):
+    with self.lock:
+      entry = self.entries.pop(url, None)
+      if entry:
+        self.size -= entry.size
+
+  def evict(self):
+    while self.size > self.max_bytes and self.entries:
+      url, entry = self.entries.popitem(last=False)
+      self.size -= entry.size
+
+  def clear(self):
+    with self.lock:
+      self.entries = OrderedDict()
+      self.size = 0
+
+
+def casefold_keys(headers):
+  return {name.casefold(): value for name, value in headers.items()}
@@ -5,16 +5,29 @@ from tkinter import font as tkfont
 from css import INHERITED_PROPERTIES
 from html_parser import Element, Text
 from draw import DrawText, DrawRect, DrawEmoji
+from traversal import pre_order, enter_exit
 import emoji
 
 HSTEP, VSTEP = 13, 18
 SCROLLBAR_WIDTH = 12
 FONTS = {}
 MEASURES = {}
+# Builds the font for (size, weight, style) in place of a Tk font, so pages can be laid out without a display
+font_backend = None
+
+
+def set_font_backend(backend):
+  global font_backend
+  font_backend = backend
+  # Fonts and measurements from one backend mean nothing to another
+  FONTS.clear()
+  MEASURES.clear()
 
 
 def get_font(size, weight, style):
   key = (size, weight, style)
+  if key not in FONTS and font_backend:
+    FONTS[key] = (font_backend(size, weight, style), None)
   if key not in FONTS:
     if "fixed_width" in style:
       s = style.replace("fixed_width", "").strip()
@@ -45,10 +58,8 @@ def get_measure(s, size, weight, style):
 
 
 def paint_tree(layout_object, display_list):
-  display_list.extend(layout_object.paint())
-
-  for child in layout_object.children:
-    paint_tree(child, display_list)
+  for obj in pre_order(layout_object):
+    display_list.extend(obj.paint())
 
 
 class DocumentLayout:
@@ -118,6 +129,16 @@ class BlockLayout:
       return "block"
 
   def layout(self):
+    # Each block is placed on the way down and sized on the way back up. A block's previous sibling has always
+    # been sized by the time the block itself is placed, since the walk finishes one subtree before the next.
+    for block, entering in enter_exit(self):
+      if entering:
+        block.place()
+      else:
+        block.size()
+
+  def place(self):
+    # Positions this block and creates its children, which the walk in layout() visits next
     self.x = self.parent.x
     if self.previous:
       self.y = self.previous.y + self.previous.height
@@ -142,10 +163,8 @@ class BlockLayout:
       self.recurse(self.node)
       self.flush()
 
-    for child in self.children:
-      child.layout()
-
-    if mode == "block":
+  def size(self):
+    if self.layout_mode() == "block":
       self.height = sum([child.height for child in self.children])
     else:
       self.height = self.cursor_y
@@ -198,29 +217,33 @@ class BlockLayout:
       self.pre = False
 
   def recurse(self, tree):
-    if isinstance(tree, Text):
-      words = []
-      if self.pre:
-        word = ''
-        for c in tree.text:
-          if c == ' ' or c == '\n':
-            if word:
-              words.append(word)
-            word = ''
-            words.append(c)
-          else:
-            word += c
-        if word:
-          words.append(word)
+    for node, entering in enter_exit(tree):
+      if isinstance(node, Text):
+        if entering:
+          self.text(node)
+      elif entering:
+        self.open_tag(node)
       else:
-        words = tree.text.split()
-      for word in words:
-        self.word(tree, word)
+        self.close_tag(node)
+
+  def text(self, node):
+    words = []
+    if self.pre:
+      word = ''
+      for c in node.text:
+        if c == ' ' or c == '\n':
+          if word:
+            words.append(word)
+          word = ''
+          words.append(c)
+        else:
+          word += c
+      if word:
+        words.append(word)
     else:
-      self.open_tag(tree)
-      for child in tree.children:
-        self.recurse(child)
-      self.close_tag(tree)
+      words = node.text.split()
+    for word in words:
+      self.word(node, word)
 
   def create_word(self, word, x=None, size=None, weight=None, style=None, centering=None, superscript=None, color=None):
     return {
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+from fetch import AsyncFetcher
+from html_parser import HTMLParser, find_tag_end
+from url import URL
+
+
+class PreloadScanner:
+  # Finds <link rel=stylesheet> tags in raw HTML without building a tree. Tags are found and split into
+  # attributes exactly the way HTMLParser does it, so the hrefs found here match the ones the real parse finds.
+  def __init__(self):
+    self.pending = ''
+    self.in_comment = False
+    self.attribute_parser = HTMLParser('')
+
+  def feed(self, chunk):
+    text = self.pending + chunk
+    hrefs = []
+    i = 0
+    while i < len(text):
+      if self.in_comment:
+        end = text.find("-->", i)
+        if end == -1:
+          # Keep enough of the tail to spot a "-->" that straddles the next chunk
+          i = max(i, len(text) - 2)
+          break
+        self.in_comment = False
+        i = end + 3
+        continue
+
+      start = text.find("<", i)
+      if start == -1:
+        i = len(text)
+        break
+      if text.startswith("<!--", start):
+        self.in_comment = True
+        # "<!-->" is an empty comment, so the "-->" may overlap the opening
+        i = start + 2
+        continue
+      end = find_tag_end(text, start + 1)
+      if end == -1:
+        i = start
+        break
+      tag = text[start + 1:end]
+      if tag[:4].casefold() == "link":
+        name, attributes = self.attribute_parser.get_attributes(tag)
+        if name == "link" and attributes.get("rel") == "stylesheet" and "href" in attributes:
+          hrefs.append(attributes["href"])
+      i = end + 1
+
+    self.pending = text[i:]
+    return hrefs
+
+
+class Preloader:
+  # Starts fetching stylesheets as soon as the scanner sees them, on an event loop in a background thread,
+  # so they download while the page is still being parsed.
+  def __init__(self, base: URL):
+    self.base = base
+    self.scanner = PreloadScanner()
+    self.fetches = {}
+    self.loop = None
+    self.thread = None
+    self.fetcher = None
+
+  def feed(self, chunk):
+    for href in self.scanner.feed(chunk):
+      if href not in self.fetches:
+        self.start(href)
+
+  def start(self, href):
+    if self.loop is None:
+      self.loop = asyncio.new_event_loop()
+      self.fetcher = AsyncFetcher()
+      self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+      self.thread.start()
+    self.fetches[href] = asyncio.run_coroutine_threadsafe(self.fetcher.fetch(self.base.resolve(href)), self.loop)
+
+  def take(self, href):
+    # Returns the in-flight fetch for href, if the scanner started one
+    return self.fetches.pop(href, None)
+
+  def close(self):
+    self.fetches = {}
+    if self.loop:
+      asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+      self.loop.call_soon_threadsafe(self.loop.stop)
+      self.thread.join()
+      self.loop.close()
+      self.loop = None
+
+  async def shutdown(self):
+    # Fetches nobody took are cancelled and waited for, then the executor that runs DNS lookups, so nothing
+    # is left running on the loop when it closes
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.get_running_loop().shutdown_default_executor()
@@ -0,0 +1,110 @@
+import ipaddress
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# getaddrinfo doesn't report record TTLs, so every answer is kept for the same fixed time
+DNS_TTL = 60
+NEGATIVE_TTL = 10
+PRERESOLVE_WORKERS = 4
+
+
+def is_ip_literal(host):
+  try:
+    ipaddress.ip_address(host)
+    return True
+  except ValueError:
+    return False
+
+
+def system_resolve(host, port):
+  infos = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)
+  return [info[4][0] for info in infos]
+
+
+class StubResolver:
+  # Answers from a fixed table instead of the network, for tests and offline use
+  def __init__(self, hosts):
+    self.hosts = hosts
+
+  def __call__(self, host, port):
+    if host not in self.hosts:
+      raise socket.gaierror(socket.EAI_NONAME, f"{host} is not in the stub resolver")
+    return list(self.hosts[host])
+
+
+class Resolver:
+  def __init__(self, backend=system_resolve, ttl: float = DNS_TTL, negative_ttl: float = NEGATIVE_TTL):
+    self.backend = backend
+    self.ttl = ttl
+    self.negative_ttl = negative_ttl
+    # host -> (expiry, addresses or the error the lookup raised)
+    self.cache = {}
+    self.pending = {}
+    self.lock = threading.Lock()
+    self.executor = None
+    self.hits = 0
+    self.misses = 0
+
+  def cached(self, host):
+    with self.lock:
+      if host in self.cache:
+        expiry, answer = self.cache[host]
+        if time.monotonic() < expiry:
+          return answer
+        del self.cache[host]
+    return None
+
+  def resolve(self, host, port=0):
+    if is_ip_literal(host):
+      return host
+
+    answer = self.cached(host)
+    if answer is None:
+      with self.lock:
+        future = self.pending.get(host)
+      if future:
+        # A pre-resolution for this host is already on its way; wait for it instead of asking twice
+        future.result()
+        answer = self.cached(host)
+    if answer is None:
+      self.misses += 1
+      answer = self.lookup(host, port)
+    else:
+      self.hits += 1
+
+    if isinstance(answer, Exception):
+      raise answer
+    return answer[0]
+
+  def lookup(self, host, port=0):
+    try:
+      answer = self.backend(host, port)
+      ttl = self.ttl
+    except OSError as e:
+      answer = e
+      ttl = self.negative_ttl
+    with self.lock:
+      self.cache[host] = (time.monotonic() + ttl, answer)
+    return answer
+
+  def preresolve(self, host, port=0):
+    if is_ip_literal(host) or self.cached(host) is not None:
+      return
+    with self.lock:
+      if host in self.pending:
+        return
+      if self.executor is None:
+        self.executor = ThreadPoolExecutor(PRERESOLVE_WORKERS, thread_name_prefix="preresolve")
+      future = self.executor.submit(self.lookup, host, port)
+      self.pending[host] = future
+    future.add_done_callback(lambda _: self.finish_preresolve(host))
+
+  def finish_preresolve(self, host):
+    with self.lock:
+      self.pending.pop(host, None)
+
+  def clear(self):
+    with self.lock:
+      self.cache = {}
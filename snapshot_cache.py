@@ -0,0 +1,238 @@
+import hashlib
+import marshal
+import os
+import zlib
+from array import array
+from collections import OrderedDict
+
+import layout
+from css import intern_style
+from disk_cache import atomic_write
+from dom_index import DocumentIndex
+from dom_store import NodeStore
+from draw import DrawText, DrawRect, DrawEmoji
+from html_parser import Text, CLEAN
+from traversal import pre_order
+
+SNAPSHOT_MAX_ENTRIES = 64
+SNAPSHOT_VERSION = 1
+
+
+def body_digest():
+  return hashlib.blake2b(digest_size=16)
+
+
+def dom_key(body: str):
+  digest = body_digest()
+  digest.update(body.encode('utf-8'))
+  return digest.hexdigest()
+
+
+def style_key(dom_key, stylesheets):
+  return dom_key, content_key(*stylesheets)
+
+
+def layout_key(style_key, width: int):
+  return style_key + (width,)
+
+
+def content_key(*parts: str):
+  digest = body_digest()
+  for part in parts:
+    data = part.encode('utf-8')
+    # Length-prefixed, so ("ab", "c") and ("a", "bc") hash differently
+    digest.update(len(data).to_bytes(8, 'little'))
+    digest.update(data)
+  return digest.hexdigest()
+
+
+class DOMSnapshot:
+  __slots__ = ('root', 'index', 'styled_with')
+
+  def __init__(self, root, index):
+    self.root = root
+    self.index = index
+    # The style key whose computed styles are currently on the tree's nodes, if any
+    self.styled_with = None
+
+
+class LayoutSnapshot:
+  # What a page needs once it is laid out: its height for scrolling, and the display list to draw
+  __slots__ = ('height', 'display_list')
+
+  def __init__(self, height, display_list):
+    self.height = height
+    self.display_list = display_list
+
+
+# Results of each pipeline stage, keyed by what they were computed from: the DOM by the body's hash, computed
+# styles by that plus a hash of the stylesheets, and layout by both plus the viewport width. Unchanged content
+# then costs a hash and a lookup rather than another parse, cascade and layout.
+class SnapshotCache:
+  def __init__(self, max_entries: int = SNAPSHOT_MAX_ENTRIES, directory=None):
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    # Entries are also written here, if given, so they outlive the process
+    self.directory = directory
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    self.hits = 0
+    self.misses = 0
+
+  def lookup(self, key, load):
+    if key in self.entries:
+      self.entries.move_to_end(key)
+      self.hits += 1
+      return self.entries[key]
+    value = self.load(key, load)
+    if value is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.remember(key, value)
+    return value
+
+  def remember(self, key, value):
+    self.entries[key] = value
+    self.entries.move_to_end(key)
+    while len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
+
+  def store(self, key, value, dump):
+    self.remember(key, value)
+    if self.directory:
+      try:
+        atomic_write(self.path(key), zlib.compress(marshal.dumps((SNAPSHOT_VERSION, key, dump(value)))))
+      except (OSError, ValueError):
+        # Not writable, or not something the disk format can hold; the entry still serves from memory
+        pass
+    return value
+
+  def path(self, key):
+    if isinstance(key, str):
+      name = f"dom-{key}"
+    elif len(key) == 2:
+      name = f"style-{key[0]}-{key[1]}"
+    else:
+      name = f"layout-{key[0]}-{key[1]}-{key[2]}"
+    return os.path.join(self.directory, name)
+
+  def load(self, key, load):
+    if not self.directory:
+      return None
+    try:
+      with open(self.path(key), 'rb') as f:
+        version, stored_key, data = marshal.loads(zlib.decompress(f.read()))
+    except (OSError, EOFError, ValueError, TypeError, zlib.error):
+      return None
+    # Tuples come back from marshal as tuples, so the stored key compares equal to the one asked for
+    if version != SNAPSHOT_VERSION or stored_key != key:
+      return None
+    return load(data)
+
+  def get_dom(self, key):
+    return self.lookup(key, load_dom)
+
+  def put_dom(self, key, root, index):
+    return self.store(key, DOMSnapshot(root, index), dump_dom)
+
+  def get_styles(self, key):
+    return self.lookup(key, load_styles)
+
+  def put_styles(self, key, root):
+    return self.store(key, [node.style for node in pre_order(root)], dump_styles)
+
+  def get_layout(self, key):
+    return self.lookup(key, load_layout)
+
+  def put_layout(self, key, height, display_list):
+    return self.store(key, LayoutSnapshot(height, display_list), dump_layout)
+
+  def forget(self, key):
+    # Only from memory; what is on disk still matches the key it was stored under
+    self.entries.pop(key, None)
+
+  def clear(self):
+    self.entries.clear()
+
+
+def apply_styles(root, styles):
+  for node, computed in zip(pre_order(root), styles):
+    node.style = computed
+    if not isinstance(node, Text):
+      node.dirty = CLEAN
+
+
+# The disk format is plain data that marshal can write: the DOM in NodeStore's parallel arrays, styles as a
+# table of distinct styles plus one index per node, and display list entries as tuples with font keys in
+# place of font objects.
+
+def dump_dom(snapshot):
+  store = NodeStore.from_tree(snapshot.root)
+  data = [value if store.is_text(i) else dict(value) for i, value in enumerate(store.data)]
+  return (store.tags, store.tag_id.tobytes(), store.parent.tobytes(), store.first_child.tobytes(),
+          store.next_sibling.tobytes(), data)
+
+
+def load_dom(data):
+  store = NodeStore()
+  store.tags, tag_id, parent, first_child, next_sibling, store.data = data
+  store.tag_ids = {tag: i for i, tag in enumerate(store.tags) if i != NodeStore.TEXT}
+  for name, raw in (('tag_id', tag_id), ('parent', parent), ('first_child', first_child),
+                    ('next_sibling', next_sibling)):
+    getattr(store, name).frombytes(raw)
+  root = store.to_tree()
+  index = DocumentIndex()
+  for node in pre_order(root):
+    if not isinstance(node, Text):
+      index.add(node)
+  return DOMSnapshot(root, index)
+
+
+def copy_dom(snapshot):
+  # A tree of its own with the same content
+  return load_dom(dump_dom(snapshot))
+
+
+def dump_styles(styles):
+  table = {}
+  indexes = array('i', (table.setdefault(tuple(computed.items()), len(table)) for computed in styles))
+  return list(table), indexes.tobytes()
+
+
+def load_styles(data):
+  table, raw = data
+  indexes = array('i')
+  indexes.frombytes(raw)
+  styles = [intern_style(dict(computed)) for computed in table]
+  return [styles[i] for i in indexes]
+
+
+def dump_layout(snapshot):
+  keys = {id(font): key for key, (font, label) in layout.FONTS.items()}
+  commands = []
+  for cmd in snapshot.display_list:
+    if isinstance(cmd, DrawText):
+      if id(cmd.font) not in keys:
+        # Laid out with a font that has since left layout.FONTS, e.g. through set_font_backend()
+        raise ValueError("display list uses a font with no key to store it under")
+      commands.append(("text", cmd.left, cmd.top, cmd.text, keys[id(cmd.font)], cmd.color))
+    elif isinstance(cmd, DrawRect):
+      commands.append(("rect", cmd.left, cmd.top, cmd.right, cmd.bottom, cmd.color))
+    elif isinstance(cmd, DrawEmoji):
+      commands.append(("emoji", cmd.left, cmd.top, cmd.emoji))
+  return snapshot.height, commands
+
+
+def load_layout(data):
+  height, commands = data
+  display_list = []
+  for kind, *fields in commands:
+    if kind == "text":
+      left, top, text, font_key, color = fields
+      display_list.append(DrawText(left, top, text, layout.get_font(*font_key), color))
+    elif kind == "rect":
+      display_list.append(DrawRect(*fields))
+    else:
+      display_list.append(DrawEmoji(*fields))
+  return LayoutSnapshot(height, display_list)
@@ -0,0 +1,78 @@
+import unittest
+import os
+import subprocess
+import sys
+import tempfile
+
+import layout
+from benchmark import (StubFont, generate_document, generate_stylesheet, synthetic_cases, corpus_cases, run_case,
+                       compare, save_baseline, load_baseline, STAGES)
+from html_parser import HTMLParser
+
+
+class TestBenchmark(unittest.TestCase):
+  def setUp(self):
+    layout.set_font_backend(StubFont)
+
+  def tearDown(self):
+    layout.set_font_backend(None)
+
+  def test_generate_document(self):
+    self.assertEqual(generate_document(seed=1), generate_document(seed=1))
+    self.assertNotEqual(generate_document(seed=1), generate_document(seed=2))
+
+    body = generate_document(paragraphs=30, depth=7, entity_density=0.5, pre_blocks=3)
+    self.assertEqual(body.count("<pre>"), 3)
+    self.assertEqual(body.count("<p"), 30 + body.count("<pre>"))
+    self.assertGreater(body.count("&"), 100)
+
+    # The deepest element sits under html, body and depth sections
+    def depth(node):
+      return 1 + max((depth(child) for child in node.children), default=0)
+    self.assertGreaterEqual(depth(HTMLParser(body).parse()), 2 + 7)
+
+  def test_generate_stylesheet(self):
+    self.assertEqual(generate_stylesheet(25).count("{"), 25)
+
+  def test_run_case(self):
+    result = run_case(generate_document(paragraphs=10), generate_stylesheet(5), repeat=2)
+
+    self.assertEqual(list(result["seconds"]), STAGES)
+    self.assertEqual(list(result["peak_memory"]), STAGES)
+    self.assertGreater(result["nodes"], 10)
+    self.assertGreater(result["commands"], 0)
+    self.assertEqual(result["throughput"]["parse"], result["bytes"] / result["seconds"]["parse"])
+
+  def test_cases(self):
+    self.assertEqual(list(synthetic_cases(["base", "deep"])), ["synthetic/base", "synthetic/deep"])
+    with tempfile.TemporaryDirectory() as directory:
+      with open(os.path.join(directory, "page.html"), "w") as f:
+        f.write("<p>Hello</p>")
+      with open(os.path.join(directory, "page.css"), "w") as f:
+        f.write("p { color: red; }")
+      self.assertEqual(corpus_cases(directory), {"corpus/page.html": ("<p>Hello</p>", "p { color: red; }")})
+
+  def test_compare(self):
+    baseline = {"a": {"seconds": {"parse": 1.0, "style": 1.0}}, "b": {"error": "RecursionError"}}
+    results = {"a": {"seconds": {"parse": 1.2, "style": 1.5}}, "b": {"seconds": {"parse": 9.0}},
+               "c": {"seconds": {"parse": 9.0}}}
+
+    self.assertEqual(compare(results, baseline, threshold=0.25), [("a", "style", 1.0, 1.5)])
+    self.assertEqual(compare(results, baseline, threshold=0.1), [("a", "parse", 1.0, 1.2), ("a", "style", 1.0, 1.5)])
+
+  def test_baseline_round_trip(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, "baseline.json")
+      self.assertIsNone(load_baseline(path))
+      save_baseline({"a": {"seconds": {"parse": 0.5}}}, path)
+      self.assertEqual(load_baseline(path), {"a": {"seconds": {"parse": 0.5}}})
+
+  def test_missing_baseline_fails(self):
+    with tempfile.TemporaryDirectory() as directory:
+      command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark.py"),
+                 "--cases", "base", "--no-corpus", "--repeat", "1", "--no-memory",
+                 "--baseline", os.path.join(directory, "missing.json")]
+      failed = subprocess.run(command, capture_output=True, text=True)
+      self.assertEqual(failed.returncode, 1)
+      self.assertIn("No baseline", failed.stderr)
+      self.assertEqual(subprocess.run(command + ["--allow-missing-baseline"], capture_output=True).returncode, 0)
@@ -1,13 +1,17 @@
 import unittest
 import json
+import os
+import tempfile
 from unittest.mock import patch
 import io
 import re
 import time
 import gzip
 
-from browser import Browser
+from browser import Browser, SNAPSHOT_LOOKAHEAD
+from preload import Preloader
 from url import URL
+from tls import TLSConfig
 from test_utils import socket, ssl
 
 
@@ -48,16 +52,17 @@ class TestBrowserLex(unittest.TestCase):
 class TestBrowserLoad(unittest.TestCase):
   # Tests for load()
 
-  # When these tests run all in a suite, the global sockets dict is populated and may cause
+  # When these tests run all in a suite, the global connection pool is populated and may cause
   # tests with similar URLs to reuse sockets. Specific tests which assert on new sockets or socket reuse
   # messages have unique hostnames to prevent this. JFYI
-  # potential TODO: import sockets from browser and reset it as part of of setUp()?
+  # potential TODO: import pool from url and close_all() as part of of setUp()?
 
   def setUp(self):
-    socket.patch().start()
+    self.socket_patch = socket.patch()
+    self.socket_patch.start()
 
   def tearDown(self):
-    socket.patch().stop()
+    self.socket_patch.stop()
 
   def test_load_http(self, mock_stdout):
     url = "http://load.http/examples/load_http.html"
@@ -70,7 +75,8 @@ class TestBrowserLoad(unittest.TestCase):
     self.assertIn('<Body text>', mock_stdout.getvalue())
 
   def test_load_https(self, mock_stdout):
-    ssl.patch().start()
+    self.enterContext(ssl.patch())
+    self.enterContext(patch('url.tls', TLSConfig()))
     url = "https://browser.engineering/examples/example1-simple.html"
     socket.respond(
       url, b"HTTP/1.0 200 OK\r\n" + b"Header1: Value1\r\n\r\n" + b"&lt;Body text&gt;"
@@ -116,11 +122,12 @@ class TestBrowserLoad(unittest.TestCase):
   def test_load_reused_sockets(self, mock_stdout):
     url1 = "http://load_reused_sockets.org/examples/load_reused_sockets.html"
     url2 = "http://load_reused_sockets.org/examples/load_reused_sockets2.html"
+    # Only a response with explicit framing lets the socket go back to the pool
     socket.respond(
-      url1, b"HTTP/1.0 200 OK\r\n" + b"Header1: Value1\r\n\r\n" + b"<pre>Body text 1</pre>"
+      url1, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 22\r\n\r\n" + b"<pre>Body text 1</pre>"
     )
     socket.respond(
-      url2, b"HTTP/1.0 200 OK\r\n" + b"Header1: Value1\r\n\r\n" + b"<pre>Example text 2</pre>"
+      url2, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 25\r\n\r\n" + b"<pre>Example text 2</pre>"
     )
     Browser().load(URL(url1))
     Browser().load(URL(url2))
@@ -288,3 +295,83 @@ class TestBrowserLoad(unittest.TestCase):
     Browser().load(URL(url))
 
     self.assertIn("Body text", mock_stdout.getvalue())
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestBrowserSharedTree(unittest.TestCase):
+  # Tabs that load the same body share one cached tree until one of them changes it
+  url = "data:text/html,<p>Shared <b>text</b></p><div>x</div>"
+
+  def color(self, browser, tag):
+    return browser.index.get_elements_by_tag(tag)[0].style["color"]
+
+  def test_set_stylesheets_copies_shared_tree(self, mock_stdout):
+    a, b = Browser(), Browser()
+    a.load(URL(self.url))
+    b.load(URL(self.url))
+    self.assertIs(a.nodes, b.nodes)
+
+    a.set_stylesheets(["p { color: red; }"])
+
+    self.assertIsNot(a.nodes, b.nodes)
+    self.assertEqual(self.color(a, "p"), "red")
+    self.assertEqual(self.color(b, "p"), "black")
+
+  def test_own_nodes_before_changes(self, mock_stdout):
+    a, b = Browser(), Browser()
+    a.load(URL(self.url))
+    b.load(URL(self.url))
+
+    a.own_nodes()
+    a.index.get_elements_by_tag("div")[0].set_attribute("style", "color: blue")
+    a.restyle()
+
+    self.assertEqual(self.color(a, "div"), "blue")
+    self.assertEqual(self.color(b, "div"), "black")
+    self.assertEqual(b.index.get_elements_by_tag("div")[0].attributes, {})
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestBrowserPreloader(unittest.TestCase):
+  def test_closed_when_load_fails(self, mock_stdout):
+    browser = Browser()
+    with patch('browser.Preloader.close') as close, \
+        patch.object(Browser, 'parse_cached', side_effect=ConnectionError("reset mid-body")):
+      with self.assertRaises(ConnectionError):
+        browser.load(URL("data:text/html,<p>Hi</p>"))
+    close.assert_called_once()
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestBrowserSnapshots(unittest.TestCase):
+  def test_large_file_reload_skips_parse(self, mock_stdout):
+    # Big enough that the file arrives in several chunks
+    with tempfile.NamedTemporaryFile("w", suffix=".html", delete=False) as f:
+      f.write("<p>Reloaded text</p>\n" * 10000)
+    self.addCleanup(os.unlink, f.name)
+    url = f"file://{f.name}"
+
+    first = Browser()
+    first.load(URL(url))
+    second = Browser()
+    with patch.object(Browser, 'parse_progressively') as parse:
+      second.load(URL(url))
+
+    parse.assert_not_called()
+    self.assertIs(second.nodes, first.nodes)
+
+  def test_slow_body_parsed_as_it_arrives(self, mock_stdout):
+    def slow():
+      yield "<p>First</p>"
+      time.sleep(SNAPSHOT_LOOKAHEAD * 2)
+      yield "<p>Second</p>"
+
+    browser = Browser()
+    fed = []
+    parse = browser.parse_progressively
+    with patch.object(browser, 'parse_progressively',
+                      lambda url, body, preloader: parse(url, (fed.append(chunk) or chunk for chunk in body), preloader)):
+      key, snapshot = browser.parse_cached(URL("http://slow.test/"), slow(), Preloader(URL("http://slow.test/")))
+
+    self.assertEqual(fed, ["<p>First</p>", "<p>Second</p>"])
+    self.assertEqual(len(snapshot.index.get_elements_by_tag("p")), 2)
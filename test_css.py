@@ -0,0 +1,228 @@
+import unittest
+import io
+from unittest.mock import patch
+
+import css
+from css import (style, style_node, restyle, CSSParser, RuleIndex, AncestorFilter, cascade_priority,
+                 filter_stats)
+from html_parser import HTMLParser, Element, Text
+from traversal import pre_order
+
+
+def parse_rules(text):
+  with patch('sys.stdout', new_callable=io.StringIO):
+    return sorted(CSSParser(text).parse(), key=cascade_priority)
+
+
+class AnySelector:
+  # A selector with no tag to bucket it by
+  priority = 0
+
+  def matches(self, node, ancestors=None):
+    return isinstance(node, Element)
+
+
+class TestRuleIndex(unittest.TestCase):
+  def test_buckets(self):
+    rules = parse_rules("p { color: red; } div p { color: blue; } b { color: green; }")
+    index = RuleIndex(rules)
+
+    self.assertEqual([body for selector, body in index.by_tag["p"]], [{"color": "red"}, {"color": "blue"}])
+    self.assertEqual(list(index.by_tag), ["p", "b"])
+    self.assertEqual(len(index), 3)
+    self.assertEqual(list(index), rules)
+
+  def test_universal_rules_keep_their_place(self):
+    first, second = parse_rules("p { color: red; } b { color: green; }")
+    universal = (AnySelector(), {"color": "gray"})
+    index = RuleIndex([first, universal, second])
+
+    self.assertEqual(index.by_tag["p"], [first, universal])
+    self.assertEqual(index.by_tag["b"], [universal, second])
+    self.assertEqual(index.candidates(Element("span", {}, None)), [universal])
+
+  def test_same_styles_as_testing_every_rule(self):
+    rules = parse_rules("""
+      p { color: red; } div p { color: blue; } section div p { font-size: 120%; } i { font-style: italic; }
+      div i { color: green; } b { font-weight: bold; } section b { color: purple; } h1 { font-size: 150%; }
+    """)
+    body = "<section><div><p>One <i>two</i> <b>three</b></p></div><h1>Four</h1></section><p><b>Five</b></p>"
+
+    indexed = HTMLParser(body).parse()
+    style(indexed, RuleIndex(rules))
+    expected = HTMLParser(body).parse()
+    for node in pre_order(expected):
+      style_node(node, rules)
+
+    self.assertEqual([node.style for node in pre_order(indexed)], [node.style for node in pre_order(expected)])
+
+
+class TestAncestorFilter(unittest.TestCase):
+  def setUp(self):
+    filter_stats.reset()
+
+  def test_push_pop(self):
+    ancestors = AncestorFilter(64)
+    self.assertFalse(ancestors.may_contain("div"))
+    ancestors.push("div")
+    ancestors.push("div")
+    ancestors.push("p")
+    self.assertTrue(ancestors.may_contain("div"))
+    ancestors.pop("div")
+    self.assertTrue(ancestors.may_contain("div"))
+    ancestors.pop("div")
+    self.assertFalse(ancestors.may_contain("div"))
+    self.assertTrue(ancestors.may_contain("p"))
+
+  def test_rejects_without_walking(self):
+    tree = HTMLParser("<section><p>One</p></section><div><p>Two</p></div>").parse()
+    style(tree, parse_rules("div p { color: red; } article section p { color: blue; }"))
+
+    colors = [node.style["color"] for node in pre_order(tree) if getattr(node, "tag", None) == "p"]
+    self.assertEqual(colors, ["black", "red"])
+    # Both rules are rejected for the first paragraph, and only the second one for the other
+    self.assertEqual(filter_stats.as_dict(), {"rejected": 3, "walked": 1, "false_positives": 0})
+
+  def test_restyle_subtree(self):
+    tree = HTMLParser("<div><section><p>One</p></section></div>").parse()
+    rules = parse_rules("div p { color: red; }")
+    style(tree, rules)
+    section = tree.children[0].children[0].children[0]
+    section.children[0].style = {}
+
+    # Styling just the section still knows the div is above it
+    style(section, rules)
+    self.assertEqual(section.children[0].style["color"], "red")
+
+
+class TestStyleSharing(unittest.TestCase):
+  def test_shared_and_interned(self):
+    tree = HTMLParser("<ul><li>One</li><li>Two</li><li style='color: red'>Three</li></ul>"
+                      "<ol><li>Four</li></ol>").parse()
+    style(tree, parse_rules("ul li { color: blue; }"))
+    ul, ol = tree.children[0].children
+    first, second, inline = ul.children
+
+    self.assertIs(first.style, second.style)
+    self.assertIs(first.children[0].style, second.children[0].style)
+    self.assertEqual(first.style["color"], "blue")
+    self.assertEqual(inline.style["color"], "red")
+    # Same tag and parent style, but only one of them is inside a ul
+    self.assertIs(ol.style, ul.style)
+    self.assertEqual(ol.children[0].style["color"], "black")
+    with self.assertRaises(TypeError):
+      first.style["color"] = "green"
+
+  def test_equal_styles_are_one_object(self):
+    first = HTMLParser("<p>One</p>").parse()
+    second = HTMLParser("<div><b>Two</b></div>").parse()
+    style(first, parse_rules(""))
+    style(second, parse_rules("b { font-weight: normal; }"))
+    self.assertIs(first.children[0].children[0].style, second.children[0].children[0].children[0].style)
+
+  def test_intern_table_is_bounded(self):
+    with patch.object(css, 'COMPUTED_STYLES', css.OrderedDict()), \
+         patch.object(css, 'COMPUTED_STYLES_MAX_ENTRIES', 4):
+      tree = HTMLParser("<p>kept</p>").parse()
+      style(tree, parse_rules("p { color: green; }"))
+      kept = tree.children[0].children[0].style
+      for size in range(10):
+        page = HTMLParser("<p>text</p>").parse()
+        style(page, parse_rules(f"p {{ font-size: {size + 20}px; }}"))
+      self.assertLessEqual(len(css.COMPUTED_STYLES), 4)
+      # Evicted, but still on the nodes that had it
+      self.assertFalse(any(computed is kept for computed in css.COMPUTED_STYLES.values()))
+      self.assertEqual(tree.children[0].children[0].style["color"], "green")
+
+
+class TestRestyle(unittest.TestCase):
+  BODY = "<div><p>One <b>two</b></p><p>Three</p></div><section><p>Four</p></section>"
+  RULES = "div p { color: blue; } b { font-weight: bold; } section { font-size: 120%; }"
+
+  def setUp(self):
+    self.rules = parse_rules(self.RULES)
+    self.tree = HTMLParser(self.BODY).parse()
+    style(self.tree, self.rules)
+    self.div, self.section = self.tree.children[0].children
+
+  def restyled(self):
+    # Restyles incrementally, returning the nodes that were styled again
+    with patch('css.style_node', wraps=style_node) as styled:
+      restyle(self.tree, self.rules)
+    return [call.args[0] for call in styled.call_args_list]
+
+  def assert_same_as_full_style(self):
+    expected = copy_tree(self.tree)
+    style(expected, self.rules)
+    self.assertEqual([node.style for node in pre_order(self.tree)], [node.style for node in pre_order(expected)])
+
+  def test_nothing_dirty(self):
+    self.assertEqual(self.restyled(), [])
+
+  def test_attribute_change(self):
+    first, second = self.div.children
+    second.set_attribute("class", "x")
+
+    self.assertEqual(self.restyled(), [second])
+    self.assertEqual(self.restyled(), [])
+
+  def test_inherited_change_reaches_children(self):
+    first = self.div.children[0]
+    first.set_attribute("style", "color: red")
+
+    restyled = self.restyled()
+    self.assertEqual(restyled[0], first)
+    self.assertEqual([node.style["color"] for node in pre_order(first)], ["red", "red", "red", "red"])
+    self.assertEqual(len(restyled), 4)
+    self.assert_same_as_full_style()
+
+  def test_non_inherited_change_stops(self):
+    first = self.div.children[0]
+    first.set_attribute("style", "background-color: gray")
+
+    self.assertEqual(self.restyled(), [first])
+    self.assertEqual(first.style["background-color"], "gray")
+
+  def test_removed_attribute(self):
+    first = self.div.children[0]
+    first.set_attribute("style", "color: red")
+    restyle(self.tree, self.rules)
+    first.remove_attribute("style")
+    restyle(self.tree, self.rules)
+
+    self.assertEqual(first.style["color"], "blue")
+    self.assert_same_as_full_style()
+
+  def test_new_children(self):
+    paragraph = Element("p", {}, self.section)
+    self.section.append_child(paragraph)
+    paragraph.append_child(Text("Five", paragraph))
+
+    self.assertEqual(self.restyled(), [paragraph, paragraph.children[0]])
+    self.assertEqual(paragraph.style["font-size"], self.section.children[0].style["font-size"])
+
+  def test_new_stylesheets(self):
+    self.rules = parse_rules("section p { color: green; }")
+    self.tree.mark_subtree_dirty()
+    restyle(self.tree, self.rules)
+
+    self.assertEqual(self.section.children[0].style["color"], "green")
+    self.assert_same_as_full_style()
+
+  def test_restyle_subtree_of_dirty_tree(self):
+    self.div.set_attribute("style", "font-size: 200%")
+    self.section.children[0].set_attribute("id", "x")
+    restyle(self.div, self.rules)
+
+    self.assertEqual(self.div.children[1].style["font-size"], "32.0px")
+    # The section is still waiting for the next restyle of the whole tree
+    self.assertEqual(self.restyled(), [self.section.children[0]])
+
+
+def copy_tree(node, parent=None):
+  if isinstance(node, Text):
+    return Text(node.text, parent)
+  copy = Element(node.tag, node.attributes, parent)
+  for child in node.children:
+    copy.append_child(copy_tree(child, copy))
+  return copy
@@ -0,0 +1,118 @@
+import unittest
+import os
+import tempfile
+import time
+
+from disk_cache import DiskCacheStore, INITIAL_SLOTS
+from http_cache import HTTPCache
+
+HEADERS = {"Host": "disk.test", "Accept-Encoding": "gzip", "User-Agent": "christalee"}
+
+
+class TestDiskCacheStore(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.stores = []
+
+  def tearDown(self):
+    for store in self.stores:
+      store.close()
+    self.tmp.cleanup()
+
+  def open_store(self, **kwargs):
+    store = DiskCacheStore(self.tmp.name, **kwargs)
+    self.stores.append(store)
+    return store
+
+  def test_round_trip(self):
+    store = self.open_store()
+    store.put("http://disk.test/", {"status": "200"}, b"Body")
+
+    meta, body = store.get("http://disk.test/")
+    self.assertEqual(meta["status"], "200")
+    self.assertEqual(body, b"Body")
+    self.assertIsNone(store.get("http://disk.test/missing"))
+
+  def test_survives_reopen(self):
+    self.open_store().put("http://disk.test/", {"status": "200"}, b"Body")
+
+    meta, body = self.open_store().get("http://disk.test/")
+    self.assertEqual(body, b"Body")
+
+  def test_content_addressed_bodies(self):
+    store = self.open_store()
+    store.put("http://disk.test/a", {}, b"Same body")
+    store.put("http://disk.test/b", {}, b"Same body")
+
+    self.assertEqual(len(os.listdir(os.path.join(self.tmp.name, "bodies"))), 1)
+    store.remove("http://disk.test/a")
+    self.assertEqual(store.get("http://disk.test/b")[1], b"Same body")
+    store.remove("http://disk.test/b")
+    self.assertEqual(os.listdir(os.path.join(self.tmp.name, "bodies")), [])
+
+  def test_size_eviction(self):
+    store = self.open_store(max_bytes=250)
+    for name in ["a", "b", "c"]:
+      store.put(f"http://disk.test/{name}", {}, name.encode('utf-8') * 100)
+      time.sleep(0.01)
+      if name == "b":
+        store.get("http://disk.test/a")
+
+    self.assertIsNotNone(store.get("http://disk.test/a"))
+    self.assertIsNone(store.get("http://disk.test/b"))
+    self.assertIsNotNone(store.get("http://disk.test/c"))
+    self.assertLessEqual(store.size(), 250)
+
+  def test_counts_match_index(self):
+    store = self.open_store(max_bytes=4000)
+    for i in range(INITIAL_SLOTS):
+      # Shared bodies, replaced bodies, removals, a resize and evictions along the way
+      store.put(f"http://disk.test/{i % 700}", {}, str(i % 13).encode('utf-8') * (i % 5 + 1))
+      if i % 9 == 0:
+        store.remove(f"http://disk.test/{i // 2}")
+
+    records = [record for _, record in store.records()]
+    bodies = {record[1]: record[2] for record in records}
+    self.assertEqual(store.counts()["live"], len(records))
+    self.assertEqual(store.size(), sum(bodies.values()))
+    self.assertLessEqual(store.size(), 4000)
+    self.assertEqual({record[0]: record[1] for _, record in store.records(bodies=True)},
+                     {body: sum(1 for record in records if record[1] == body) for body in bodies})
+    self.assertEqual(sorted(os.listdir(os.path.join(self.tmp.name, "bodies"))), sorted(body.hex() for body in bodies))
+
+  def test_replaces_old_index(self):
+    with open(os.path.join(self.tmp.name, "index"), "wb") as f:
+      f.write(b"BECACHE1" + bytes(64))
+
+    store = self.open_store()
+    store.put("http://disk.test/", {}, b"Body")
+    self.assertEqual(self.open_store().get("http://disk.test/")[1], b"Body")
+
+  def test_corrupt_body_is_a_miss(self):
+    store = self.open_store()
+    store.put("http://disk.test/", {}, b"Body")
+    for name in os.listdir(os.path.join(self.tmp.name, "bodies")):
+      with open(os.path.join(self.tmp.name, "bodies", name), "wb") as f:
+        f.write(b"Torn")
+
+    self.assertIsNone(store.get("http://disk.test/"))
+
+  def test_resize_seen_by_other_store(self):
+    first = self.open_store()
+    second = self.open_store()
+    count = INITIAL_SLOTS
+    for i in range(count):
+      second.put(f"http://disk.test/{i}", {}, str(i).encode('utf-8'))
+
+    self.assertGreater(second.slots, INITIAL_SLOTS)
+    self.assertEqual(first.get(f"http://disk.test/{count - 1}")[1], str(count - 1).encode('utf-8'))
+    self.assertEqual(first.slots, second.slots)
+
+  def test_http_cache_write_through(self):
+    now = time.time()
+    HTTPCache(disk=self.open_store()).store("http://disk.test/", "200", {"cache-control": "max-age=60"}, b"Body",
+                                            HEADERS, now, now)
+
+    entry = HTTPCache(disk=self.open_store()).lookup("http://disk.test/", HEADERS)
+    self.assertTrue(entry.is_fresh())
+    self.assertEqual(entry.content(), "Body")
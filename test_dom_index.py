@@ -0,0 +1,81 @@
+import unittest
+
+from css import CSSParser
+from html_parser import HTMLParser
+
+BODY = """<link rel=stylesheet href=a.css>
+<div id=main class="content wide"><p class=intro>one</p><section><p id=deep>two</p></section></div>
+<p class="intro">three</p><div id=main>duplicate id</div>"""
+
+
+class TestDocumentIndex(unittest.TestCase):
+  def setUp(self):
+    self.parser = HTMLParser(BODY)
+    self.tree = self.parser.parse()
+    self.index = self.parser.index
+
+  def text(self, elements):
+    return [element.children[0].text for element in elements]
+
+  def test_by_tag(self):
+    self.assertEqual(self.text(self.index.get_elements_by_tag("p")), ["one", "two", "three"])
+    self.assertEqual(self.index.get_elements_by_tag("LINK")[0].attributes["href"], "a.css")
+    self.assertEqual([element.tag for element in self.index.get_elements_by_tag("html")], ["html"])
+
+  def test_by_id(self):
+    self.assertEqual(self.index.get_element_by_id("main").attributes["class"], "content wide")
+    self.assertIsNone(self.index.get_element_by_id("missing"))
+
+  def test_by_class_and_attribute(self):
+    self.assertEqual(self.text(self.index.get_elements_by_class("intro")), ["one", "three"])
+    self.assertEqual(len(self.index.get_elements_by_class("wide")), 1)
+    self.assertEqual([element.tag for element in self.index.get_elements_with_attribute("id")], ["div", "p", "div"])
+
+  def test_query_selector_all(self):
+    self.assertEqual(self.text(self.index.query_selector_all("div p")), ["one", "two"])
+    self.assertEqual(self.text(self.index.query_selector_all("div section p")), ["two"])
+    self.assertEqual(self.text(self.index.query_selector_all("#main .intro")), ["one"])
+    self.assertEqual(self.text(self.index.query_selector_all(CSSParser("section p").selector())), ["two"])
+
+  def test_matches_tree(self):
+    # Everything the parser indexed is in the tree, in the same order
+    def walk(node):
+      yield node
+      for child in node.children:
+        yield from walk(child)
+
+    in_tree = [node for node in walk(self.tree) if getattr(node, "tag", None) == "p"]
+    self.assertEqual(self.index.get_elements_by_tag("p"), in_tree)
+
+  def test_incremental(self):
+    parser = HTMLParser('')
+    parser.feed("<ul><li>a</li>")
+    self.assertEqual(len(parser.index.get_elements_by_tag("li")), 1)
+    parser.feed("<li>b</li></ul>")
+    parser.finish()
+    self.assertEqual(self.text(parser.index.query_selector_all("ul li")), ["a", "b"])
+
+  def test_attribute_changes(self):
+    one, two, three = self.index.get_elements_by_tag("p")
+    three.set_attribute("id", "x")
+    self.assertIs(self.index.get_element_by_id("x"), three)
+    # Gaining an attribute keeps the lists in document order
+    one.set_attribute("id", "y")
+    self.assertEqual([element.tag for element in self.index.get_elements_with_attribute("id")],
+                     ["div", "p", "p", "p", "div"])
+    self.assertEqual(self.index.get_elements_with_attribute("id")[1], one)
+
+    three.set_attribute("class", "outro")
+    self.assertEqual(self.text(self.index.get_elements_by_class("intro")), ["one"])
+    self.assertEqual(self.text(self.index.query_selector_all(".outro")), ["three"])
+
+    three.remove_attribute("id")
+    self.assertIsNone(self.index.get_element_by_id("x"))
+    self.assertNotIn(three, self.index.get_elements_with_attribute("id"))
+
+  def test_duplicate_id_changes(self):
+    first, second = self.index.get_elements_with_attribute("id")[0], self.index.get_elements_with_attribute("id")[2]
+    first.remove_attribute("id")
+    self.assertIs(self.index.get_element_by_id("main"), second)
+    first.set_attribute("id", "main")
+    self.assertIs(self.index.get_element_by_id("main"), first)
@@ -0,0 +1,54 @@
+import unittest
+
+from dom_store import NodeStore, NodeStoreParser
+from html_parser import HTMLParser, EMPTY_ATTRIBUTES
+from test_html_parser import dump
+
+BODY = "<title>T</title><div class=a><p>one <b>two</b></p><br><p id=x>three</p></div>tail"
+
+
+class TestNodeStore(unittest.TestCase):
+  def test_parser_matches_tree(self):
+    store = NodeStoreParser(BODY).parse()
+
+    self.assertEqual(dump(store.to_tree()), dump(HTMLParser(BODY).parse()))
+
+  def test_from_tree_round_trip(self):
+    tree = HTMLParser(BODY).parse()
+    store = NodeStore.from_tree(tree)
+
+    self.assertEqual(dump(store.to_tree()), dump(tree))
+
+  def test_navigation(self):
+    store = NodeStoreParser(BODY).parse()
+
+    self.assertEqual(store.tag(0), "html")
+    head, body = store.children(0)
+    self.assertEqual((store.tag(head), store.tag(body)), ("head", "body"))
+    div, tail = store.children(body)
+    self.assertEqual(store.attributes(div), {"class": "a"})
+    self.assertTrue(store.is_text(tail))
+    self.assertEqual(store.text(tail), "tail")
+    self.assertEqual(store.parent[tail], body)
+    self.assertEqual([store.tag(child) for child in store.children(div)], ["p", "br", "p"])
+    self.assertIs(store.attributes(tail), EMPTY_ATTRIBUTES)
+
+  def test_descendants_in_document_order(self):
+    store = NodeStoreParser(BODY).parse()
+    tags = [store.tag(node) for node in store.descendants()]
+
+    self.assertEqual(tags, ["html", "head", "title", "#text", "body", "div", "p", "#text", "b", "#text", "br", "p",
+                            "#text", "#text"])
+
+  def test_tags_stored_once(self):
+    store = NodeStoreParser("<p>a</p>" * 50).parse()
+
+    self.assertEqual(store.tags, ["#text", "html", "body", "p"])
+    self.assertEqual(len(store), 102)
+
+  def test_element_named_text(self):
+    tree = HTMLParser('<#text a=1>hi').parse()
+    store = NodeStore.from_tree(tree)
+
+    self.assertEqual(dump(store.to_tree()), dump(tree))
+    self.assertEqual(dump(NodeStoreParser('<#text a=1>hi').parse().to_tree()), dump(tree))
@@ -0,0 +1,52 @@
+import unittest
+import os
+import tempfile
+from unittest.mock import patch
+
+import entities
+from entities import decode, incomplete_reference, load_entities
+
+
+class TestEntities(unittest.TestCase):
+  def test_named(self):
+    self.assertEqual(decode("&lt;div&gt; &amp; &notin;"), "<div> & ∉")
+
+  def test_numeric(self):
+    self.assertEqual(decode("&#60;&#x3C;&#X3c;&#8212;"), "<<<—")
+    self.assertEqual(decode("&#0;&#xD800;&#x110000;"), "���")
+    # References to the C1 controls mean what windows-1252 put there
+    self.assertEqual(decode("&#150;"), "–")
+
+  def test_legacy_without_semicolon(self):
+    self.assertEqual(decode("&copy 2024 &amp"), "© 2024 &")
+    self.assertEqual(decode("&copy2024"), "©2024")
+    # Longest match: "&notin;" is one entity, "&notit;" is "&not" followed by "it;"
+    self.assertEqual(decode("&notin; &notit;"), "∉ ¬it;")
+
+  def test_unknown(self):
+    self.assertEqual(decode("&asdf;"), "")
+    self.assertEqual(decode("AT&T & co"), "AT&T & co")
+
+  def test_incomplete_reference(self):
+    self.assertEqual(incomplete_reference("a &no"), 2)
+    self.assertEqual(incomplete_reference("a &#x3"), 2)
+    self.assertEqual(incomplete_reference("a &amp; b"), -1)
+    self.assertEqual(incomplete_reference("a & b"), -1)
+
+  def test_compiled_table_reused(self):
+    with tempfile.TemporaryDirectory() as directory:
+      compiled = os.path.join(directory, "entities.marshal")
+      table = load_entities(compiled_path=compiled)
+      self.assertTrue(os.path.exists(compiled))
+
+      with patch('entities.compile_entities') as compile_entities:
+        cached = load_entities(compiled_path=compiled)
+        compile_entities.assert_not_called()
+      self.assertEqual(cached.named, table.named)
+      self.assertEqual(cached.legacy, table.legacy)
+
+  def test_loaded_once(self):
+    entities.entity_table()
+    with patch('entities.load_entities') as load:
+      decode("&amp; &lt;")
+      load.assert_not_called()
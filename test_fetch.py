@@ -0,0 +1,165 @@
+import unittest
+import socket
+import threading
+import time
+import io
+from unittest.mock import patch
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from url import URL, request_pipelined
+from fetch import fetch_all
+from connection_pool import ConnectionPool
+
+DELAYS = {"/slow.css": 0.4, "/medium.css": 0.2, "/fast.css": 0}
+
+
+class DelayedHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    time.sleep(DELAYS.get(self.path, 0))
+    body = f"/* {self.path} */".encode('utf-8')
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  connections = 0
+
+  def setup(self):
+    super().setup()
+    KeepAliveHandler.connections += 1
+
+  def do_GET(self):
+    body = f"/* {self.path} */".encode('utf-8')
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(body)))
+    if self.path == "/close.css":
+      self.send_header("Connection", "close")
+      self.close_connection = True
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestFetchAll(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(("127.0.0.1", 0), DelayedHandler)
+    cls.port = cls.server.server_address[1]
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def url(self, path):
+    return URL(f"http://127.0.0.1:{self.port}{path}")
+
+  def test_fetch_all_document_order(self, mock_stdout):
+    paths = ["/slow.css", "/fast.css", "/medium.css"]
+    results = fetch_all([self.url(path) for path in paths])
+
+    self.assertEqual(results, [f"/* {path} */" for path in paths])
+
+  def test_fetch_all_concurrent(self, mock_stdout):
+    start = time.monotonic()
+    fetch_all([self.url("/slow.css"), self.url("/medium.css"), self.url("/slow.css")])
+    elapsed = time.monotonic() - start
+
+    # Bounded by the slowest fetch rather than the sum of all three
+    self.assertLess(elapsed, 0.9)
+
+  def test_fetch_all_per_host_limit(self, mock_stdout):
+    start = time.monotonic()
+    fetch_all([self.url("/medium.css"), self.url("/medium.css")], per_host_limit=1)
+    elapsed = time.monotonic() - start
+
+    self.assertGreaterEqual(elapsed, 0.4)
+
+  def test_fetch_all_timeout(self, mock_stdout):
+    results = fetch_all([self.url("/fast.css"), self.url("/slow.css")], timeout=0.1)
+
+    self.assertEqual(results[0], "/* /fast.css */")
+    self.assertIsInstance(results[1], Exception)
+
+  def test_fetch_all_data_url(self, mock_stdout):
+    results = fetch_all([URL("data:text/html,p { color: red; }")])
+
+    self.assertEqual(results, ["p { color: red; }"])
+
+  def test_fetch_all_nothing(self, mock_stdout):
+    with patch('fetch.asyncio.run') as run:
+      self.assertEqual(fetch_all([]), [])
+    run.assert_not_called()
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestPipelining(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    cls.port = cls.server.server_address[1]
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def setUp(self):
+    self.pool = ConnectionPool()
+    self.pool_patch = patch('url.pool', self.pool)
+    self.pool_patch.start()
+    KeepAliveHandler.connections = 0
+
+  def tearDown(self):
+    self.pool.close_all()
+    self.pool_patch.stop()
+
+  def url(self, path):
+    return URL(f"http://127.0.0.1:{self.port}{path}")
+
+  def test_pipelined_one_connection(self, mock_stdout):
+    paths = ["/a.css", "/b.css", "/c.css"]
+    results = request_pipelined([self.url(path) for path in paths])
+
+    self.assertEqual(results, [f"/* {path} */" for path in paths])
+    self.assertEqual(KeepAliveHandler.connections, 1)
+    self.assertEqual(self.pool.stats()["idle"], 1)
+
+  def test_pipelined_connection_close_falls_back(self, mock_stdout):
+    paths = ["/a.css", "/close.css", "/b.css", "/c.css"]
+    results = request_pipelined([self.url(path) for path in paths])
+
+    # Closing with pipelined requests still unread can reset the connection before earlier responses are
+    # read, so only the results are certain, not how many connections it took to get them
+    self.assertEqual(results, [f"/* {path} */" for path in paths])
+
+  def test_fetch_all_pipeline_silent_server(self, mock_stdout):
+    # Accepts connections and never answers them
+    listener = socket.create_server(("127.0.0.1", 0))
+    self.addCleanup(listener.close)
+    port = listener.getsockname()[1]
+
+    start = time.monotonic()
+    results = fetch_all([URL(f"http://127.0.0.1:{port}/a.css"), URL(f"http://127.0.0.1:{port}/b.css")], timeout=0.5,
+                        pipeline=True)
+
+    self.assertLess(time.monotonic() - start, 2)
+    self.assertTrue(all(isinstance(result, Exception) for result in results))
+
+  def test_fetch_all_pipeline(self, mock_stdout):
+    urls = [self.url("/a.css"), URL("data:text/html,p { color: red; }"), self.url("/b.css")]
+    results = fetch_all(urls, pipeline=True)
+
+    self.assertEqual(results, ["/* /a.css */", "p { color: red; }", "/* /b.css */"])
+    self.assertEqual(KeepAliveHandler.connections, 1)
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from file_loader import FileCache, iter_mapped
+from url import URL
+
+
+class TestFileLoader(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.directory.name, "page.html")
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+  def write(self, data: bytes, mtime_ns=None):
+    with open(self.path, 'wb') as f:
+      f.write(data)
+    if mtime_ns is not None:
+      os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+  def test_iter_mapped_matches_text_mode(self):
+    self.write("<p>café</p>\r\n<p>naïve</p>\r<p>end</p>\n".encode('utf-8'))
+
+    # Chunks this small split both multi-byte characters and \r\n pairs
+    chunks = list(iter_mapped(self.path, chunk_size=3))
+
+    with open(self.path, 'r', encoding="utf-8") as f:
+      self.assertEqual(''.join(chunks), f.read())
+    self.assertGreater(len(chunks), 1)
+
+  def test_iter_mapped_empty_file(self):
+    self.write(b"")
+
+    self.assertEqual(list(iter_mapped(self.path)), [])
+
+  def test_unchanged_file_served_from_cache(self):
+    self.write(b"<p>Hello</p>")
+    files = FileCache()
+    self.assertEqual(''.join(files.stream(self.path)), "<p>Hello</p>")
+
+    with patch('file_loader.iter_mapped') as mock_iter:
+      self.assertEqual(''.join(files.stream(self.path)), "<p>Hello</p>")
+      mock_iter.assert_not_called()
+
+  def test_changed_file_reloaded(self):
+    self.write(b"<p>Hello</p>", mtime_ns=1_000_000_000)
+    files = FileCache()
+    ''.join(files.stream(self.path))
+
+    self.write(b"<p>World</p>", mtime_ns=2_000_000_000)
+
+    self.assertEqual(''.join(files.stream(self.path)), "<p>World</p>")
+    # The stale version of the file is dropped rather than kept alongside the new one
+    self.assertEqual(len(files.entries), 1)
+
+  def test_oversized_file_not_cached(self):
+    self.write(b"<p>Hello</p>")
+    files = FileCache(max_chars=4)
+
+    self.assertEqual(''.join(files.stream(self.path)), "<p>Hello</p>")
+    self.assertEqual(len(files.entries), 0)
+    self.assertEqual(files.size, 0)
+
+  def test_request_file_url(self):
+    self.write("<p>café</p>".encode('utf-8'))
+
+    self.assertEqual(URL(f"file://{self.path}").request(), "<p>café</p>")
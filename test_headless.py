@@ -0,0 +1,46 @@
+import unittest
+import io
+import os
+import tempfile
+from unittest.mock import patch
+
+import layout
+from headless import HeadlessFont, Renderer, render_all
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestHeadless(unittest.TestCase):
+  def setUp(self):
+    layout.set_font_backend(HeadlessFont)
+
+  def tearDown(self):
+    layout.set_font_backend(None)
+
+  def test_render_display_list(self, mock_stdout):
+    result = Renderer().render("data:text/html,<p>Hello <b>world</b></p>")
+
+    self.assertIsNone(result["error"])
+    words = [(cmd["text"], cmd["font"][1]) for cmd in result["display_list"] if cmd["type"] == "text"]
+    self.assertEqual(words, [("Hello", "normal"), ("world", "bold")])
+    self.assertEqual(list(result["timings"]), ['fetch', 'parse', 'stylesheets', 'style', 'layout', 'paint'])
+
+  def test_render_image(self, mock_stdout):
+    with tempfile.TemporaryDirectory() as directory:
+      result = Renderer(width=200, image_dir=directory).render("data:text/html,<p>Hello</p>", index=3)
+
+      self.assertEqual(result["image"], os.path.join(directory, "3.png"))
+      self.assertTrue(os.path.exists(result["image"]))
+      self.assertIn('raster', result["timings"])
+
+  def test_render_error(self, mock_stdout):
+    result = Renderer().render("data:text/plain,Hello")
+
+    self.assertIn("Nothing to render", result["error"])
+    self.assertIsNone(result["display_list"])
+
+  def test_render_all_in_order(self, mock_stdout):
+    targets = [f"data:text/html,<p>Page {i}</p>" for i in range(8)]
+    results = list(render_all(targets, workers=2))
+
+    self.assertEqual([result["url"] for result in results], targets)
+    self.assertEqual([result["display_list"][-1]["text"] for result in results], [str(i) for i in range(8)])
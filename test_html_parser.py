@@ -0,0 +1,144 @@
+import unittest
+
+from html_parser import HTMLParser, Element, Text, EMPTY_ATTRIBUTES
+
+
+def dump(node):
+  if isinstance(node, Text):
+    return node.text
+  return (node.tag, node.attributes, [dump(child) for child in node.children])
+
+
+class TestHTMLParserFeed(unittest.TestCase):
+  DOCUMENTS = [
+    "Hello, world!",
+    "&lt;div&gt; &amp; &asdf;",
+    "<!-- a comment --> <p>one<b>two</b></p>",
+    "<html><head><title>Title</title></head><body><p>x &copy; y</body></html>",
+    "<p>unclosed <i>deep <b>deeper",
+    "<br/><img src='a.png'>text",
+    "&copy 2024 &notin; &#60;&#x3e; AT&T",
+  ]
+
+  def feed(self, body, size):
+    parser = HTMLParser('')
+    for i in range(0, len(body), size):
+      parser.feed(body[i:i + size])
+    return parser.finish()
+
+  def test_feed_matches_parse(self):
+    for body in self.DOCUMENTS:
+      expected = dump(HTMLParser(body).parse())
+      for size in [1, 2, 3, 7, 64]:
+        self.assertEqual(dump(self.feed(body, size)), expected, (body, size))
+
+  def test_entity_across_chunks(self):
+    parser = HTMLParser('')
+    parser.feed("a &l")
+    parser.feed("t; b")
+    tree = parser.finish()
+
+    self.assertEqual(dump(tree), ("html", {}, [("body", {}, ["a < b"])]))
+
+  def test_comment_across_chunks(self):
+    parser = HTMLParser('')
+    for chunk in ["<p><", "!-", "- <b>hidden</b> -", "-> b</p>"]:
+      parser.feed(chunk)
+    tree = parser.finish()
+
+    self.assertEqual(dump(tree), ("html", {}, [("body", {}, [("p", {}, [" b"])])]))
+
+  def test_partial_tree(self):
+    parser = HTMLParser('')
+    self.assertIsNone(parser.partial_tree())
+
+    parser.feed("<p>first</p><div><p>second")
+    partial = parser.partial_tree()
+    body = partial.children[0]
+
+    self.assertEqual([child.tag for child in body.children], ["p", "div"])
+    self.assertIsInstance(body.children[1].children[0], Element)
+    self.assertIs(parser.finish(), partial)
+
+
+class TestHTMLParserTokenizer(unittest.TestCase):
+  def parse(self, body):
+    return dump(HTMLParser(body).parse())
+
+  def test_quoted_attributes(self):
+    tree = self.parse("<p title=\"a > b\" class='x y' id=z data-empty=\"\">text</p>")
+
+    self.assertEqual(tree, ("html", {}, [("body", {}, [
+      ("p", {"title": "a > b", "class": "x y", "id": "z", "data-empty": ""}, ["text"])])]))
+
+  def test_quoted_attribute_across_chunks(self):
+    parser = HTMLParser('')
+    for chunk in ["<a href='x", ">y'>li", "nk</a>"]:
+      parser.feed(chunk)
+
+    self.assertEqual(dump(parser.finish()), ("html", {}, [("body", {}, [("a", {"href": "x>y"}, ["link"])])]))
+
+  def test_self_closing_slash(self):
+    tree = self.parse("<p>a<br/>b<img src='x.png'/></p>")
+
+    self.assertEqual(tree, ("html", {}, [("body", {}, [("p", {}, ["a", ("br", {}, []), "b",
+                                                                    ("img", {"src": "x.png"}, [])])])]))
+
+  def test_comments(self):
+    tree = self.parse("<p>before<!-- <b>hidden</b> -->after<!-->shown</p>")
+
+    self.assertEqual(tree, ("html", {}, [("body", {}, [("p", {}, ["before", "after", "shown"])])]))
+
+  def test_stray_greater_than(self):
+    self.assertEqual(self.parse("<p>a > b</p>"), ("html", {}, [("body", {}, [("p", {}, ["a > b"])])]))
+
+  def test_unterminated_tag_dropped(self):
+    self.assertEqual(self.parse("<p>text</p><div class='a"), ("html", {}, [("body", {}, [("p", {}, ["text"])])]))
+
+
+class TestHTMLParserInsertionMode(unittest.TestCase):
+  def test_modes(self):
+    parser = HTMLParser('')
+    self.assertEqual(parser.mode, HTMLParser.INITIAL)
+    parser.feed("<title>T</title>")
+    self.assertEqual(parser.mode, HTMLParser.IN_HEAD)
+    parser.feed("<p>text")
+    self.assertEqual(parser.mode, HTMLParser.IN_BODY)
+    parser.feed("</p></body>")
+    self.assertEqual(parser.mode, HTMLParser.IN_HTML)
+
+  def test_implied_tags(self):
+    tree = dump(HTMLParser("<link rel=stylesheet href=a.css><p>one</p>").parse())
+
+    self.assertEqual(tree, ("html", {}, [("head", {}, [("link", {"rel": "stylesheet", "href": "a.css"}, [])]),
+                                         ("body", {}, [("p", {}, ["one"])])]))
+
+  def test_deep_nesting(self):
+    depth = 2000
+    tree = HTMLParser("<div>" * depth + "x").parse()
+
+    node = tree.children[0]
+    for _ in range(depth + 1):
+      node = node.children[0]
+    self.assertEqual(node.text, "x")
+
+
+class TestHTMLParserNodes(unittest.TestCase):
+  def test_shared_empty_containers(self):
+    tree = HTMLParser("<p>a</p><p>b</p><br>").parse()
+    first, second, br = tree.children[0].children
+
+    self.assertIs(first.attributes, EMPTY_ATTRIBUTES)
+    self.assertEqual(br.children, ())
+    self.assertEqual(first.children[0].children, ())
+    with self.assertRaises(AttributeError):
+      first.extra = True
+
+  def test_identical_attributes_shared(self):
+    tree = HTMLParser("<p class=row>a</p><p class=row>b</p><p class=other>c</p>").parse()
+    first, second, third = tree.children[0].children
+
+    self.assertIs(first.attributes, second.attributes)
+    self.assertEqual(third.attributes, {"class": "other"})
+    with self.assertRaises(TypeError):
+      first.attributes["class"] = "changed"
@@ -0,0 +1,170 @@
+import unittest
+import io
+import gzip
+import tracemalloc
+import zlib
+from unittest.mock import patch
+
+import url
+from url import URL
+from connection_pool import ConnectionPool
+from http_cache import HTTPCache
+from http_body import iter_framed, iter_decoded
+from test_utils import socket
+
+
+def url_cache():
+  return url.cache
+
+
+def chunked(*chunks):
+  body = b''
+  for chunk in chunks:
+    body += f"{len(chunk):x}\r\n".encode('utf-8') + chunk + b"\r\n"
+  return body + b"0\r\n\r\n"
+
+
+class TestHTTPBody(unittest.TestCase):
+  def framed(self, raw, response_headers, buffer_size=4):
+    return [bytes(chunk) for chunk in iter_framed(io.BytesIO(raw), response_headers, buffer_size)]
+
+  def test_chunked(self):
+    raw = chunked(b"Hello, ", b"world!") + b"next response"
+    stream = io.BytesIO(raw)
+    body = b''.join(bytes(chunk) for chunk in iter_framed(stream, {"transfer-encoding": "chunked"}))
+
+    self.assertEqual(body, b"Hello, world!")
+    self.assertEqual(stream.read(), b"next response")
+
+  def test_chunked_extensions_and_trailers(self):
+    raw = b"5;name=value\r\nHello\r\n0\r\nTrailer: yes\r\n\r\n"
+
+    self.assertEqual(b''.join(self.framed(raw, {"transfer-encoding": "chunked"})), b"Hello")
+
+  def test_content_length(self):
+    chunks = self.framed(b"Body text", {"content-length": "5"})
+
+    self.assertEqual(b''.join(chunks), b"Body ")
+    self.assertTrue(all(len(chunk) <= 4 for chunk in chunks))
+
+  def test_read_to_eof(self):
+    self.assertEqual(b''.join(self.framed(b"Body text", {})), b"Body text")
+
+  def test_truncated_body(self):
+    with self.assertRaises(ConnectionError):
+      self.framed(b"Body", {"content-length": "9"})
+    with self.assertRaises(ConnectionError):
+      self.framed(chunked(b"Hello")[:-5], {"transfer-encoding": "chunked"})
+    with self.assertRaises(ConnectionError):
+      self.framed(b"9\r\nBody", {"transfer-encoding": "chunked"})
+
+  def test_bodiless_statuses(self):
+    for status in ['100', '204', '304']:
+      stream = io.BytesIO(b"next response")
+      self.assertEqual(list(iter_framed(stream, {"content-length": "4"}, status=status)), [])
+      self.assertEqual(stream.read(), b"next response")
+
+  def test_utf8_split_across_chunks(self):
+    encoded = "🍐🪄 pear".encode('utf-8')
+    chunks = [encoded[i:i + 3] for i in range(0, len(encoded), 3)]
+
+    self.assertEqual(''.join(iter_decoded(chunks, {})), "🍐🪄 pear")
+
+  def test_gzip_incremental(self):
+    compressed = gzip.compress(b"Body text " * 1000)
+    chunks = [compressed[i:i + 7] for i in range(0, len(compressed), 7)]
+
+    self.assertEqual(''.join(iter_decoded(chunks, {"content-encoding": "gzip"})), "Body text " * 1000)
+
+  def test_gzip_multiple_members(self):
+    compressed = gzip.compress(b"Body ") + gzip.compress(b"text")
+
+    self.assertEqual(''.join(iter_decoded([compressed], {"content-encoding": "gzip"})), "Body text")
+
+  def test_deflate(self):
+    self.assertEqual(''.join(iter_decoded([zlib.compress(b"Body text")], {"content-encoding": "deflate"})), "Body text")
+
+  def test_raw_deflate(self):
+    d = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    compressed = d.compress(b"Body text") + d.flush()
+
+    self.assertEqual(''.join(iter_decoded([compressed], {"content-encoding": "deflate"})), "Body text")
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestURLStream(unittest.TestCase):
+  def setUp(self):
+    self.socket_patch = socket.patch()
+    self.socket_patch.start()
+    self.cache_patch = patch('url.cache', HTTPCache())
+    self.cache_patch.start()
+
+  def tearDown(self):
+    self.cache_patch.stop()
+    self.socket_patch.stop()
+
+  def test_stream_chunked_gzip(self, mock_stdout):
+    url = "http://body.test/chunked.html"
+    compressed = gzip.compress("Body text ✓".encode('utf-8'))
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + b"Content-Encoding: gzip\r\nTransfer-Encoding: chunked\r\n\r\n" +
+                   chunked(compressed[:10], compressed[10:]))
+
+    self.assertEqual(''.join(URL(url).stream()), "Body text ✓")
+
+  def test_stream_old_style_chunk_sizes(self, mock_stdout):
+    url = "http://body.test/hex.html"
+    body = gzip.compress(b"Body text")
+    socket.respond(url, b"HTTP/1.0 200 OK\r\n" + b"Content-Encoding: gzip\r\n" + b"Transfer-Encoding: chunked\r\n\r\n" +
+                   f"{hex(len(body))}\r\n".encode('utf-8') + body + f"\r\n{hex(0)}\r\n\r\n".encode('utf-8'))
+
+    self.assertEqual(URL(url).request(), "Body text")
+
+  def test_truncated_body_not_cached(self, mock_stdout):
+    url = "http://body.test/truncated.html"
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + b"Cache-Control: max-age=60\r\nContent-Length: 9\r\n\r\n" + b"Body")
+
+    with patch('url.pool', ConnectionPool()) as pool:
+      with self.assertRaises(ConnectionError):
+        URL(url).request()
+      with self.assertRaises(ConnectionError):
+        URL(url).request()
+      # Nothing more can be read off the connection, so it isn't kept either
+      self.assertEqual(pool.stats()["idle"], 0)
+    self.assertNotIn("Returning content from cache", mock_stdout.getvalue())
+
+  def test_unreusable_response_not_kept(self, mock_stdout):
+    url = "http://body.test/once.html"
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + b"Cache-Control: no-cache\r\nETag: \"v1\"\r\nContent-Length: 3\r\n\r\n" +
+                   b"old")
+    URL(url).request()
+    self.assertIn(url, url_cache())
+    # Nothing to revalidate with and no lifetime, so nothing a later request could use
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 3\r\n\r\n" + b"new")
+    with patch('url.cache.store') as store:
+      self.assertEqual(URL(url).request(), "new")
+    store.assert_not_called()
+    self.assertNotIn(url, url_cache())
+
+  def test_stream_keeps_one_copy(self, mock_stdout):
+    url = "http://body.test/large.html"
+    size = 4 * 1024 * 1024
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + f"Cache-Control: max-age=60\r\nContent-Length: {size}\r\n\r\n"
+                   .encode('utf-8') + b"x" * size)
+
+    tracemalloc.start()
+    try:
+      for _ in URL(url).stream():
+        pass
+      peak = tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+    self.assertLess(peak, size * 1.5)
+    self.assertEqual(len(url_cache().lookup(url, URL(url).request_headers()).body), size)
+
+  def test_stream_is_cached(self, mock_stdout):
+    url = "http://body.test/cached.html"
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + b"Cache-Control: max-age=60\r\nContent-Length: 9\r\n\r\n" + b"Body text")
+
+    self.assertEqual(URL(url).request(), "Body text")
+    self.assertEqual(URL(url).request(), "Body text")
+    self.assertIn(f"Returning content from cache: {url}", mock_stdout.getvalue())
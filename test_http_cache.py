@@ -0,0 +1,234 @@
+import unittest
+import io
+import gzip
+import threading
+import time
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch
+
+from url import URL, request_pipelined
+from connection_pool import ConnectionPool
+from http_cache import HTTPCache, parse_cache_control
+from test_utils import socket
+
+HEADERS = {"Host": "cache.test", "Accept-Encoding": "gzip", "User-Agent": "christalee"}
+
+
+class RevalidatingHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  # Long enough that a client waiting for the connection to close notices, short enough not to stall the run
+  timeout = 5
+  connections = 0
+
+  def setup(self):
+    super().setup()
+    RevalidatingHandler.connections += 1
+
+  def do_GET(self):
+    if self.headers.get("If-None-Match") == '"v1"':
+      # Like most servers, no Content-Length on a 304
+      self.send_response(304)
+      self.send_header("ETag", '"v1"')
+      self.end_headers()
+      return
+    body = f"/* {self.path} */".encode('utf-8')
+    self.send_response(200)
+    self.send_header("ETag", '"v1"')
+    self.send_header("Cache-Control", "no-cache")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+class TestHTTPCache(unittest.TestCase):
+  def store(self, cache, url, response_headers, body=b"Body", status='200', age=0):
+    now = time.time()
+    return cache.store(url, status, response_headers, body, HEADERS, now - age, now - age)
+
+  def test_parse_cache_control(self):
+    directives = parse_cache_control('no-cache, max-age="60", private')
+
+    self.assertEqual(directives, {"no-cache": None, "max-age": "60", "private": None})
+
+  def test_max_age_fresh(self):
+    entry = self.store(HTTPCache(), "http://cache.test/", {"cache-control": "max-age=60"}, age=30)
+
+    self.assertTrue(entry.is_fresh())
+
+  def test_max_age_stale(self):
+    entry = self.store(HTTPCache(), "http://cache.test/", {"cache-control": "max-age=60"}, age=90)
+
+    self.assertFalse(entry.is_fresh())
+
+  def test_age_header(self):
+    entry = self.store(HTTPCache(), "http://cache.test/", {"cache-control": "max-age=60", "age": "100"})
+
+    self.assertFalse(entry.is_fresh())
+
+  def test_expires(self):
+    now = time.time()
+    headers = {"date": formatdate(now, usegmt=True), "expires": formatdate(now + 60, usegmt=True)}
+    entry = self.store(HTTPCache(), "http://cache.test/", headers)
+
+    self.assertTrue(entry.is_fresh())
+    self.assertFalse(entry.is_fresh(now + 120))
+
+  def test_heuristic_freshness(self):
+    now = time.time()
+    headers = {"date": formatdate(now, usegmt=True), "last-modified": formatdate(now - 1000, usegmt=True)}
+    entry = self.store(HTTPCache(), "http://cache.test/", headers)
+
+    self.assertAlmostEqual(entry.freshness_lifetime(), 100, delta=1)
+    self.assertTrue(entry.is_fresh())
+
+  def test_no_cache_always_revalidates(self):
+    headers = {"cache-control": "no-cache, max-age=60", "etag": '"v1"'}
+    entry = self.store(HTTPCache(), "http://cache.test/", headers)
+
+    self.assertFalse(entry.is_fresh())
+    self.assertEqual(entry.validators(), ['If-None-Match: "v1"'])
+
+  def test_no_store(self):
+    cache = HTTPCache()
+    entry = self.store(cache, "http://cache.test/", {"cache-control": "no-store, max-age=60"})
+
+    self.assertIsNone(entry)
+    self.assertNotIn("http://cache.test/", cache)
+
+  def test_vary(self):
+    cache = HTTPCache()
+    self.store(cache, "http://cache.test/", {"cache-control": "max-age=60", "vary": "Accept-Encoding"})
+
+    self.assertIsNotNone(cache.lookup("http://cache.test/", HEADERS))
+    self.assertIsNone(cache.lookup("http://cache.test/", {**HEADERS, "Accept-Encoding": "br"}))
+
+  def test_vary_star(self):
+    cache = HTTPCache()
+    self.store(cache, "http://cache.test/", {"cache-control": "max-age=60", "vary": "*"})
+
+    self.assertNotIn("http://cache.test/", cache)
+
+  def test_lru_eviction(self):
+    cache = HTTPCache(max_bytes=250)
+    for name in ["a", "b", "c"]:
+      self.store(cache, f"http://cache.test/{name}", {}, body=b"x" * 100)
+      if name == "b":
+        cache.lookup("http://cache.test/a", HEADERS)
+
+    self.assertIn("http://cache.test/a", cache)
+    self.assertNotIn("http://cache.test/b", cache)
+    self.assertIn("http://cache.test/c", cache)
+    self.assertLessEqual(cache.size, 250)
+
+  def test_compressed_storage(self):
+    cache = HTTPCache(compress=True)
+    body = b"Body text " * 100
+    entry = self.store(cache, "http://cache.test/", {}, body=body)
+
+    self.assertLess(len(entry.body), len(body))
+    self.assertEqual(entry.content(), body.decode('utf-8'))
+
+  def test_compressed_storage_keeps_wire_gzip(self):
+    cache = HTTPCache(compress=True)
+    body = gzip.compress(b"Body text")
+    entry = self.store(cache, "http://cache.test/", {"content-encoding": "gzip"}, body=body)
+
+    self.assertEqual(entry.body, body)
+    self.assertEqual(entry.content(), "Body text")
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestHTTPCacheRequests(unittest.TestCase):
+  def setUp(self):
+    self.socket_patch = socket.patch()
+    self.socket_patch.start()
+    self.cache_patch = patch('url.cache', HTTPCache())
+    self.cache_patch.start()
+    socket.clear_history()
+
+  def tearDown(self):
+    self.cache_patch.stop()
+    self.socket_patch.stop()
+
+  def test_fresh_hit_skips_network(self, mock_stdout):
+    url = "http://cache.test/fresh.html"
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + b"Cache-Control: max-age=60\r\nContent-Length: 4\r\n\r\n" + b"Body")
+
+    URL(url).request()
+    content = URL(url).request()
+
+    self.assertEqual(content, "Body")
+    self.assertEqual(len(socket.Requests[url]), 1)
+    self.assertIn(f"Returning content from cache: {url}", mock_stdout.getvalue())
+
+  def test_revalidation(self, mock_stdout):
+    url = "http://cache.test/revalidate.html"
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + b"ETag: \"v1\"\r\nContent-Length: 4\r\n\r\n" + b"Body")
+    URL(url).request()
+
+    socket.respond(url, b"HTTP/1.1 304 Not Modified\r\n" + b"ETag: \"v1\"\r\nContent-Length: 0\r\n\r\n")
+    content = URL(url).request()
+
+    self.assertEqual(content, "Body")
+    self.assertIn(b'If-None-Match: "v1"', socket.last_request(url))
+    self.assertIn(f"Revalidated cache entry: {url}", mock_stdout.getvalue())
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestRevalidationServer(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RevalidatingHandler)
+    cls.port = cls.server.server_address[1]
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+
+  def setUp(self):
+    self.pool = ConnectionPool()
+    self.pool_patch = patch('url.pool', self.pool)
+    self.pool_patch.start()
+    self.cache_patch = patch('url.cache', HTTPCache())
+    self.cache_patch.start()
+    RevalidatingHandler.connections = 0
+
+  def tearDown(self):
+    self.cache_patch.stop()
+    self.pool.close_all()
+    self.pool_patch.stop()
+
+  def url(self, path):
+    return URL(f"http://127.0.0.1:{self.port}{path}")
+
+  def test_unframed_304_does_not_wait_for_close(self, mock_stdout):
+    self.url("/page.html").request()
+
+    start = time.perf_counter()
+    content = self.url("/page.html").request()
+
+    self.assertEqual(content, "/* /page.html */")
+    self.assertLess(time.perf_counter() - start, 1)
+    self.assertIn("Revalidated cache entry", mock_stdout.getvalue())
+    # The connection stays usable after a 304
+    self.assertEqual(RevalidatingHandler.connections, 1)
+    self.assertEqual(self.pool.stats()["idle"], 1)
+
+  def test_pipelined_304_leaves_later_responses(self, mock_stdout):
+    self.url("/a.css").request()
+    self.url("/b.css").request()
+    self.pool.close_all()
+
+    start = time.perf_counter()
+    paths = ["/a.css", "/b.css", "/c.css"]
+    results = request_pipelined([self.url(path) for path in paths])
+
+    self.assertEqual(results, [f"/* {path} */" for path in paths])
+    self.assertLess(time.perf_counter() - start, 1)
+    self.assertEqual(mock_stdout.getvalue().count("Revalidated cache entry"), 2)
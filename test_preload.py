@@ -0,0 +1,70 @@
+import unittest
+import asyncio
+import io
+import socket
+import time
+from unittest.mock import patch
+
+from url import URL
+from preload import PreloadScanner, Preloader
+
+PAGE = """<html><head>
+<link rel="stylesheet" href="/one.css">
+<link rel=icon href="/favicon.ico">
+<!-- <link rel="stylesheet" href="/commented.css"> -->
+<LINK rel="stylesheet" href='two.css' />
+<linked rel="stylesheet" href="/not-a-link.css">
+</head><body><p>text</p></body></html>"""
+
+
+class TestPreloadScanner(unittest.TestCase):
+  def scan(self, body, size):
+    scanner = PreloadScanner()
+    hrefs = []
+    for i in range(0, len(body), size):
+      hrefs.extend(scanner.feed(body[i:i + size]))
+    return hrefs
+
+  def test_scan_whole_body(self):
+    self.assertEqual(self.scan(PAGE, len(PAGE)), ["/one.css", "two.css"])
+
+  def test_scan_chunks(self):
+    for size in [1, 2, 3, 5, 16]:
+      self.assertEqual(self.scan(PAGE, size), ["/one.css", "two.css"], size)
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestPreloader(unittest.TestCase):
+  def test_preloader_fetches_and_hands_off(self, mock_stdout):
+    preloader = Preloader(URL("http://preload.test/index.html"))
+    with patch.object(URL, "resolve", lambda self, href: URL(f"data:text/html,{href}")):
+      preloader.feed(PAGE)
+    try:
+      one = preloader.take("/one.css")
+      self.assertEqual(one.result(timeout=5), "/one.css")
+      self.assertEqual(preloader.take("two.css").result(timeout=5), "two.css")
+      self.assertIsNone(preloader.take("/one.css"))
+    finally:
+      preloader.close()
+
+  def test_close_cancels_unfinished_fetches(self, mock_stdout):
+    # Accepts connections and never answers them
+    listener = socket.create_server(("127.0.0.1", 0))
+    self.addCleanup(listener.close)
+    port = listener.getsockname()[1]
+    preloader = Preloader(URL(f"http://127.0.0.1:{port}/index.html"))
+    preloader.feed('<link rel="stylesheet" href="/stuck.css">')
+    future = preloader.fetches["/stuck.css"]
+    loop = preloader.loop
+    # Close only once the request is underway
+    listener.settimeout(5)
+    connection, _ = listener.accept()
+    self.addCleanup(connection.close)
+
+    start = time.monotonic()
+    preloader.close()
+
+    self.assertLess(time.monotonic() - start, 2)
+    self.assertTrue(future.cancelled())
+    self.assertTrue(loop.is_closed())
+    self.assertEqual(asyncio.all_tasks(loop), set())
@@ -0,0 +1,94 @@
+import unittest
+import socket
+import threading
+
+from resolver import Resolver, StubResolver
+from html_parser import HTMLParser
+
+
+class CountingStub(StubResolver):
+  def __init__(self, hosts):
+    super().__init__(hosts)
+    self.lookups = []
+
+  def __call__(self, host, port):
+    self.lookups.append(host)
+    return super().__call__(host, port)
+
+
+class TestResolver(unittest.TestCase):
+  def test_stub_resolver(self):
+    resolver = Resolver(StubResolver({"example.test": ["10.0.0.1", "10.0.0.2"]}))
+
+    self.assertEqual(resolver.resolve("example.test"), "10.0.0.1")
+    with self.assertRaises(socket.gaierror):
+      resolver.resolve("missing.test")
+
+  def test_ip_literal_skips_lookup(self):
+    backend = CountingStub({})
+    resolver = Resolver(backend)
+
+    self.assertEqual(resolver.resolve("127.0.0.1"), "127.0.0.1")
+    self.assertEqual(backend.lookups, [])
+
+  def test_cached_until_ttl(self):
+    backend = CountingStub({"example.test": ["10.0.0.1"]})
+    resolver = Resolver(backend, ttl=60)
+    resolver.resolve("example.test")
+    resolver.resolve("example.test")
+
+    self.assertEqual(backend.lookups, ["example.test"])
+    self.assertEqual((resolver.hits, resolver.misses), (1, 1))
+
+  def test_expired_entry_looked_up_again(self):
+    backend = CountingStub({"example.test": ["10.0.0.1"]})
+    resolver = Resolver(backend, ttl=0)
+    resolver.resolve("example.test")
+    resolver.resolve("example.test")
+
+    self.assertEqual(backend.lookups, ["example.test", "example.test"])
+
+  def test_negative_caching(self):
+    backend = CountingStub({})
+    resolver = Resolver(backend, negative_ttl=60)
+    for _ in range(2):
+      with self.assertRaises(socket.gaierror):
+        resolver.resolve("missing.test")
+
+    self.assertEqual(backend.lookups, ["missing.test"])
+
+  def test_preresolve(self):
+    backend = CountingStub({"example.test": ["10.0.0.1"]})
+    resolver = Resolver(backend)
+    resolver.preresolve("example.test")
+    resolver.preresolve("example.test")
+
+    self.assertEqual(resolver.resolve("example.test"), "10.0.0.1")
+    self.assertEqual(backend.lookups, ["example.test"])
+
+  def test_resolve_waits_for_preresolve(self):
+    started, release = threading.Event(), threading.Event()
+
+    def slow(host, port):
+      started.set()
+      release.wait()
+      return ["10.0.0.1"]
+
+    backend = CountingStub({})
+    resolver = Resolver(slow)
+    resolver.preresolve("example.test")
+    started.wait()
+    resolver.backend = backend
+    threading.Timer(0.05, release.set).start()
+
+    self.assertEqual(resolver.resolve("example.test"), "10.0.0.1")
+    self.assertEqual(backend.lookups, [])
+
+  def test_parser_hook(self):
+    seen = []
+    parser = HTMLParser('<a href="http://a.test/">a</a><link href="http://b.test/style.css">',
+                        on_element=lambda node: seen.append((node.tag, node.attributes.get("href"))))
+    parser.parse()
+
+    self.assertIn(("a", "http://a.test/"), seen)
+    self.assertIn(("link", "http://b.test/style.css"), seen)
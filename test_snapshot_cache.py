@@ -0,0 +1,133 @@
+import unittest
+import io
+import os
+import tempfile
+from unittest.mock import patch
+
+import layout
+from benchmark import StubFont
+from css import style, CSSParser, cascade_priority
+from html_parser import HTMLParser
+from snapshot_cache import SnapshotCache, apply_styles, copy_dom, dom_key, style_key, layout_key
+from traversal import pre_order
+from test_html_parser import dump
+
+BODY = '<html><head><link rel=stylesheet href=a.css></head><body><p class=x>Hello <b>world</b></p><pre>a\nb</pre></body>'
+SHEET = "p { color: red; }"
+
+
+class TestSnapshotCache(unittest.TestCase):
+  def setUp(self):
+    layout.set_font_backend(StubFont)
+
+  def tearDown(self):
+    layout.set_font_backend(None)
+
+  def render(self, cache, body=BODY, sheet=SHEET, width=800):
+    # Runs the pipeline the way Browser.load does, returning the display list and whether each stage was cached
+    key = dom_key(body)
+    cached = []
+    dom = cache.get_dom(key)
+    cached.append(dom is not None)
+    if dom is None:
+      parser = HTMLParser(body)
+      dom = cache.put_dom(key, parser.parse(), parser.index)
+
+    key = style_key(key, [sheet])
+    styles = cache.get_styles(key)
+    cached.append(styles is not None)
+    if styles:
+      apply_styles(dom.root, styles)
+    else:
+      with patch('sys.stdout', new_callable=io.StringIO):
+        rules = CSSParser(sheet).parse()
+      style(dom.root, sorted(rules, key=cascade_priority))
+      cache.put_styles(key, dom.root)
+
+    key = layout_key(key, width)
+    snapshot = cache.get_layout(key)
+    cached.append(snapshot is not None)
+    if snapshot is None:
+      document = layout.DocumentLayout(dom.root, width)
+      document.layout()
+      display_list = []
+      layout.paint_tree(document, display_list)
+      snapshot = cache.put_layout(key, document.height, display_list)
+    return dom, [(type(cmd).__name__, cmd.left, cmd.top, getattr(cmd, "text", None)) for cmd in snapshot.display_list], cached
+
+  def test_keys(self):
+    self.assertEqual(dom_key(BODY), dom_key(BODY))
+    self.assertNotEqual(dom_key(BODY), dom_key(BODY + " "))
+    self.assertNotEqual(style_key("k", ["ab", "c"]), style_key("k", ["a", "bc"]))
+    self.assertEqual(layout_key(style_key("k", []), 800)[-1], 800)
+
+  def test_memory_hits(self):
+    cache = SnapshotCache()
+    dom, first, cached = self.render(cache)
+    self.assertEqual(cached, [False, False, False])
+    same_dom, again, cached = self.render(cache)
+    self.assertEqual(cached, [True, True, True])
+    self.assertIs(same_dom, dom)
+    self.assertEqual(again, first)
+
+    # A new width only lays out again; a new stylesheet restyles as well
+    self.assertEqual(self.render(cache, width=300)[2], [True, True, False])
+    self.assertEqual(self.render(cache, sheet="p { color: blue; }")[2], [True, False, False])
+    self.assertEqual(cache.hits, 6)
+    self.assertEqual(cache.misses, 6)
+
+  def test_lru(self):
+    cache = SnapshotCache(max_entries=3)
+    self.render(cache)
+    self.render(cache, body="<p>Other</p>")
+    self.assertEqual(len(cache.entries), 3)
+    self.assertEqual(self.render(cache)[2], [False, False, False])
+
+  def test_disk_round_trip(self):
+    with tempfile.TemporaryDirectory() as directory:
+      dom, first, _ = self.render(SnapshotCache(directory=directory))
+      self.assertEqual(len(os.listdir(directory)), 3)
+
+      cache = SnapshotCache(directory=directory)
+      loaded, again, cached = self.render(cache)
+      self.assertEqual(cached, [True, True, True])
+      self.assertIsNot(loaded.root, dom.root)
+      self.assertEqual(dump(loaded.root), dump(dom.root))
+      self.assertEqual([node.style for node in pre_order(loaded.root)], [node.style for node in pre_order(dom.root)])
+      self.assertEqual(again, first)
+      self.assertEqual(loaded.index.get_elements_by_tag("link")[0].attributes["href"], "a.css")
+
+  def test_disk_skips_layout_with_unknown_font(self):
+    with tempfile.TemporaryDirectory() as directory:
+      cache = SnapshotCache(directory=directory)
+      self.render(cache)
+      key = layout_key(style_key(dom_key(BODY), [SHEET]), 800)
+      display_list = cache.get_layout(key).display_list
+      # The fonts the display list was drawn with are no longer in layout.FONTS
+      layout.set_font_backend(StubFont)
+
+      other = ("other",) + key[1:]
+      stored = cache.put_layout(other, 100, display_list)
+
+      self.assertIs(cache.get_layout(other), stored)
+      self.assertFalse(os.path.exists(cache.path(other)))
+
+  def test_disk_ignores_corrupt_files(self):
+    with tempfile.TemporaryDirectory() as directory:
+      self.render(SnapshotCache(directory=directory))
+      for name in os.listdir(directory):
+        with open(os.path.join(directory, name), "wb") as f:
+          f.write(b"garbage")
+      self.assertEqual(self.render(SnapshotCache(directory=directory))[2], [False, False, False])
+
+  def test_copy_dom(self):
+    cache = SnapshotCache()
+    dom, _, _ = self.render(cache)
+    copy = copy_dom(dom)
+    self.assertEqual(dump(copy.root), dump(dom.root))
+    self.assertIsNot(copy.index.get_elements_by_tag("p")[0], dom.index.get_elements_by_tag("p")[0])
+
+  def test_copy_element_named_text(self):
+    parser = HTMLParser('<#text a=1>hi')
+    dom = SnapshotCache().put_dom("k", parser.parse(), parser.index)
+    self.assertEqual(dump(copy_dom(dom).root), dump(dom.root))
@@ -0,0 +1,110 @@
+import unittest
+import io
+import time
+from unittest.mock import patch
+
+from url import URL
+from connection_pool import ConnectionPool
+from http_cache import HTTPCache
+from timing import RequestTiming, TimingObservers, observers
+from test_utils import socket
+
+
+class TestRequestTiming(unittest.TestCase):
+  def test_nested_phases_are_exclusive(self):
+    timing = RequestTiming("http://timing.test/")
+
+    def slow_chunks():
+      time.sleep(0.05)
+      yield b"chunk"
+
+    with timing.measure('decompress'):
+      list(timing.timed('transfer', slow_chunks()))
+
+    self.assertGreaterEqual(timing.phases['transfer'], 0.05)
+    self.assertLess(timing.phases['decompress'], 0.05)
+
+  def test_timed_skips_consumer_time(self):
+    timing = RequestTiming("http://timing.test/")
+    for _ in timing.timed('transfer', [b"one", b"two"]):
+      time.sleep(0.05)
+
+    self.assertLess(timing.phases['transfer'], 0.05)
+
+  def test_finish_publishes_once(self):
+    records = []
+    timings = TimingObservers()
+    timings.subscribe(records.append)
+    with patch('timing.observers', timings):
+      timing = RequestTiming("http://timing.test/")
+      timing.finish()
+      timing.finish()
+
+    self.assertEqual(records, [timing])
+    self.assertIsNotNone(timing.duration)
+
+  def test_collect_unsubscribes(self):
+    timings = TimingObservers()
+    with timings.collect() as records:
+      timings.publish("first")
+    timings.publish("second")
+
+    self.assertEqual(records, ["first"])
+    self.assertEqual(timings.callbacks, [])
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestRequestTimingRecords(unittest.TestCase):
+  def setUp(self):
+    self.socket_patch = socket.patch()
+    self.socket_patch.start()
+    self.pool = ConnectionPool()
+    self.pool_patch = patch('url.pool', self.pool)
+    self.pool_patch.start()
+    self.cache_patch = patch('url.cache', HTTPCache())
+    self.cache_patch.start()
+
+  def tearDown(self):
+    self.cache_patch.stop()
+    self.pool_patch.stop()
+    self.socket_patch.stop()
+
+  def test_miss_then_hit(self, mock_stdout):
+    url = "http://timing.test/page.html"
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 4\r\nCache-Control: max-age=60\r\n\r\n" + b"Body")
+
+    with observers.collect() as records:
+      URL(url).request()
+      URL(url).request()
+
+    miss, hit = records
+    self.assertEqual((miss.url, miss.status, miss.cache, miss.reused), (url, '200', 'miss', False))
+    for phase in ['dns', 'connect', 'write', 'ttfb', 'transfer', 'decompress']:
+      self.assertIn(phase, miss.phases)
+    self.assertNotIn('tls', miss.phases)
+    self.assertEqual(hit.cache, 'hit')
+    self.assertEqual(hit.phases, {})
+
+  def test_reused_socket(self, mock_stdout):
+    url1 = "http://timing.test/one.html"
+    url2 = "http://timing.test/two.html"
+    socket.respond(url1, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 3\r\n\r\n" + b"one")
+    socket.respond(url2, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 3\r\n\r\n" + b"two")
+
+    with observers.collect() as records:
+      URL(url1).request()
+      URL(url2).request()
+
+    self.assertEqual([record.reused for record in records], [False, True])
+    self.assertNotIn('connect', records[1].phases)
+
+  def test_redirect_records_each_hop(self, mock_stdout):
+    url = "http://timing.test/old.html"
+    target = "http://timing.test/new.html"
+    socket.respond(url, b"HTTP/1.1 301 Moved\r\n" + b"Location: /new.html\r\nContent-Length: 0\r\n\r\n")
+    socket.respond(target, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 3\r\n\r\n" + b"new")
+
+    with observers.collect() as records:
+      URL(url).request()
+
+    self.assertEqual([(record.url, record.status) for record in records], [(url, '301'), (target, '200')])
@@ -0,0 +1,88 @@
+import unittest
+import io
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+from unittest.mock import patch
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from url import URL
+from connection_pool import ConnectionPool
+from http_cache import HTTPCache
+from timing import observers
+from tls import TLSConfig
+
+
+class CloseHandler(BaseHTTPRequestHandler):
+  # HTTP/1.0 closes after every response, so each request needs a new connection and a new handshake
+  def do_GET(self):
+    body = f"/* {self.path} */".encode('utf-8')
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+@unittest.skipUnless(shutil.which("openssl"), "needs openssl to make a self-signed certificate")
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestTLSResumption(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.directory = tempfile.TemporaryDirectory()
+    cls.certfile = os.path.join(cls.directory.name, "cert.pem")
+    keyfile = os.path.join(cls.directory.name, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                    "-addext", "subjectAltName=DNS:localhost", "-keyout", keyfile, "-out", cls.certfile],
+                   check=True, capture_output=True)
+
+    cls.server = ThreadingHTTPServer(("127.0.0.1", 0), CloseHandler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cls.certfile, keyfile)
+    cls.server.socket = context.wrap_socket(cls.server.socket, server_side=True)
+    cls.port = cls.server.server_address[1]
+    threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.server_close()
+    cls.directory.cleanup()
+
+  def setUp(self):
+    self.tls = TLSConfig(cafile=self.certfile)
+    self.enterContext(patch('url.tls', self.tls))
+    self.enterContext(patch('url.pool', ConnectionPool()))
+    self.enterContext(patch('url.cache', HTTPCache()))
+
+  def url(self, path):
+    return URL(f"https://localhost:{self.port}{path}")
+
+  def test_reconnect_resumes_session(self, mock_stdout):
+    with observers.collect() as records:
+      self.assertEqual(self.url("/a.css").request(), "/* /a.css */")
+      self.assertEqual(self.url("/b.css").request(), "/* /b.css */")
+
+    self.assertEqual([record.tls_resumed for record in records], [False, True])
+    self.assertEqual(self.tls.stats(), {"resumed": 1, "full": 1, "sessions": 1})
+
+  def test_context_built_once(self, mock_stdout):
+    with patch('ssl.create_default_context', wraps=ssl.create_default_context) as create:
+      self.url("/a.css").request()
+      self.url("/b.css").request()
+
+    create.assert_called_once()
+
+  def test_forget_session(self, mock_stdout):
+    self.url("/a.css").request()
+    self.tls.forget("localhost", self.port)
+
+    with observers.collect() as records:
+      self.url("/b.css").request()
+
+    self.assertFalse(records[0].tls_resumed)
@@ -0,0 +1,81 @@
+import unittest
+import io
+from unittest.mock import patch
+
+import layout
+from benchmark import StubFont
+from css import style, CSSParser, cascade_priority
+from html_parser import HTMLParser, print_tree
+from traversal import pre_order, post_order, enter_exit, with_depth, ENTER, EXIT
+
+
+class Node:
+  def __init__(self, name, *children):
+    self.name = name
+    self.children = list(children)
+
+
+TREE = Node("a", Node("b", Node("d"), Node("e")), Node("c", Node("f")))
+
+
+class TestTraversal(unittest.TestCase):
+  def names(self, nodes):
+    return "".join(node.name for node in nodes)
+
+  def test_orders(self):
+    self.assertEqual(self.names(pre_order(TREE)), "abdecf")
+    self.assertEqual(self.names(post_order(TREE)), "debfca")
+    self.assertEqual([(node.name, depth) for node, depth in with_depth(TREE)],
+                     [("a", 0), ("b", 1), ("d", 2), ("e", 2), ("c", 1), ("f", 2)])
+
+  def test_enter_exit(self):
+    events = [(node.name, entering) for node, entering in enter_exit(TREE.children[0])]
+    self.assertEqual(events, [("b", ENTER), ("d", ENTER), ("d", EXIT), ("e", ENTER), ("e", EXIT), ("b", EXIT)])
+
+  def test_children_read_after_yield(self):
+    # Children added once a node has been reached are still visited, which is how layout builds its boxes
+    root = Node("r")
+    seen = []
+    for node in pre_order(root):
+      seen.append(node.name)
+      if len(node.name) < 3:
+        node.children = [Node(node.name + "0"), Node(node.name + "1")]
+    self.assertEqual(seen, ["r", "r0", "r00", "r01", "r1", "r10", "r11"])
+
+  def test_deep(self):
+    node = root = Node("0")
+    for i in range(100000):
+      node.children.append(Node(str(i + 1)))
+      node = node.children[0]
+    self.assertEqual(sum(1 for _ in post_order(root)), 100001)
+
+
+class TestDeepDocument(unittest.TestCase):
+  def setUp(self):
+    layout.set_font_backend(StubFont)
+
+  def tearDown(self):
+    layout.set_font_backend(None)
+
+  def test_render_deep_document(self):
+    depth = 5000
+    body = "<div>" * depth + "<p>Deep <b>text</b></p>" + "</div>" * depth
+    nodes = HTMLParser(body).parse()
+    with patch('sys.stdout', new_callable=io.StringIO):
+      rules = CSSParser("div b { color: red; }").parse()
+    style(nodes, sorted(rules, key=cascade_priority))
+    document = layout.DocumentLayout(nodes, 800)
+    document.layout()
+    display_list = []
+    layout.paint_tree(document, display_list)
+
+    self.assertEqual([(cmd.text, cmd.color) for cmd in display_list], [("Deep", "black"), ("text", "red")])
+    self.assertEqual(display_list[0].top, display_list[1].top)
+
+  def test_print_deep_tree(self):
+    nodes = HTMLParser("<b>" * 3000 + "x").parse()
+    with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+      print_tree(nodes)
+    lines = stdout.getvalue().splitlines()
+    self.assertEqual(len(lines), 3 + 3000)
+    self.assertEqual(lines[-1], " " * (2 * 3002) + " x")
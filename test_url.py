@@ -1,6 +1,10 @@
 import unittest
+import io
+from unittest.mock import patch
 
 from url import URL
+from connection_pool import ConnectionPool
+from tls import TLSConfig
 from test_utils import socket, ssl
 
 
@@ -72,10 +76,11 @@ class TestBrowserURL(unittest.TestCase):
 
 class TestBrowserRequest(unittest.TestCase):
   def setUp(self):
-    socket.patch().start()
+    self.socket_patch = socket.patch()
+    self.socket_patch.start()
 
   def tearDown(self):
-    socket.patch().stop()
+    self.socket_patch.stop()
 
   def test_request_file(self):
     content = URL(
@@ -98,7 +103,8 @@ class TestBrowserRequest(unittest.TestCase):
     self.assertEqual(content, 'Body text')
 
   def test_request_https(self):
-    ssl.patch().start()
+    self.enterContext(ssl.patch())
+    self.enterContext(patch('url.tls', TLSConfig()))
     url = "https://browser.engineering/examples/example1-simple.html"
     socket.respond(
       url, b"HTTP/1.0 200 OK\r\n" + b"Header1: Value1\r\n\r\n" + b"Body text"
@@ -106,3 +112,83 @@ class TestBrowserRequest(unittest.TestCase):
     content = URL(url).request()
 
     self.assertEqual(content, 'Body text')
+
+
+@patch('sys.stdout', new_callable=io.StringIO)
+class TestConnectionPool(unittest.TestCase):
+  def setUp(self):
+    self.socket_patch = socket.patch()
+    self.socket_patch.start()
+    self.pool = ConnectionPool(idle_timeout=30)
+    self.pool_patch = patch('url.pool', self.pool)
+    self.pool_patch.start()
+
+  def tearDown(self):
+    self.pool_patch.stop()
+    self.socket_patch.stop()
+
+  def test_pool_reuses_keep_alive(self, mock_stdout):
+    url1 = "http://pool.test/one.html"
+    url2 = "http://pool.test/two.html"
+    socket.respond(url1, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 3\r\n\r\n" + b"one")
+    socket.respond(url2, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 3\r\n\r\n" + b"two")
+
+    self.assertEqual(URL(url1).request(), "one")
+    self.assertEqual(URL(url2).request(), "two")
+    self.assertEqual(mock_stdout.getvalue().count("New socket opened!"), 1)
+    self.assertEqual(self.pool.stats(), {"hits": 1, "misses": 1, "idle": 1, "active": 0})
+
+  def test_pool_closes_unframed(self, mock_stdout):
+    url = "http://pool.test/unframed.html"
+    socket.respond(url, b"HTTP/1.0 200 OK\r\n" + b"Header1: Value1\r\n\r\n" + b"Body text")
+
+    URL(url).request()
+    URL(url).request()
+
+    self.assertEqual(mock_stdout.getvalue().count("New socket opened!"), 2)
+    self.assertEqual(self.pool.stats()["idle"], 0)
+
+  def test_pool_connection_close(self, mock_stdout):
+    url = "http://pool.test/close.html"
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 4\r\nConnection: close\r\n\r\n" + b"Body")
+
+    URL(url).request()
+
+    self.assertEqual(self.pool.stats()["idle"], 0)
+
+  def test_pool_drops_stale_socket(self, mock_stdout):
+    url = "http://pool.test/stale.html"
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 4\r\n\r\n" + b"Body")
+
+    URL(url).request()
+    # The server hangs up on the idle connection
+    self.pool.idle[("pool.test", 80)][0].socket.close()
+    self.assertEqual(URL(url).request(), "Body")
+
+    self.assertEqual(mock_stdout.getvalue().count("New socket opened!"), 2)
+    self.assertEqual(self.pool.hits, 0)
+
+  def test_pool_retries_failed_reuse(self, mock_stdout):
+    url = "http://pool.test/retry.html"
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 4\r\n\r\n" + b"Body")
+
+    URL(url).request()
+    stale = self.pool.idle[("pool.test", 80)][0].socket
+    # Looks alive when peeked at, but the server closes it as the request goes out
+    stale.makefile = lambda *args, **kwargs: io.BytesIO(b"")
+    self.assertEqual(URL(url).request(), "Body")
+
+    self.assertIn("Stale socket, retrying", mock_stdout.getvalue())
+    self.assertFalse(stale.connected)
+
+  def test_pool_evicts_idle(self, mock_stdout):
+    self.pool.idle_timeout = 0
+    url = "http://pool.test/idle.html"
+    socket.respond(url, b"HTTP/1.1 200 OK\r\n" + b"Content-Length: 4\r\n\r\n" + b"Body")
+
+    URL(url).request()
+    idle = self.pool.idle[("pool.test", 80)][0].socket
+    self.pool.evict_idle()
+
+    self.assertFalse(idle.connected)
+    self.assertEqual(self.pool.stats()["idle"], 0)
@@ -15,6 +15,15 @@ class socket:
   def fileno(self):
     return self.file_num
 
+  def setblocking(self, flag):
+    pass
+
+  def recv(self, bufsize, flags=0):
+    # An open fake socket never has unread data waiting, so it looks like a live idle connection
+    if self.connected:
+      raise BlockingIOError()
+    return b""
+
   def connect(self, host_port):
     self.scheme = "http"
     self.host, self.port = host_port
@@ -60,9 +69,14 @@ class socket:
   def close(self):
     self.connected = False
 
+  @staticmethod
+  def getaddrinfo(host, port, *args, **kwargs):
+    # Hand the hostname back as the address, so connect() still knows which fake URL it is talking to
+    return [(2, 1, 6, '', (host, port))]
+
   @classmethod
   def patch(cls):
-    return mock.patch("socket.socket", wraps=cls)
+    return mock.patch.multiple("socket", socket=mock.MagicMock(wraps=cls), getaddrinfo=cls.getaddrinfo)
 
   @classmethod
   def respond(cls, url, response, method="GET", body=None):
@@ -101,7 +115,7 @@ class socket:
 
 
 class ssl:
-  def wrap_socket(self, s, server_hostname):
+  def wrap_socket(self, s, server_hostname, session=None):
     assert s.host == server_hostname
     s.scheme = "https"
     return s
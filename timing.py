@@ -0,0 +1,101 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Phases in the order a request goes through them
+PHASES = ['dns', 'connect', 'tls', 'write', 'ttfb', 'transfer', 'decompress']
+
+
+class RequestTiming:
+  # One record per request. Phase times are exclusive: when one measured phase runs inside another, as the
+  # network reads do inside decompression, its time only counts towards the inner phase.
+  def __init__(self, url: str):
+    self.url = url
+    self.started = time.time()
+    self.start = time.perf_counter()
+    self.phases = {}
+    # Elapsed time of nested phases, one accumulator per phase currently running
+    self.nested = []
+    self.reused = None
+    # Whether the TLS handshake resumed a saved session, or None when there was no handshake
+    self.tls_resumed = None
+    # 'hit', 'miss' or 'revalidated'
+    self.cache = None
+    self.status = None
+    self.error = None
+    self.duration = None
+
+  def add(self, phase, elapsed):
+    children = self.nested.pop()
+    self.phases[phase] = self.phases.get(phase, 0) + elapsed - children
+    if self.nested:
+      self.nested[-1] += elapsed
+
+  @contextmanager
+  def measure(self, phase):
+    self.nested.append(0.0)
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add(phase, time.perf_counter() - start)
+
+  def timed(self, phase, iterable):
+    # Only the time spent producing each item counts, not the time the consumer spends on it
+    iterator = iter(iterable)
+    while True:
+      self.nested.append(0.0)
+      start = time.perf_counter()
+      try:
+        item = next(iterator)
+      except StopIteration:
+        return
+      finally:
+        self.add(phase, time.perf_counter() - start)
+      yield item
+
+  def finish(self, error=None):
+    if self.duration is not None:
+      return
+    self.error = error
+    self.duration = time.perf_counter() - self.start
+    observers.publish(self)
+
+  def as_dict(self):
+    return {"url": self.url, "started": self.started, "duration": self.duration, "status": self.status,
+            "cache": self.cache, "reused": self.reused, "tls_resumed": self.tls_resumed,
+            "error": None if self.error is None else str(self.error),
+            **{phase: self.phases.get(phase) for phase in PHASES}}
+
+
+class TimingObservers:
+  # Anything interested in request timings subscribes a callback, which is called with every finished
+  # RequestTiming. Requests finish on whichever thread made them, so callbacks must be thread safe.
+  def __init__(self):
+    self.callbacks = []
+    self.lock = threading.Lock()
+
+  def subscribe(self, callback):
+    with self.lock:
+      self.callbacks = self.callbacks + [callback]
+
+  def unsubscribe(self, callback):
+    with self.lock:
+      self.callbacks = [c for c in self.callbacks if c != callback]
+
+  def publish(self, record):
+    for callback in self.callbacks:
+      callback(record)
+
+  @contextmanager
+  def collect(self):
+    # Gathers every record finished inside the with block into a list
+    records = []
+    self.subscribe(records.append)
+    try:
+      yield records
+    finally:
+      self.unsubscribe(records.append)
+
+
+observers = TimingObservers()
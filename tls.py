@@ -0,0 +1,57 @@
+import ssl
+import threading
+
+
+class TLSConfig:
+  # One SSLContext for the whole process, so the CA store is only loaded once, plus the most recent session
+  # each origin handed out, so reconnecting can resume it instead of doing a full handshake
+  def __init__(self, cafile=None):
+    self.cafile = cafile
+    self.ctx = None
+    # (host, port) -> ssl.SSLSession
+    self.sessions = {}
+    self.lock = threading.Lock()
+    self.resumed = 0
+    self.full = 0
+
+  def context(self):
+    with self.lock:
+      if self.ctx is None:
+        self.ctx = ssl.create_default_context()
+        if self.cafile:
+          self.ctx.load_verify_locations(self.cafile)
+      return self.ctx
+
+  def stats(self):
+    with self.lock:
+      return {"resumed": self.resumed, "full": self.full, "sessions": len(self.sessions)}
+
+  def wrap(self, s, host, port):
+    # Returns the wrapped socket and whether the handshake resumed an earlier session
+    with self.lock:
+      session = self.sessions.get((host, port))
+    s = self.context().wrap_socket(s, server_hostname=host, session=session)
+    resumed = bool(getattr(s, 'session_reused', False))
+    with self.lock:
+      if resumed:
+        self.resumed += 1
+      else:
+        self.full += 1
+    self.remember(host, port, s)
+    return s, resumed
+
+  def remember(self, host, port, s):
+    # TLS 1.3 servers send their session tickets after the handshake, so this is called again once a
+    # response has been read to pick up a session that can actually be resumed
+    session = getattr(s, 'session', None)
+    if session is not None:
+      with self.lock:
+        self.sessions[(host, port)] = session
+
+  def forget(self, host, port):
+    with self.lock:
+      self.sessions.pop((host, port), None)
+
+  def clear(self):
+    with self.lock:
+      self.sessions = {}
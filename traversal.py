@@ -0,0 +1,41 @@
+ENTER = True
+EXIT = False
+
+
+# Tree walks with an explicit stack instead of recursion, so a document nested thousands of levels deep costs
+# nothing more than a wide one. They work on anything with a children sequence: DOM nodes, layout objects.
+# A node's children are only read after the node itself has been yielded, so the caller may still fill them in
+# (layout creates its child boxes as it reaches each one).
+
+def pre_order(root):
+  stack = [root]
+  while stack:
+    node = stack.pop()
+    yield node
+    stack.extend(reversed(node.children))
+
+
+def post_order(root):
+  for node, entering in enter_exit(root):
+    if not entering:
+      yield node
+
+
+def enter_exit(root):
+  # Yields (node, ENTER) before a node's descendants and (node, EXIT) after them
+  stack = [(root, ENTER)]
+  while stack:
+    node, entering = stack.pop()
+    yield node, entering
+    if entering:
+      stack.append((node, EXIT))
+      stack.extend((child, ENTER) for child in reversed(node.children))
+
+
+def with_depth(root):
+  # Pre-order, yielding (node, depth) with the root at depth 0
+  stack = [(root, 0)]
+  while stack:
+    node, depth = stack.pop()
+    yield node, depth
+    stack.extend((child, depth + 1) for child in reversed(node.children))
@@ -1,18 +1,60 @@
 import socket
-import ssl
-import re
-import datetime
-import gzip
+import time
 
-sockets = {}
-cache = {}
+from connection_pool import ConnectionPool
+from file_loader import FileCache
+from http_cache import HTTPCache
+from http_body import iter_framed, iter_decoded, has_body
+from resolver import Resolver
+from timing import RequestTiming
+from tls import TLSConfig
+
+pool = ConnectionPool()
+cache = HTTPCache()
+resolver = Resolver()
+files = FileCache()
+tls = TLSConfig()
 MAX_REDIRECTS = 3
 
 
+def parse_header(line: str):
+  header, value = line.split(":", 1)
+  return header.casefold(), value.strip()
+
+
+def read_headers(raw_response):
+  response_headers = {}
+  while True:
+    line = raw_response.readline().decode(encoding='utf-8')
+    if line in ['\r\n', '']:
+      break
+    header, value = parse_header(line)
+    response_headers[header] = value
+  return response_headers
+
+
+def keep_alive(version: str, response_headers, status=None):
+  # Only a response with explicit framing, or none to read, leaves the socket positioned at the start of the
+  # next response
+  connection = response_headers.get('connection', '').casefold()
+  if connection == 'close':
+    return False
+  if version == 'HTTP/1.0' and connection != 'keep-alive':
+    return False
+  return (not has_body(status) or 'content-length' in response_headers
+          or response_headers.get('transfer-encoding') == 'chunked')
+
+
+def decode_content(content: bytes, response_headers):
+  return ''.join(iter_decoded([content], response_headers))
+
+
 class URL:
   def __init__(self, url: str):
     self.view_source = False
     self.is_malformed = False
+    # Seconds a socket operation for this URL may block before giving up, or None to wait as long as it takes
+    self.timeout = None
     try:
       if url.startswith('data:'):
         self.scheme, url = url.split(':', 1)
@@ -45,8 +87,6 @@ class URL:
         self.host, port = self.host.split(":", 1)
         self.port = int(port)
 
-      self.socket = sockets.get((self.host, self.port), None)
-
     except:
       self.is_malformed = True
 
@@ -56,111 +96,198 @@ class URL:
     self.host, url = url.split('/', 1)
     self.path = '/' + url
 
-  def open_socket(self):
+  def open_socket(self, timing: RequestTiming = None):
+    timing = timing or RequestTiming(self.cache_key())
     s = socket.socket(
       family=socket.AF_INET,
       type=socket.SOCK_STREAM,
       proto=socket.IPPROTO_TCP
     )
-    s.connect((self.host, self.port))
+    if self.timeout is not None:
+      s.settimeout(self.timeout)
+    with timing.measure('dns'):
+      address = resolver.resolve(self.host, self.port)
+    with timing.measure('connect'):
+      s.connect((address, self.port))
     if self.scheme == 'https':
-      ctx = ssl.create_default_context()
-      s = ctx.wrap_socket(s, server_hostname=self.host)
+      with timing.measure('tls'):
+        s, timing.tls_resumed = tls.wrap(s, self.host, self.port)
 
     return s
 
-  def handle_http(self, num_redirects: int = 0):
-    if self.socket is None or self.socket.fileno() == -1:
-      print("New socket opened!")
-      self.socket = self.open_socket()
-    sockets[(self.host, self.port)] = self.socket
+  def cache_key(self):
+    return f"{self.scheme}://{self.host}{self.path}"
+
+  def request_headers(self):
+    return {"Host": self.host, "Accept-Encoding": "gzip, deflate", "User-Agent": "christalee"}
 
+  def request_text(self, extra_headers=()):
     r = f"GET {self.path} HTTP/1.1\r\n"
-    request_headers = '\r\n'.join([f"Host: {self.host}", "Accept-Encoding: gzip", "User-Agent: christalee"])
+    request_headers = '\r\n'.join([f"{header}: {value}" for header, value in self.request_headers().items()] +
+                                    list(extra_headers))
     r += request_headers
     r += '\r\n\r\n'
-    self.socket.send(r.encode('utf-8'))
-
-    raw_response = self.socket.makefile('rb', newline='\r\n')
-    statusline = raw_response.readline().decode(encoding='utf-8')
-    version, status, explanation = statusline.split(" ", 2)
-
-    response_headers = {}
-    while True:
-      line = raw_response.readline().decode(encoding='utf-8')
-      if line == '\r\n':
-        break
-      header, value = line.split(":", 1)
-      response_headers[header.casefold()] = value.strip()
+    return r
 
+  def redirect_url(self, status, response_headers):
     if status.startswith('3') and 'location' in response_headers:
       url = response_headers['location']
       if "://" not in url:
         url = f"{self.scheme}://{self.host}{url}"
+      return url
+    return None
+
+  def cache_response(self, entry, status, response_headers, content, request_time, response_time):
+    url = self.cache_key()
+    if status == '304' and entry:
+      print(f"Revalidated cache entry: {url}")
+      cache.refresh(entry, response_headers, request_time, response_time)
+      return entry.content()
+    entry = cache.store(url, status, response_headers, content, self.request_headers(), request_time, response_time)
+    if entry:
+      return entry.content()
+    return decode_content(content, response_headers)
+
+  def send_request(self, timing: RequestTiming, extra_headers=()):
+    # GETs are idempotent, so a pooled socket the server has quietly closed is retried once on a fresh one
+    key = (self.host, self.port)
+    while True:
+      s, reused = pool.checkout(key, lambda: self.open_socket(timing))
+      timing.reused = reused
+      if not reused:
+        print("New socket opened!")
+      elif self.timeout is not None:
+        s.settimeout(self.timeout)
+      try:
+        with timing.measure('write'):
+          s.send(self.request_text(extra_headers).encode('utf-8'))
+        raw_response = s.makefile('rb', newline='\r\n')
+        with timing.measure('ttfb'):
+          statusline = raw_response.readline().decode(encoding='utf-8')
+        if not statusline:
+          raise ConnectionError(f"connection to {self.host} closed before response")
+        return s, raw_response, statusline
+      except OSError:
+        pool.discard(key, s)
+        if not reused:
+          raise
+        print("Stale socket, retrying")
+
+  def read_body(self, s, raw_response, version, status, response_headers):
+    # The socket only goes back to the pool once the whole body has been read off it
+    key = (self.host, self.port)
+    finished = False
+    try:
+      yield from iter_framed(raw_response, response_headers, status=status)
+      finished = True
+    finally:
+      raw_response.close()
+      if self.scheme == 'https':
+        tls.remember(self.host, self.port, s)
+      if finished and keep_alive(version, response_headers, status):
+        if self.timeout is not None:
+          # The next user of the socket picks its own timeout
+          s.settimeout(None)
+        pool.checkin(key, s)
+      else:
+        pool.discard(key, s)
+
+  def stream_body(self, body, status, response_headers, request_time, timing: RequestTiming):
+    # Only keep the wire bytes when a later request could use them, and then in one growing buffer that the
+    # cache takes as it is
+    raw = bytearray() if cache.reusable(status, response_headers) else None
+
+    def chunks():
+      for chunk in body:
+        if raw is not None:
+          raw.extend(chunk)
+        yield chunk
+
+    try:
+      yield from timing.timed('decompress', iter_decoded(chunks(), response_headers))
+    except Exception as e:
+      timing.finish(e)
+      raise
+    if raw is None:
+      # Whatever was cached before is out of date either way
+      cache.forget(self.cache_key())
+    else:
+      cache.store(self.cache_key(), status, response_headers, raw, self.request_headers(), request_time,
+                  time.time())
+    timing.finish()
+
+  def handle_response(self, entry, status, response_headers, body, request_time, timing: RequestTiming,
+                      num_redirects: int = 0):
+    timing.status = status
+    url = self.redirect_url(status, response_headers)
+    if url:
+      # Nobody reads a redirect's body, but it has to come off the socket before the socket can be reused
+      for _ in body:
+        pass
+      timing.finish()
       if num_redirects < MAX_REDIRECTS:
         print(f"Redirecting to: {url}")
-        return URL(url).request(num_redirects + 1)
+        return URL(url).stream(num_redirects + 1)
       else:
         print(f"Too many redirects, sorry")
         return None
 
-    url = f"{self.scheme}://{self.host}{self.path}"
-    cache_control = ''
-    if 'cache-control' in response_headers and status == '200':
-      cache_control = response_headers['cache-control']
-      if 'max-age' in cache_control:
-        m = re.search(r'max-age=(\d*)', cache_control)
-        if m and url in cache:
-          max_age = int(m.group(1))
-          timestamp_content = cache[url]
-          content_age = datetime.datetime.now() - timestamp_content['timestamp']
-          if content_age.total_seconds() < max_age:
-            print(f"Returning content from cache: {url}")
-            return timestamp_content['content']
-
-    if 'content-length' in response_headers:
-      content_length = int(response_headers['content-length'])
-    else:
-      content_length = -1
-
-    if 'transfer-encoding' in response_headers and response_headers['transfer-encoding'] == 'chunked':
-      content = b''
-      while True:
-        size = raw_response.readline().strip().decode(encoding='utf-8')
-        if size == '0' or not size:
-          raw_response.readline()
-          break
-        else:
-          length = int(size, 16)
-        line = raw_response.read(length)
-        # need to read past \r\n
-        raw_response.read(2)
-        content += line
-    else:
-      content = raw_response.read(content_length)
+    if status == '304' and entry:
+      for _ in body:
+        pass
+      print(f"Revalidated cache entry: {self.cache_key()}")
+      cache.refresh(entry, response_headers, request_time, time.time())
+      timing.cache = 'revalidated'
+      timing.finish()
+      return iter([entry.content()])
 
-    if 'content-encoding' in response_headers and response_headers['content-encoding'] == 'gzip':
-      content = gzip.decompress(content)
+    return self.stream_body(body, status, response_headers, request_time, timing)
 
-    content = content.decode(encoding='utf-8')
-    raw_response.close()
+  def handle_http(self, num_redirects: int = 0):
+    # Fresh entries are served without touching the network; stale ones are revalidated
+    timing = RequestTiming(self.cache_key())
+    entry = cache.lookup(self.cache_key(), self.request_headers())
+    if entry and entry.is_fresh():
+      print(f"Returning content from cache: {self.cache_key()}")
+      timing.cache = 'hit'
+      timing.finish()
+      return iter([entry.content()])
 
-    if 'no-store' not in cache_control:
-      cache[url] = {'timestamp': datetime.datetime.now(), 'content': content}
+    timing.cache = 'miss'
+    request_time = time.time()
+    try:
+      s, raw_response, statusline = self.send_request(timing, entry.validators() if entry else [])
+    except Exception as e:
+      timing.finish(e)
+      raise
+    try:
+      version, status, explanation = statusline.split(" ", 2)
+      response_headers = read_headers(raw_response)
+    except Exception as e:
+      pool.discard((self.host, self.port), s)
+      timing.finish(e)
+      raise
 
-    return content
+    body = timing.timed('transfer', self.read_body(s, raw_response, version, status, response_headers))
+    return self.handle_response(entry, status, response_headers, body, request_time, timing, num_redirects)
 
-  def request(self, num_redirects: int = 0):
+  def stream(self, num_redirects: int = 0):
+    # Returns an iterator over the body's text, or None if there is no body to show
     if self.is_malformed:
       return None
     elif self.scheme == 'file':
-      with open(self.path, 'r', encoding="utf-8") as f:
-        return f.read()
-    if self.scheme == "data" and self.host == "text/html":
-      return self.path
-    if self.scheme == 'http' or 'https':
+      return files.stream(self.path)
+    elif self.scheme == "data":
+      return iter([self.path]) if self.host == "text/html" else None
+    else:
       return self.handle_http(num_redirects)
 
+  def request(self, num_redirects: int = 0):
+    body = self.stream(num_redirects)
+    if body is None:
+      return None
+    return ''.join(body)
+
   def resolve(self, url):
     if "://" in url:
       return URL(url)
@@ -175,3 +302,100 @@ class URL:
       return URL(f"{self.scheme}:{url}")
     else:
       return URL(f"{self.scheme}://{self.host}:{str(self.port)}{url}")
+
+
+def request_serially(urls):
+  results = []
+  for url in urls:
+    try:
+      results.append(url.request())
+    except Exception as e:
+      results.append(e)
+  return results
+
+
+def request_pipelined(urls, timeout=None):
+  # Writes every request on one pooled connection before reading any response, then reads the responses
+  # back in order. All urls must share an origin. Whatever the server doesn't answer, because it closed the
+  # connection or said Connection: close, is fetched serially instead. A server that goes quiet for longer
+  # than timeout seconds fails every request it hasn't answered.
+  if timeout is not None:
+    # Each url carries the timeout, so the serial fallbacks are bounded too
+    for url in urls:
+      url.timeout = timeout
+  results = [None] * len(urls)
+  waiting = []
+  for i, url in enumerate(urls):
+    entry = cache.lookup(url.cache_key(), url.request_headers())
+    if entry and entry.is_fresh():
+      print(f"Returning content from cache: {url.cache_key()}")
+      timing = RequestTiming(url.cache_key())
+      timing.cache = 'hit'
+      timing.finish()
+      results[i] = entry.content()
+    else:
+      waiting.append((i, url, entry))
+  if len(waiting) < 2:
+    for (i, url, entry), result in zip(waiting, request_serially([url for i, url, entry in waiting])):
+      results[i] = result
+    return results
+
+  # Connection setup is charged to the first request; the rest only wait on their own responses
+  timings = [RequestTiming(url.cache_key()) for i, url, entry in waiting]
+  first = waiting[0][1]
+  key = (first.host, first.port)
+  s, reused = pool.checkout(key, lambda: first.open_socket(timings[0]))
+  if not reused:
+    print("New socket opened!")
+  elif timeout is not None:
+    s.settimeout(timeout)
+  answered = 0
+  reusable = False
+  try:
+    request_time = time.time()
+    for (i, url, entry), timing in zip(waiting, timings):
+      timing.reused = reused or timing is not timings[0]
+      timing.cache = 'miss'
+      with timing.measure('write'):
+        s.send(url.request_text(entry.validators() if entry else []).encode('utf-8'))
+    raw_response = s.makefile('rb', newline='\r\n')
+    for (i, url, entry), timing in zip(waiting, timings):
+      with timing.measure('ttfb'):
+        statusline = raw_response.readline().decode(encoding='utf-8')
+      if not statusline:
+        break
+      version, status, explanation = statusline.split(" ", 2)
+      response_headers = read_headers(raw_response)
+      body = timing.timed('transfer', iter_framed(raw_response, response_headers, status=status))
+      body = url.handle_response(entry, status, response_headers, body, request_time, timing)
+      results[i] = None if body is None else ''.join(body)
+      answered += 1
+      reusable = keep_alive(version, response_headers, status)
+      if not reusable:
+        break
+    raw_response.close()
+  except TimeoutError as e:
+    # Asking the same server again one by one would only wait out the timeout once per request
+    print(f"Pipelining to {first.host} timed out: {e}")
+    reusable = False
+    for (i, url, entry), timing in zip(waiting[answered:], timings[answered:]):
+      timing.finish(e)
+      results[i] = e
+    answered = len(waiting)
+  except (OSError, ValueError) as e:
+    print(f"Pipelining to {first.host} failed, falling back to serial requests: {e}")
+    reusable = False
+  finally:
+    if first.scheme == 'https':
+      tls.remember(first.host, first.port, s)
+    if reusable and answered == len(waiting):
+      if timeout is not None:
+        s.settimeout(None)
+      pool.checkin(key, s)
+    else:
+      pool.discard(key, s)
+
+  rest = waiting[answered:]
+  for (i, url, entry), result in zip(rest, request_serially([url for i, url, entry in rest])):
+    results[i] = result
+  return results